@@ -1,7 +1,13 @@
+from utils.import_profile import import_profiler
+
+import_profiler.install()  # before the other imports, so they show up in the import time report
+
 import asyncio
+import io
 import logging
 import logging.handlers
 import os
+import re
 import sys
 
 import discord
@@ -10,17 +16,121 @@ import typing
 from discord.ext import commands
 
 from config.config import Bot as config
+from config.config import Metrics as metrics_config
 from config.config import Timeouts
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+from db_classes.write_buffer import flush_all as flush_write_buffers
+from config.config import LoopMonitor as loop_config
+from config.config import Recorder as recorder_config
+from utils import metrics
+from utils.event_loop import install_uvloop, loop_name
+from utils.event_recorder import Anonymiser, EventRecorder
+from utils.guild_state import forget_guild
+from utils.intents import describe as describe_intents, required_intents
+from utils.log_queue import DebugSampler, QueueLogging
+from utils.message_pipeline import MessagePipeline
+from utils.loop_monitor import loop_monitor
+from utils.member_loader import MemberLoader
+from utils.metrics_server import install_ratelimit_recorder, start_metrics_server
+from utils.perf import instrument_http, perf
+from utils.process_pool import process_pool
+from utils.scheduler import scheduler
+from utils.sharding import ShardAssignment
+from utils.startup import Startup
+from utils.waiters import ReactionWaiters
+
+intents = required_intents(config.extensions, config.extra_intents)
+if config.member_loading not in ("startup", "lazy"):
+    raise ValueError(f"MemberLoading must be startup or lazy, not {config.member_loading}")
+lazy_members = config.member_loading == "lazy"
+
+# set by launcher.py for its worker processes
+shard_assignment = ShardAssignment.from_env()
+
+
+class RefereeBot(commands.Bot):
+
+    def __init__(self, *args, lazy_members: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.member_loader = MemberLoader(self.intents, lazy=lazy_members)
+        self.message_pipeline = MessagePipeline(self)
+        self.reaction_waiters = ReactionWaiters()
+        self.startup = Startup()
+        self.recorder: typing.Optional[EventRecorder] = None
+
+    def dispatch(self, event_name, *args, **kwargs):
+        metrics.events.inc(event_name)
+        if event_name == "socket_response" and self.recorder is not None:
+            self.recorder.record(args[0])
+        if event_name == "raw_reaction_add":
+            self.reaction_waiters.resolve(args[0])
+        for listener in self.extra_events.get(f"on_{event_name}", ()):
+            metrics.listener_calls.inc(getattr(listener, "__qualname__", event_name))
+        super().dispatch(event_name, *args, **kwargs)
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        name = f"{event_name}:{getattr(coro, '__qualname__', coro)}"
+        task = super()._schedule_event(perf.wrap(name, coro), event_name, *args, **kwargs)
+        # lets the loop monitor tell which listener blocked the loop
+        task.set_name(name)
+        return task
+
+    async def on_message(self, message: discord.Message):
+        # cogs subscribe to the pipeline instead of listening to on_message themselves
+        self.message_pipeline.dispatch(message)
+        await self.process_commands(message)
+
+    async def invoke(self, ctx: commands.Context):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        with perf.span(f"command:{ctx.command.qualified_name}") as span:
+            await super().invoke(ctx)
+            # errors are handled inside invoke and never reach the span
+            span.failed = ctx.command_failed
+
+    async def close(self):
+        process_pool.shutdown()
+        # before the pool goes away with the loop, buffered rows would be lost otherwise
+        await flush_write_buffers()
+        await super().close()
+
+
+class ShardedRefereeBot(RefereeBot, commands.AutoShardedBot):
+    """
+    The bot of a launcher worker, connected to the shards assigned to it
+    """
 
-intents = discord.Intents.default()
-intents.members = True
-intents.presences = True
 
-bot = commands.Bot(command_prefix=config.commandPrefixes,
-                   case_insensitive=True,
-                   pm_help=None,
-                   activity=discord.Game(name=config.status),
-                   intents=intents)
+# the bot creates its event loop, so the policy has to be set before
+uvloop_installed = install_uvloop() if config.uvloop else False
+
+if shard_assignment is not None:
+    bot_class = ShardedRefereeBot
+    shard_options = {"shard_ids": list(shard_assignment.shard_ids), "shard_count": shard_assignment.shard_count}
+else:
+    bot_class, shard_options = RefereeBot, {}
+
+bot = bot_class(command_prefix=config.commandPrefixes,
+                case_insensitive=True,
+                pm_help=None,
+                activity=discord.Game(name=config.status),
+                intents=intents,
+                chunk_guilds_at_startup=intents.members and not lazy_members,
+                member_cache_flags=discord.MemberCacheFlags.from_intents(intents),
+                max_messages=config.max_messages or None,
+                lazy_members=lazy_members,
+                **shard_options)
+
+metrics.registry.gauge("gateway_latency_seconds", "Latency between heartbeat and heartbeat acknowledgement",
+                       callback=lambda: [((), bot.latency)])
+metrics.registry.gauge("guild_members", "Members per guild", ["guild"],
+                       callback=lambda: [((g.name,), g.member_count) for g in bot.guilds])
+metrics.registry.gauge("guild_cached_members", "Cached members per guild", ["guild"],
+                       callback=lambda: [((g.name,), len(g.members)) for g in bot.guilds])
+if shard_assignment is not None:
+    metrics.registry.gauge("shard_latency_seconds", "Heartbeat latency per shard of this worker", ["shard"],
+                           callback=lambda: [((str(shard_id),), latency) for shard_id, latency in bot.latencies])
 
 
 def setup_logger() -> logging.Logger:
@@ -39,13 +149,17 @@ def setup_logger() -> logging.Logger:
     stdout_handler = logging.StreamHandler(sys.stdout)
     stdout_handler.setFormatter(ref_format)
 
+    # workers of the launcher rotate their own files
+    filename = f"logs/ref-worker{shard_assignment.worker}.log" if shard_assignment else "logs/ref.log"
     fhandler = logging.handlers.RotatingFileHandler(
-        filename='logs/ref.log', encoding='utf-8', mode='a',
+        filename=filename, encoding='utf-8', mode='a',
         maxBytes=10 ** 7, backupCount=5)
     fhandler.setFormatter(ref_format)
 
-    logger.addHandler(fhandler)
-    logger.addHandler(stdout_handler)
+    # the handlers run in a background thread, logging calls only enqueue the record
+    queue_logging = QueueLogging(logger, [fhandler, stdout_handler])
+    queue_logging.handler.addFilter(DebugSampler(config.debug_sample_rate))
+    queue_logging.start()
     return logger
 
 
@@ -53,39 +167,127 @@ def main():
     """
     Main function, loads extension and starts the bot
     """
+    if config.uvloop and not uvloop_installed:
+        logger.warning("Uvloop is enabled but not installed, using the asyncio event loop")
+    logger.info(f"Event loop: {loop_name(bot.loop)}")
+    logger.info(f"Intents: {describe_intents(intents)}, member loading: {config.member_loading}")
+    if shard_assignment is not None:
+        logger.info(f"Running as {shard_assignment.name}")
     for ext in config.extensions:
+        start = timeit.default_timer()
         bot.load_extension(f"extensions.{ext}")
-        logger.info(f"Loaded {ext}")
+        logger.info(f"Loaded {ext} in {timeit.default_timer() - start:.3f}s")
     bot.help_command = commands.DefaultHelpCommand(no_category="Core")
+    instrument_http(bot.http)
+    install_ratelimit_recorder()
+    # runs while the bot logs in, queries issued before a schema is set up wait for it
+    bot.loop.create_task(pg_pool.init_backends())
+    if metrics_config.enabled:
+        # the launcher serves the configured port and collects the metrics of its workers from theirs
+        port = shard_assignment.metrics_port if shard_assignment else metrics_config.port
+        bot.loop.create_task(start_metrics_server(metrics_config.host, port))
+    if loop_config.enabled:
+        loop_monitor.start(bot.loop)
+    if recorder_config.enabled:
+        start_recorder()
 
     bot.run(config.token)
 
 
+def start_recorder():
+    """
+    Starts recording gateway events. Anonymised recordings keep the words
+    the bot reacts to, so commands and thanks still work when they are replayed
+    """
+    anonymiser = None
+    if recorder_config.anonymise:
+        keep_words = {"thank", "thanks", "thx", "you", "thanking", "thanker", "thanked"}
+        keep_words.update(word for prefix in config.commandPrefixes for word in re.findall(r"[^\W\d_]+", prefix))
+        for command in bot.walk_commands():
+            keep_words.add(command.name)
+            keep_words.update(command.aliases)
+        anonymiser = Anonymiser(recorder_config.salt, keep_words=keep_words)
+    path = recorder_config.path
+    if shard_assignment is not None:
+        path = os.path.join(path, f"worker{shard_assignment.worker}")
+    bot.recorder = EventRecorder(path, recorder_config.events, anonymiser=anonymiser,
+                                 max_bytes=recorder_config.max_bytes, keep=recorder_config.keep)
+    bot.recorder.start()
+
+
 @bot.event
 async def on_ready():
     """
     On_ready eventhandler, gets called by api
     """
     logger_levels = {50: "CRITICAL", 40: "ERROR", 30: "WARNING", 20: "INFO", 10: "DEBUG"}
-    logger.info("Ready!")
-    logger.info(f"Logging level: {logger_levels.get(lvl := logger.level, f'Unknown ({lvl})')}")
-    if (n := len(bot.guilds)) != 1:
-        raise Exception(f"Too wrong number of guilds: {n}\n{', '.join(g.name for g in bot.guilds)}")
+    if not bot.startup.warmed_up and len(bot.guilds) == 1 and (bot.shard_count or 1) == 1:
+        # rows from before the guild_id columns, adopted before the warm ups load them into per guild caches
+        adopted = await pg_pool.adopt_unassigned_rows(bot.guilds[0].id)
+        if any(adopted.values()):
+            logger.info(f"Assigned rows to {bot.guilds[0]}: "
+                        + ", ".join(f"{table} {n}" for table, n in adopted.items() if n))
+    if await bot.startup.on_ready():
+        logger.info(f"Serving {len(bot.guilds)} guilds"
+                    + (f" as {shard_assignment.name}" if shard_assignment else ""))
+        logger.info("Ready!")
+        logger.info(f"Logging level: {logger_levels.get(lvl := logger.level, f'Unknown ({lvl})')}")
+        if import_profiler.installed:
+            report_import_times()
+
+
+@bot.event
+async def on_resumed():
+    bot.startup.on_resumed()
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    logger.info(f"Joined {guild} ({guild.id}), serving {len(bot.guilds)} guilds")
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    forget_guild(guild.id)
+    logger.info(f"Left {guild} ({guild.id}), serving {len(bot.guilds)} guilds")
+
+
+def report_import_times():
+    """
+    Logs the time to ready and the slowest imports, writes the full import time report to the logs folder
+    """
+    import_profiler.uninstall()
+    logger.info(f"Time to ready: {timeit.default_timer() - import_profiler.started:.3f}s")
+    for name, _, cumulative, _ in import_profiler.slowest(10):
+        logger.info(f"Import {name}: {cumulative:.3f}s")
+    with open("logs/importtime.log", "w") as file:
+        file.write(import_profiler.report())
 
 
 @bot.event
 async def on_command_error(ctx: commands.Context, error: commands.CommandError):
     logger.error(f"Error in {ctx.message.content} from {ctx.author.name}#{ctx.author.discriminator}: {error}")
+    if ctx.command:
+        metrics.command_errors.inc(ctx.command.qualified_name)
+        observe_command_duration(ctx)
 
 
 @bot.event
 async def on_command(ctx: commands.Context):
+    ctx.started_at = timeit.default_timer()
     logger.info(f"STARTED: '{ctx.message.content}' from {ctx.author.name}#{ctx.author.discriminator}")
 
 
 @bot.event
 async def on_command_completion(ctx: commands.Context):
     logger.info(f"COMPLETED: '{ctx.message.content}' from {ctx.author.name}#{ctx.author.discriminator}")
+    observe_command_duration(ctx)
+
+
+def observe_command_duration(ctx: commands.Context):
+    started_at = getattr(ctx, "started_at", None)
+    if started_at is not None:
+        metrics.command_duration.observe(timeit.default_timer() - started_at, ctx.command.qualified_name)
 
 
 @bot.command(name="ping")
@@ -103,13 +305,8 @@ async def ping(ctx: commands.Context):
     await msg.edit(embed=embed)
     await msg.add_reaction(zoop)
 
-
-    def check(reaction, user):
-        return user == ctx.author and reaction.emoji == zoop
-
-
     try:
-        await bot.wait_for("reaction_add", check=check, timeout=Timeouts.long)
+        await bot.reaction_waiters.wait(msg.id, ctx.author.id, [zoop], timeout=Timeouts.long)
     except asyncio.TimeoutError:
         pass
     await msg.delete()
@@ -207,6 +404,65 @@ async def listening(ctx: commands.Context, *, activity: str):
 async def stats(ctx: commands.Context):
     embed = discord.Embed(title=f"Referee stats")
     embed.add_field(name="Loaded modules", value="\n".join(config.extensions))
+    pool_stats = pg_pool.stats()
+    pool_text = "\n".join(
+        f"{name}: {s['in_use']}/{s['quota'] or '-'} | wait {s['wait_avg'] * 1000:.1f}/{s['wait_max'] * 1000:.1f}ms"
+        f" | saturated {s['quota_saturated']}/{s['pool_saturated']}"
+        for name, s in pool_stats["extensions"].items())
+    embed.add_field(name=f"DB pool ({pool_stats['in_use']}/{pool_stats['max_size']} in use)",
+                    value=pool_text or "-", inline=False)
+    statement_text = "\n".join(f"{name}: {s['executions']}x | {s['seconds'] * 1000:.0f}ms | prepared {s['prepares']}x"
+                                for name, s in list(statements.stats().items())[:5] if s["executions"])
+    embed.add_field(name="Slowest statements", value=statement_text or "-", inline=False)
+    lag = loop_monitor.lag_percentiles()
+    loop_text = "\n".join(f"{name}: {duration * 1000:.0f}ms ({count}x)"
+                           for name, duration, count in loop_monitor.slowest_callbacks())
+    embed.add_field(name=f"Event loop lag p50 {lag['p50'] * 1000:.1f}ms | p99 {lag['p99'] * 1000:.1f}ms"
+                         f" | max {lag['max'] * 1000:.1f}ms",
+                    value=loop_text or "No slow callbacks", inline=False)
+    jobs_text = "\n".join(f"{name}: {s['runs']} runs | {s['failures']} failed | {s['skipped']} skipped"
+                           f" | p50 {s['duration_p50']:.2f}s | max {s['duration_max']:.2f}s"
+                           for name, s in scheduler.stats().items())
+    startup_text = "\n".join(f"{name}: {'-' if duration is None else f'{duration:.3f}s'}"
+                              for name, duration in bot.startup.timings().items())
+    embed.add_field(name=f"Warm up ({bot.startup.ready_count} ready, {bot.startup.resumed_count} resumed)",
+                    value=startup_text or "-", inline=False)
+    embed.add_field(name=f"Scheduled jobs ({scheduler.pending} timers pending)", value=jobs_text or "-", inline=False)
+    await ctx.send(embed=embed)
+
+
+@bot.command(name="perf", hidden=True)
+@can_kick()
+async def perf_stats(ctx: commands.Context, action: str = None):
+    """
+    Shows the listeners and commands that took the most time, with their share of db and Discord API time,
+    or the ones that made the most Discord API requests
+    Usage: r!perf [http|json|reset]
+    """
+    if action == "json":
+        await ctx.send(file=discord.File(io.BytesIO(perf.dump_json().encode()), filename="perf.json"))
+        return
+    if action == "http":
+        embed = discord.Embed(title="Referee Discord API requests")
+        for source, route, s in perf.top_http(10):
+            embed.add_field(name=f"{source}: {route}",
+                            value=f"{s['count']}x ({s['failed']} failed) | {s['time']:.2f}s"
+                                  f" | {s['bytes_sent'] / 1024:.1f}/{s['bytes_received'] / 1024:.1f}KiB sent/received"
+                                  f" | rate limited {s['ratelimited']}x for {s['ratelimit_wait']:.2f}s",
+                            inline=False)
+        await ctx.send(embed=embed)
+        return
+    if action == "reset":
+        perf.reset()
+        await ctx.send("Reset timings", delete_after=5)
+        return
+    embed = discord.Embed(title="Referee timings (p50/p99 in ms)")
+    for name, s in perf.top(10):
+        embed.add_field(name=f"{name} ({s['calls']}x, {s['errors']} failed)",
+                        value=f"wall {s['wall_p50'] * 1000:.1f}/{s['wall_p99'] * 1000:.1f}"
+                              f" | db {s['db_p50'] * 1000:.1f}/{s['db_p99'] * 1000:.1f}"
+                              f" | api {s['api_p50'] * 1000:.1f}/{s['api_p99'] * 1000:.1f}",
+                        inline=False)
     await ctx.send(embed=embed)
 
 
@@ -0,0 +1,104 @@
+"""
+Compares the asyncio and the uvloop event loop: message and reaction dispatch throughput of the bot on a fake guild,
+and round trip latency of asyncpg queries if a postgres server is configured.
+Every loop is measured in a fresh process, since the bot binds its loop when it is created.
+
+    python -m benchmarks.event_loop [--events 20000] [--queries 2000]
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+LOOPS = ("asyncio", "uvloop")
+
+
+async def query_latency(queries: int) -> dict:
+    import asyncpg
+    from config.config import PostGres as pg_config
+    from utils.metrics import Samples
+
+    con = await asyncpg.connect(host=pg_config.PG_Host, database=pg_config.PG_Database, user=pg_config.PG_User,
+                                password=pg_config.PG_Password, timeout=5)
+    samples = Samples(queries)
+    try:
+        for _ in range(queries):
+            start = time.perf_counter()
+            await con.fetchval("SELECT 1")
+            samples.add(time.perf_counter() - start)
+    finally:
+        await con.close()
+    return {"query_p50_ms": samples.percentile(50) * 1000, "query_p99_ms": samples.percentile(99) * 1000}
+
+
+async def measure(bot, args) -> dict:
+    from benchmarks import throughput
+
+    harness, generator = await throughput.start(bot, args.members, weights={"chat": 50, "thanks": 10, "reaction": 40})
+    result = await harness.run(generator.events(args.events))
+    throughput.stop(harness)
+    listeners = harness.summary().values()
+    measured = {
+        "events_per_second": result["events_per_second"],
+        "listener_p99_ms": max((s["wall_p99"] for s in listeners), default=0.0) * 1000,
+    }
+    if args.queries:
+        try:
+            measured.update(await query_latency(args.queries))
+        except (OSError, asyncio.TimeoutError, ImportError) as e:
+            print(f"Skipping asyncpg round trips: {e}", file=sys.stderr)
+    return measured
+
+
+def child(args):
+    if args.loop == "uvloop":
+        from utils.event_loop import install_uvloop
+        if not install_uvloop():
+            print(json.dumps({"error": "uvloop is not installed"}))
+            return
+    from benchmarks import throughput
+    from utils.event_loop import loop_name
+
+    throughput.load_extensions(args.extensions)
+    bot = throughput.Referee.bot
+    measured = bot.loop.run_until_complete(measure(bot, args))
+    print(json.dumps(dict(measured, loop=loop_name(bot.loop))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=10_000, help="Members of the fake guild")
+    parser.add_argument("--events", type=int, default=20_000, help="Messages and reactions to dispatch")
+    parser.add_argument("--queries", type=int, default=2_000, help="asyncpg round trips, 0 to skip")
+    parser.add_argument("--extensions", nargs="*", default=["reputation", "ranks", "rolegroups", "autoreactions"],
+                        help="Extensions to load")
+    parser.add_argument("--loop", choices=LOOPS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.loop:
+        return child(args)
+
+    results = {}
+    for loop in LOOPS:
+        out = subprocess.run([sys.executable, "-m", "benchmarks.event_loop", "--loop", loop,
+                              "--members", str(args.members), "--events", str(args.events),
+                              "--queries", str(args.queries), "--extensions", *args.extensions],
+                             capture_output=True, text=True)
+        lines = out.stdout.strip().splitlines()
+        try:
+            results[loop] = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            results[loop] = {"error": (out.stderr.strip().splitlines() or ["no output"])[-1]}
+
+    print(f"{'loop':<10}{'events/s':>12}{'listener p99 ms':>18}{'query p50 ms':>15}{'query p99 ms':>15}")
+    for loop, r in results.items():
+        if "error" in r:
+            print(f"{loop:<10}  {r['error']}")
+            continue
+        print(f"{loop:<10}{r['events_per_second']:>12.0f}{r['listener_p99_ms']:>18.2f}"
+              f"{r.get('query_p50_ms', float('nan')):>15.3f}{r.get('query_p99_ms', float('nan')):>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Runs the real bot against a fake gateway and a fake Discord API.
+Gateway events are fed to the parsers of discord.py's connection state as if they came from the websocket,
+REST calls are answered locally and recorded instead of being sent to Discord.
+Listener and command latency comes from the perf recorder the bot already uses in production
+"""
+import asyncio
+import itertools
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import discord
+
+from utils.perf import current_span, instrument_http, perf
+
+DISCORD_EPOCH = 1420070400000
+
+# (seconds since the start, gateway event name, payload), the format of recordings as well
+Event = Tuple[float, str, dict]
+
+# the intent without which Discord doesn't send an event, for events whose intent the bot may not have
+EVENT_INTENTS = {
+    "PRESENCE_UPDATE": "presences",
+    "GUILD_MEMBER_ADD": "members",
+    "GUILD_MEMBER_UPDATE": "members",
+    "GUILD_MEMBER_REMOVE": "members",
+    "TYPING_START": "guild_typing",
+    "VOICE_STATE_UPDATE": "voice_states",
+}
+
+_ids = itertools.count()
+
+
+def snowflake() -> int:
+    """
+    A unique snowflake for the current time
+    """
+    return ((int(time.time() * 1000) - DISCORD_EPOCH) << 22) + (next(_ids) % (1 << 22))
+
+
+def user_payload(user_id: int, bot: bool = False) -> dict:
+    return {"id": str(user_id), "username": f"user{user_id % 100000}", "discriminator": f"{user_id % 10000:04}",
+            "avatar": None, "bot": bot}
+
+
+def member_payload(user_id: int, roles: Sequence[int] = (), joined_at: str = None) -> dict:
+    return {"user": user_payload(user_id), "roles": [str(r) for r in roles], "deaf": False, "mute": False,
+            "joined_at": joined_at or datetime.now(timezone.utc).isoformat()}
+
+
+def message_payload(message_id: int, channel_id: int, author: dict, content: str = "", guild_id: int = None,
+                    mentions: Sequence[dict] = (), embeds: Sequence[dict] = ()) -> dict:
+    data = {
+        "id": str(message_id), "channel_id": str(channel_id), "author": author, "content": content,
+        "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None, "tts": False,
+        "mention_everyone": False, "mentions": list(mentions), "mention_roles": [], "attachments": [],
+        "embeds": list(embeds), "pinned": False, "type": 0,
+    }
+    if guild_id is not None:
+        data["guild_id"] = str(guild_id)
+        data["member"] = {"roles": [], "joined_at": data["timestamp"], "deaf": False, "mute": False}
+    return data
+
+
+class FakeGuild:
+    """
+    The ids of a generated guild with ``member_count`` members, and its GUILD_CREATE payload
+    """
+
+    def __init__(self, member_count: int, channel_ids: Iterable[int] = (), role_count: int = 20,
+                 guild_id: int = None, member_ids: Iterable[int] = (), seed: int = 0):
+        """
+        :param member_ids: Users that have to be members, e.g. the authors of recorded messages.
+            Random ones are added up to ``member_count``
+        """
+        rng = random.Random(seed)
+        self.id = guild_id or snowflake()
+        self.channel_ids = list(dict.fromkeys(channel_ids)) or [snowflake() for _ in range(5)]
+        self.role_ids = [snowflake() for _ in range(role_count)]
+        self.member_ids = list(dict.fromkeys(member_ids))
+        self.member_ids += [rng.randrange(10 ** 17, 10 ** 18) for _ in range(member_count - len(self.member_ids))]
+        self.rng = rng
+
+    def payload(self, bot_user_id: int, members: bool = True) -> dict:
+        """
+        :param members: Include all members, as if the bot requested them at startup.
+            Otherwise only the bot is, like in the GUILD_CREATE of a large guild without the presences intent
+        """
+        member_list = [member_payload(user_id) for user_id in self.member_ids] if members else []
+        member_list.append(member_payload(bot_user_id))
+        member_list[-1]["user"]["bot"] = True
+        return {
+            "id": str(self.id), "name": "Fake guild", "owner_id": str(self.member_ids[0]),
+            "member_count": len(self.member_ids) + 1, "large": len(self.member_ids) >= 250, "emojis": [],
+            "features": [],
+            "roles": [{"id": str(self.id), "name": "@everyone", "permissions": "0", "position": 0}]
+                     + [{"id": str(r), "name": f"role-{i}", "permissions": "0", "position": i + 1}
+                        for i, r in enumerate(self.role_ids)],
+            "channels": [{"id": str(c), "type": 0, "name": f"channel-{i}", "position": i, "permission_overwrites": []}
+                         for i, c in enumerate(self.channel_ids)],
+            "members": member_list,
+        }
+
+
+class OutboundCall:
+    __slots__ = ("method", "path", "url", "json", "source")
+
+    def __init__(self, method: str, path: str, url: str, json: Optional[dict], source: str):
+        self.method = method
+        self.path = path
+        self.url = url
+        self.json = json
+        self.source = source
+
+
+class FakeHTTP:
+    """
+    Stands in for :meth:`discord.http.HTTPClient.request`.
+    Every call is recorded, the routes the bot reads the response of get a made up one
+    """
+
+    def __init__(self, state, latency: float = 0.0, keep_calls: int = 10_000):
+        self.state = state
+        self.latency = latency
+        self.keep_calls = keep_calls
+        self.calls: List[OutboundCall] = []
+        self.routes: Counter = Counter()
+        self.responses: Dict[Tuple[str, str], Callable] = {
+            ("POST", "/channels/{channel_id}/messages"): self._sent_message,
+            ("PATCH", "/channels/{channel_id}/messages/{message_id}"): self._sent_message,
+            ("GET", "/channels/{channel_id}/messages/{message_id}"): self._sent_message,
+            ("GET", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}"): lambda route, kwargs: [],
+            ("POST", "/users/@me/channels"): self._dm_channel,
+        }
+
+    async def request(self, route, files=None, form=None, **kwargs):
+        self.routes[f"{route.method} {route.path}"] += 1
+        if len(self.calls) < self.keep_calls:
+            span = current_span.get()
+            self.calls.append(OutboundCall(route.method, route.path, route.url, kwargs.get("json"),
+                                           span.name if span else "background"))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        respond = self.responses.get((route.method, route.path))
+        return respond(route, kwargs) if respond else None
+
+    def _sent_message(self, route, kwargs) -> dict:
+        body = kwargs.get("json") or {}
+        message_id = re.search(r"/messages/(\d+)", route.url)
+        embeds = body.get("embeds") or ([body["embed"]] if body.get("embed") else [])
+        return message_payload(int(message_id.group(1)) if message_id else snowflake(), route.channel_id,
+                               user_payload(self.state.self_id, bot=True), content=body.get("content") or "",
+                               guild_id=route.guild_id, embeds=embeds)
+
+    @staticmethod
+    def _dm_channel(route, kwargs) -> dict:
+        recipient = int(kwargs["json"]["recipient_id"])
+        return {"id": str(snowflake()), "type": 1, "recipients": [user_payload(recipient)]}
+
+
+class EventGenerator:
+    """
+    Synthetic gateway traffic for a :class:`FakeGuild`: chat, thanks, commands, reactions, joins,
+    and presence updates and typing, which Discord only sends with those intents
+    """
+
+    chat = ("hello", "does anyone know how to fix this", "it works now", "lol", "what python version are you on",
+            "I tried that already but it still throws")
+
+    def __init__(self, guild: FakeGuild, commands: Sequence[str] = (), reaction_targets: Sequence[tuple] = (),
+                 weights: Dict[str, float] = None):
+        """
+        :param commands: Command invocations to mix into the messages, e.g. ``r!rep``
+        :param reaction_targets: (channel id, message id, emoji) tuples reactions are added to
+        :param weights: Relative frequency of "chat", "thanks", "command", "reaction", "join", "presence" and "typing"
+        """
+        self.guild = guild
+        self.commands = list(commands)
+        self.reaction_targets = list(reaction_targets)
+        self.weights = dict(weights or {"chat": 60, "thanks": 10, "command": 5, "reaction": 20, "join": 5})
+        if not self.commands:
+            self.weights["command"] = 0
+        if not self.reaction_targets:
+            self.weights["reaction"] = 0
+
+    def message(self, content: str, author_id: int, mentions: Sequence[int] = ()) -> dict:
+        rng = self.guild.rng
+        return message_payload(snowflake(), rng.choice(self.guild.channel_ids), user_payload(author_id), content,
+                               guild_id=self.guild.id, mentions=[user_payload(m) for m in mentions])
+
+    def reaction(self, user_id: int, channel_id: int, message_id: int, emoji: str) -> dict:
+        return {"user_id": str(user_id), "channel_id": str(channel_id), "message_id": str(message_id),
+                "guild_id": str(self.guild.id), "emoji": {"id": None, "name": emoji},
+                "member": member_payload(user_id)}
+
+    def presence(self, user_id: int) -> dict:
+        status = self.guild.rng.choice(("online", "idle", "dnd", "offline"))
+        return {"user": {"id": str(user_id)}, "guild_id": str(self.guild.id), "status": status,
+                "activities": [], "client_status": {"desktop": status}}
+
+    def typing(self, user_id: int) -> dict:
+        return {"channel_id": str(self.guild.rng.choice(self.guild.channel_ids)), "guild_id": str(self.guild.id),
+                "user_id": str(user_id), "timestamp": int(time.time()), "member": member_payload(user_id)}
+
+    def join(self) -> dict:
+        user_id = self.guild.rng.randrange(10 ** 17, 10 ** 18)
+        return dict(member_payload(user_id), guild_id=str(self.guild.id))
+
+    def next(self) -> Tuple[str, dict]:
+        rng = self.guild.rng
+        kind = rng.choices(list(self.weights), weights=list(self.weights.values()))[0]
+        author = rng.choice(self.guild.member_ids)
+        if kind == "thanks":
+            target = rng.choice(self.guild.member_ids)
+            return "MESSAGE_CREATE", self.message(f"thanks <@{target}>", author, mentions=[target])
+        if kind == "command":
+            return "MESSAGE_CREATE", self.message(rng.choice(self.commands), author)
+        if kind == "reaction":
+            return "MESSAGE_REACTION_ADD", self.reaction(author, *rng.choice(self.reaction_targets))
+        if kind == "join":
+            return "GUILD_MEMBER_ADD", self.join()
+        if kind == "presence":
+            return "PRESENCE_UPDATE", self.presence(author)
+        if kind == "typing":
+            return "TYPING_START", self.typing(author)
+        return "MESSAGE_CREATE", self.message(rng.choice(self.chat), author)
+
+    def events(self, count: int, rate: float = None) -> Iterable[Event]:
+        """
+        ``count`` events, ``rate`` per second or all at once
+        """
+        for i in range(count):
+            yield (i / rate if rate else 0.0), *self.next()
+
+
+class Harness:
+    """
+    Connects a bot to a :class:`FakeGuild` and :class:`FakeHTTP` and feeds it events
+    """
+
+    def __init__(self, bot, guild: FakeGuild, api_latency: float = 0.0):
+        self.bot = bot
+        self.guild = guild
+        self.state = bot._connection
+        self.http = FakeHTTP(self.state, latency=api_latency)
+        self.pending = set()
+        self.fed: Counter = Counter()
+        self.dropped: Counter = Counter()
+        self.unfinished = 0
+        self._schedule_event = bot._schedule_event
+        self._member_ids = set(guild.member_ids)
+
+    def _track(self, *args, **kwargs):
+        task = self._schedule_event(*args, **kwargs)
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    async def setup(self, ready_timeout: float = 60.0) -> float:
+        """
+        Logs the bot in to the fake guild and waits until every on_ready listener is done
+        :return: Seconds until ready
+        """
+        start = time.perf_counter()
+        self.bot.http.request = self.http.request
+        instrument_http(self.bot.http)
+        self.bot._schedule_event = self._track
+        # member requests are answered from the fake guild instead of the gateway
+        self.state.chunk_guild = self._chunk_guild
+        self.state.query_members = self._query_members
+        bot_id = snowflake()
+        self.state.user = discord.ClientUser(state=self.state, data=user_payload(bot_id, bot=True))
+        # with members loaded at startup the guild is complete once the bot is ready
+        self.state._add_guild_from_data(self.guild.payload(bot_id, members=self.state._chunk_guilds))
+        self.bot._ready.set()
+        self.bot.dispatch("ready")
+        await self.drain(ready_timeout)
+        return time.perf_counter() - start
+
+    def feed(self, event: str, payload: dict):
+        """
+        Hands one gateway event to discord.py, which dispatches it to the listeners.
+        Events of intents the bot doesn't have are dropped, as Discord wouldn't send them
+        """
+        intent = EVENT_INTENTS.get(event)
+        if intent is not None and not getattr(self.bot.intents, intent):
+            self.dropped[event] += 1
+            return
+        self.fed[event] += 1
+        self.state.parsers[event](payload)
+
+    def _add_members(self, guild: discord.Guild, user_ids: Iterable[int]) -> List[discord.Member]:
+        members = [discord.Member(data=member_payload(user_id), guild=guild, state=self.state) for user_id in user_ids]
+        for member in members:
+            guild._add_member(member)
+        return members
+
+    async def _chunk_guild(self, guild: discord.Guild, *, wait: bool = True, cache: bool = None):
+        return self._add_members(guild, self.guild.member_ids)
+
+    async def _query_members(self, guild: discord.Guild, query, limit, user_ids, cache, presences):
+        return self._add_members(guild, [u for u in user_ids or () if u in self._member_ids][:limit])
+
+    async def drain(self, timeout: float = 30.0):
+        """
+        Waits for the listeners started so far. Those still running after ``timeout``, e.g. ones waiting
+        for a reaction that never comes, are cancelled and counted as unfinished
+        """
+        deadline = time.perf_counter() + timeout
+        while self.pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.unfinished += len(self.pending)
+                for task in list(self.pending):
+                    task.cancel()
+                await asyncio.gather(*self.pending, return_exceptions=True)
+                break
+            await asyncio.wait(list(self.pending), timeout=remaining)
+
+    async def run(self, events: Iterable[Event], speed: float = None, batch: int = 100,
+                  drain_timeout: float = 30.0) -> dict:
+        """
+        Feeds ``events`` and waits until they are handled
+        :param speed: Replay speed relative to the event offsets, e.g. 1 for real time, None for as fast as possible
+        :param batch: Events fed between two yields to the loop when not pacing
+        :return: Throughput and counts, per-listener latencies are in :func:`summary`
+        """
+        perf.reset()
+        self.http.routes.clear()
+        self.fed.clear()
+        self.dropped.clear()
+        self.unfinished = 0
+        start = time.perf_counter()
+        for i, (offset, event, payload) in enumerate(events):
+            if speed:
+                delay = start + offset / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % batch == 0:
+                await asyncio.sleep(0)
+            self.feed(event, payload)
+        fed = time.perf_counter() - start
+        await self.drain(drain_timeout)
+        elapsed = time.perf_counter() - start
+        total = sum(self.fed.values())
+        return {
+            "events": total,
+            "feed_seconds": fed,
+            "seconds": elapsed,
+            "events_per_second": total / elapsed if elapsed else 0.0,
+            "dropped": sum(self.dropped.values()),
+            "unfinished": self.unfinished,
+            "rest_calls": sum(self.http.routes.values()),
+        }
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Latencies of the listeners and commands that ran, keyed by name, with the cog they belong to
+        """
+        summary = {}
+        for name, entry in perf.summary().items():
+            kind, _, target = name.partition(":")
+            if kind == "command":
+                command = self.bot.get_command(target)
+                cog = command.cog_name if command and command.cog_name else "Core"
+            elif kind == "job":
+                continue
+            else:
+                cog = target.split(".")[0] if "." in target else "Core"
+            summary[name] = dict(entry, cog=cog)
+        return summary
+
+    def close(self):
+        self.bot._schedule_event = self._schedule_event
+        del self.state.chunk_guild, self.state.query_members
@@ -0,0 +1,117 @@
+"""
+Compares the memory and throughput of the bot on a large fake guild with
+    all: the default intents plus members and presences, every member loaded at startup, 1000 cached messages,
+         as the bot ran before its intents were computed
+    startup: the intents the extensions need, every member loaded at startup
+    lazy: the intents the extensions need, members loaded when needed
+The traffic includes presence updates and typing, which Discord only sends the bot with those intents.
+Every mode is measured in a fresh process, since the bot gets its intents when it is created.
+
+    python -m benchmarks.member_cache [--members 100000] [--events 50000]
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+MODES = ("all", "startup", "lazy")
+
+WEIGHTS = {"chat": 40, "thanks": 5, "reaction": 15, "join": 2, "presence": 30, "typing": 8}
+
+
+def rss_mb() -> float:
+    """
+    Resident memory of this process, the peak where /proc isn't available
+    """
+    gc.collect()
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def measure(bot, args) -> dict:
+    from benchmarks import throughput
+
+    before = rss_mb()
+    start = time.perf_counter()
+    harness, generator = await throughput.start(bot, args.members, weights=WEIGHTS)
+    ready = time.perf_counter() - start
+    ready_rss = rss_mb()
+    result = await harness.run(generator.events(args.events))
+    throughput.stop(harness)
+    guild = bot.get_guild(harness.guild.id)
+    return {
+        "ready_seconds": ready,
+        "ready_rss_mb": ready_rss - before,
+        "rss_mb": rss_mb() - before,
+        "events_per_second": result["events_per_second"],
+        "offered_per_second": (result["events"] + result["dropped"]) / result["seconds"],
+        "dropped": result["dropped"],
+        "cached_members": len(guild.members),
+        "cached_messages": len(bot.cached_messages),
+    }
+
+
+def child(args):
+    import discord
+    from config.config import Bot as bot_config
+
+    bot_config.extensions = args.extensions
+    if args.mode == "all":
+        bot_config.extra_intents = [name for name, enabled in discord.Intents.default() if enabled]
+        bot_config.extra_intents += ["members", "presences"]
+        bot_config.member_loading = "startup"
+        bot_config.max_messages = 1000
+    else:
+        bot_config.member_loading = args.mode
+
+    from benchmarks import throughput
+
+    throughput.load_extensions(args.extensions)
+    bot = throughput.Referee.bot
+    measured = bot.loop.run_until_complete(measure(bot, args))
+    print(json.dumps(measured))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=100_000, help="Members of the fake guild")
+    parser.add_argument("--events", type=int, default=50_000, help="Gateway events to send")
+    parser.add_argument("--extensions", nargs="*", default=["reputation", "ranks", "rolegroups", "autoreactions"],
+                        help="Extensions to load")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return child(args)
+
+    results = {}
+    for mode in MODES:
+        out = subprocess.run([sys.executable, "-m", "benchmarks.member_cache", "--mode", mode,
+                              "--members", str(args.members), "--events", str(args.events),
+                              "--extensions", *args.extensions],
+                             capture_output=True, text=True)
+        lines = out.stdout.strip().splitlines()
+        try:
+            results[mode] = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            results[mode] = {"error": (out.stderr.strip().splitlines() or ["no output"])[-1]}
+
+    print(f"{'mode':<9}{'ready s':>9}{'ready MB':>10}{'RSS MB':>9}{'events/s':>10}{'offered/s':>11}"
+          f"{'dropped':>9}{'members':>9}{'messages':>10}")
+    for mode, r in results.items():
+        if "error" in r:
+            print(f"{mode:<9}  {r['error']}")
+            continue
+        print(f"{mode:<9}{r['ready_seconds']:>9.2f}{r['ready_rss_mb']:>10.1f}{r['rss_mb']:>9.1f}"
+              f"{r['events_per_second']:>10.0f}{r['offered_per_second']:>11.0f}{r['dropped']:>9}"
+              f"{r['cached_members']:>9}{r['cached_messages']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Memory and construction time of the models at a million rows, Thank as the example:
+    dict: the class the models were before, every instance carries a __dict__
+    namedtuple: the models now, built with keywords like the cogs do
+    _make: the models now, decoded from rows in field order like the postgres backend does
+and the time to put them all in a set, which exercises __hash__ and __eq__.
+If a postgres server is configured, also the time to fetch the rows with asyncpg and decode them.
+
+    python -m benchmarks.models [--rows 1000000] [--no-postgres]
+"""
+import argparse
+import asyncio
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from models.reputation_models import Thank
+
+
+class DictThank:
+    """
+    The Thank model as it was before it became a named tuple
+    """
+
+    def __init__(self, source_user_id: int, target_user_id: int, channel_id: int, message_id: int, timestamp: datetime,
+                 guild_id: int = None):
+        self.source_user_id = source_user_id
+        self.target_user_id = target_user_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.guild_id = guild_id
+
+    def __eq__(self, other):
+        if not isinstance(other, type(self)):
+            return False
+        return self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.source_user_id, self.target_user_id, self.message_id))
+
+
+def make_rows(count: int) -> list:
+    start = datetime(2020, 1, 1)
+    return [(10 ** 17 + i % 5000, 10 ** 17 + i % 7919, 42, 10 ** 18 + i, start + timedelta(seconds=i), 1)
+            for i in range(count)]
+
+
+def by_keywords(cls):
+    def build(rows):
+        return [cls(source_user_id=s, target_user_id=t, channel_id=c, message_id=m, timestamp=ts, guild_id=g)
+                for s, t, c, m, ts, g in rows]
+
+    return build
+
+
+def by_make(rows):
+    return list(map(Thank._make, rows))
+
+
+def measure(build, rows) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    models = build(rows)
+    built = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # construction time without tracemalloc slowing down every allocation
+    del models
+    gc.collect()
+    start = time.perf_counter()
+    models = build(rows)
+    built = min(built, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    unique = len(set(models))
+    hashed = time.perf_counter() - start
+    assert unique == len(rows)
+    return {"build_seconds": built, "mb": size / 2 ** 20, "bytes_per_row": size / len(rows), "set_seconds": hashed}
+
+
+async def fetch_and_decode(count: int) -> dict:
+    import asyncpg
+    from config.config import PostGres as pg_config
+
+    query = "SELECT i AS source_user_id, i AS target_user_id, 42::bigint AS channel_id, i AS message_id, " \
+            "NOW() AS time, 1::bigint AS guild_id FROM generate_series(1::bigint, $1) AS i"
+    con = await asyncpg.connect(host=pg_config.PG_Host, database=pg_config.PG_Database, user=pg_config.PG_User,
+                                password=pg_config.PG_Password, timeout=5)
+    try:
+        start = time.perf_counter()
+        records = await con.fetch(query, count)
+        fetched = time.perf_counter() - start
+    finally:
+        await con.close()
+    start = time.perf_counter()
+    list(map(Thank._make, records))
+    made = time.perf_counter() - start
+    start = time.perf_counter()
+    [DictThank(source_user_id=r["source_user_id"], target_user_id=r["target_user_id"], channel_id=r["channel_id"],
+               message_id=r["message_id"], timestamp=r["time"], guild_id=r["guild_id"]) for r in records]
+    by_name = time.perf_counter() - start
+    return {"fetch_seconds": fetched, "make_seconds": made, "dict_by_name_seconds": by_name}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Models to build")
+    parser.add_argument("--no-postgres", action="store_true", help="Skip fetching rows from postgres")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    print(f"{args.rows} rows")
+    print(f"{'model':<12}{'build s':>9}{'MB':>9}{'B/row':>8}{'set s':>8}")
+    for name, build in (("dict", by_keywords(DictThank)), ("namedtuple", by_keywords(Thank)), ("_make", by_make)):
+        r = measure(build, rows)
+        print(f"{name:<12}{r['build_seconds']:>9.2f}{r['mb']:>9.1f}{r['bytes_per_row']:>8.0f}{r['set_seconds']:>8.2f}")
+
+    if not args.no_postgres:
+        try:
+            r = asyncio.get_event_loop().run_until_complete(fetch_and_decode(args.rows))
+        except (OSError, asyncio.TimeoutError, ImportError) as e:
+            print(f"Skipping asyncpg decoding: {e}", file=sys.stderr)
+        else:
+            print(f"asyncpg fetch {r['fetch_seconds']:.2f}s, Thank._make {r['make_seconds']:.2f}s, "
+                  f"dict model by column name {r['dict_by_name_seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Plans and execution times of the hot statements before and after the index migrations.
+Works on generated rows in a scratch schema of the configured postgres db, which is dropped afterwards:
+the tables are created as the creation queries leave them, measured, migrated and measured again.
+
+    python -m benchmarks.query_plans [--thanks 1000000] [--users 50000] [--guilds 20] [--runs 20]
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+SCHEMA = "referee_query_plans"
+
+
+def describe(plan: dict) -> str:
+    """
+    The nodes of a plan, outermost first, with the relation or index they read
+    """
+    nodes = []
+
+    def walk(node):
+        target = node.get("Index Name") or node.get("Relation Name")
+        nodes.append(f"{node['Node Type']}({target})" if target else node["Node Type"])
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    walk(plan)
+    return " > ".join(nodes)
+
+
+async def fill(con, args, rng: random.Random) -> dict:
+    """
+    Generates the rows and returns sample arguments for the statements
+    """
+    now = datetime.now()
+    guilds = [rng.randrange(10 ** 17, 10 ** 18) for _ in range(args.guilds)]
+    users = [rng.randrange(10 ** 17, 10 ** 18) for _ in range(args.users)]
+    thanks = [(rng.choice(users), rng.choice(users), 1, i, now - timedelta(seconds=rng.randrange(2 * 365 * 86400)),
+               rng.choice(guilds)) for i in range(args.thanks)]
+    await con.copy_records_to_table("thanks", records=thanks, schema_name=SCHEMA,
+                                    columns=("source_user_id", "target_user_id", "channel_id", "message_id", "time",
+                                             "guild_id"))
+
+    rolegroups = [(f"group {i}", 10 ** 18 + i, guilds[i % len(guilds)]) for i in range(args.rolegroups)]
+    await con.copy_records_to_table("rolegroups", records=rolegroups, schema_name=SCHEMA,
+                                    columns=("name", "message_id", "guild_id"))
+    roles = [(rolegroup_id, rng.randrange(10 ** 17, 10 ** 18), chr(0x1F34F + i))
+             for rolegroup_id in range(1, args.rolegroups + 1) for i in range(10)]
+    await con.copy_records_to_table("rolegroup_roles", records=roles, schema_name=SCHEMA,
+                                    columns=("rolegroup_id", "role_id", "emoji"))
+
+    ranks = [(f"rank {i}", 2 * 10 ** 17 + i, 10 ** 18 + i, guilds[i % len(guilds)]) for i in range(args.ranks)]
+    await con.copy_records_to_table("ranks", records=ranks, schema_name=SCHEMA,
+                                    columns=("name", "role_id", "message_id", "guild_id"))
+
+    mails = [(rng.choice(users), "user#0001", now, "help", 0, rng.choice(guilds)) for _ in range(args.mails)]
+    await con.copy_records_to_table("modmail", records=mails, schema_name=SCHEMA,
+                                    columns=("author_id", "author_name", "timestamp", "content", "answer_count",
+                                             "guild_id"))
+    answers = [(rng.choice(users), "mod", now, "answer", 1 + i % args.mails) for i in range(2 * args.mails)]
+    await con.copy_records_to_table("answers", records=answers, schema_name=SCHEMA,
+                                    columns=("mod_id", "mod_name", "timestamp", "content", "modmail_id"))
+    await con.copy_records_to_table("modmailanswers", records=[(a[4], i + 1) for i, a in enumerate(answers)],
+                                    schema_name=SCHEMA, columns=("modmail_id", "answer_id"))
+
+    user, guild = thanks[0][1], thanks[0][5]
+    since, until = now - timedelta(days=365), now
+    return {
+        "rep": ("reputation.user_rep", (user, guild, since, until)),
+        "thanks received": ("reputation.thanks_by_target_user_id_by_guild_id", (since, until, user, guild)),
+        "thanks given": ("reputation.thanks_by_source_user_id_by_guild_id", (since, until, thanks[0][0], guild)),
+        "scoreboard": ("reputation.thanks_by_guild_id", (since, until, guild)),
+        "cooldowns": ("reputation.thanks", (now - timedelta(hours=1), datetime(3000, 1, 1))),
+        "rolegroup reaction": ("rolegroups.by_message_id", (rolegroups[-1][1],)),
+        "rolegroup roles": ("rolegroups.roles", (args.rolegroups,)),
+        "rank by role": ("ranks.by_role_id", (ranks[-1][1],)),
+        "modmail answer ids": ("modmail.answer_ids", (args.mails,)),
+        "modmail answer": ("modmail.answer", (len(answers),)),
+    }
+
+
+async def measure(con, cases: dict, runs: int) -> dict:
+    from db_classes.statements import statements
+
+    results = {}
+    for case, (name, args) in cases.items():
+        sql = statements.statements[name].sql
+        plan = json.loads(await con.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args))[0]
+        prepared = await con.prepare(sql)
+        start = time.perf_counter()
+        for _ in range(runs):
+            await prepared.fetch(*args)
+        results[case] = {"plan": describe(plan["Plan"]), "buffers": plan["Plan"].get("Shared Hit Blocks", 0)
+                         + plan["Plan"].get("Shared Read Blocks", 0),
+                         "ms": (time.perf_counter() - start) / runs * 1000}
+    return results
+
+
+async def run(args):
+    import asyncpg
+    from importlib import import_module
+    from config.config import PostGres as pg_config
+    from db_classes.migrations import migrate
+    from db_classes.PGPool import version_table
+
+    modules = {name: import_module(module) for name, module in
+               (("reputation", "db_classes.PGReputationDB"), ("rolegroups", "db_classes.PGRolegroupsDB"),
+                ("ranks", "db_classes.PGRanksDB"), ("modmail", "db_classes.PGModMailDB"))}
+    con = await asyncpg.connect(host=pg_config.PG_Host, database=pg_config.PG_Database, user=pg_config.PG_User,
+                                password=pg_config.PG_Password, timeout=5)
+    try:
+        await con.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await con.execute(f"CREATE SCHEMA {SCHEMA}")
+        await con.execute(f"SET search_path TO {SCHEMA}")
+        await con.execute(version_table)
+        for name, module in modules.items():
+            await migrate(con, name, module.schema_version, module.creation)
+
+        print("Generating rows", file=sys.stderr)
+        cases = await fill(con, args, random.Random(0))
+        await con.execute("ANALYZE")
+        before = await measure(con, cases, args.runs)
+
+        for name, module in modules.items():
+            start = time.perf_counter()
+            await migrate(con, name, module.schema_version, module.creation, module.migrations)
+            print(f"Migrated {name} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        await con.execute("ANALYZE")
+        after = await measure(con, cases, args.runs)
+    finally:
+        await con.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await con.close()
+
+    print(f"{'statement':<20}{'before ms':>11}{'after ms':>10}{'buffers':>10}{'after':>8}")
+    for case in cases:
+        b, a = before[case], after[case]
+        print(f"{case:<20}{b['ms']:>11.2f}{a['ms']:>10.2f}{b['buffers']:>10}{a['buffers']:>8}")
+        print(f"    before: {b['plan']}")
+        print(f"    after:  {a['plan']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thanks", type=int, default=1_000_000, help="Rows in thanks")
+    parser.add_argument("--users", type=int, default=50_000, help="Distinct users giving and getting thanks")
+    parser.add_argument("--guilds", type=int, default=20, help="Guilds the rows are spread over")
+    parser.add_argument("--rolegroups", type=int, default=2_000, help="Rolegroups, with 10 roles each")
+    parser.add_argument("--ranks", type=int, default=2_000, help="Rows in ranks")
+    parser.add_argument("--mails", type=int, default=50_000, help="Modmails, with 2 answers each")
+    parser.add_argument("--runs", type=int, default=20, help="Executions per statement for the timings")
+    args = parser.parse_args()
+    try:
+        asyncio.get_event_loop().run_until_complete(run(args))
+    except (OSError, asyncio.TimeoutError, ImportError) as e:
+        print(f"Needs asyncpg and a reachable postgres server: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Per-event overhead of the reaction cooldowns during a reaction storm.
+Compares :class:`utils.ratelimit.KeyedLimiter` with the list and dict based cooldowns it replaced.
+
+    python -m benchmarks.ratelimit [events] [users]
+"""
+import random
+import sys
+import time
+from typing import Dict, List
+
+from utils.ratelimit import KeyedLimiter
+
+COOLDOWN_COUNT = 5
+COOLDOWN_TIME = 10
+
+
+class ListCooldown:
+    """
+    The cooldown of the ranks and rolegroups cogs before the limiter, cleared by a timer every cooldown time
+    """
+
+    def __init__(self):
+        self.on_cooldown: List[int] = []
+        self.latest_reactions: Dict[int, int] = {}
+
+    def hit(self, user_id: int) -> bool:
+        if user_id in self.on_cooldown:
+            return False
+        self.latest_reactions[user_id] = self.latest_reactions.get(user_id, 1) + 1
+        if self.latest_reactions[user_id] > COOLDOWN_COUNT:
+            self.on_cooldown.append(user_id)
+        return True
+
+    def clear(self):
+        self.on_cooldown = []
+        self.latest_reactions = {}
+
+
+def storm(events: int, users: int, seed: int = 0) -> List[int]:
+    """
+    Reacting user ids, a few spammers account for half of the reactions
+    """
+    rng = random.Random(seed)
+    spammers = [rng.randrange(10 ** 17, 10 ** 18) for _ in range(max(1, users // 100))]
+    others = [rng.randrange(10 ** 17, 10 ** 18) for _ in range(users)]
+    return [rng.choice(spammers) if rng.random() < 0.5 else rng.choice(others) for _ in range(events)]
+
+
+def run(events: int, users: int, duration: float = 60.0):
+    user_ids = storm(events, users)
+    # the storm is spread over ``duration`` simulated seconds
+    step = duration / events
+
+    old = ListCooldown()
+    next_clear = COOLDOWN_TIME
+    blocked_old = 0
+    start = time.perf_counter()
+    for i, user_id in enumerate(user_ids):
+        if i * step >= next_clear:
+            old.clear()
+            next_clear += COOLDOWN_TIME
+        if not old.hit(user_id):
+            blocked_old += 1
+    old_ns = (time.perf_counter() - start) / events * 1e9
+    old_size = len(old.on_cooldown) + len(old.latest_reactions)
+
+    limiter = KeyedLimiter(rate=COOLDOWN_COUNT, period=COOLDOWN_TIME, burst=COOLDOWN_COUNT, max_keys=users)
+    blocked_new = 0
+    start = time.perf_counter()
+    for i, user_id in enumerate(user_ids):
+        if not limiter.hit(user_id, now=i * step):
+            blocked_new += 1
+    new_ns = (time.perf_counter() - start) / events * 1e9
+
+    print(f"{events} reactions from {users} users over {duration:.0f}s")
+    print(f"{'':<14}{'ns/event':>10}{'blocked':>10}{'keys':>10}")
+    print(f"{'list + dict':<14}{old_ns:>10.0f}{blocked_old:>10}{old_size:>10}")
+    print(f"{'KeyedLimiter':<14}{new_ns:>10.0f}{blocked_new:>10}{len(limiter):>10}")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5_000)
@@ -0,0 +1,85 @@
+"""
+Replays recorded gateway events into the real bot on a fake guild built from the recording.
+Recordings are written by the bot when the Recorder section of the config is enabled.
+
+    python -m benchmarks.replay recordings/ --speed 10
+"""
+import argparse
+import logging
+
+from config.config import Bot as bot_config, Storage as storage_config
+from utils.event_recorder import read_recording
+
+
+def guild_from_recording(events: list, members: int):
+    """
+    A fake guild with the guild, channel and user ids the recorded events refer to
+    """
+    from benchmarks.harness import FakeGuild
+
+    guild_id, channel_ids, user_ids = None, {}, {}
+    for _, _, payload in events:
+        guild_id = guild_id or payload.get("guild_id")
+        if "channel_id" in payload:
+            channel_ids[int(payload["channel_id"])] = None
+        for user in [payload.get("author"), payload.get("user"), *payload.get("mentions", ())]:
+            if user:
+                user_ids[int(user["id"])] = None
+        if "user_id" in payload:
+            user_ids[int(payload["user_id"])] = None
+    return FakeGuild(max(members, len(user_ids)), channel_ids=channel_ids, member_ids=user_ids,
+                     guild_id=int(guild_id) if guild_id else None)
+
+
+async def run(args, bot):
+    from benchmarks.harness import Harness
+    from utils.scheduler import scheduler
+
+    events = list(read_recording(args.recordings, events=args.events))
+    # DMs would need a private channel for every author, they are left out
+    guild_events = [e for e in events if "guild_id" in e[2]]
+    if not guild_events:
+        print("No guild events in the recording")
+        return
+    print(f"Loaded {len(events)} events over {events[-1][0]:.0f}s, replaying {len(guild_events)} guild events")
+
+    harness = Harness(bot, guild_from_recording(guild_events, args.members), api_latency=args.api_latency)
+    print(f"Ready in {await harness.setup():.2f}s")
+    result = await harness.run(guild_events, speed=args.speed or None)
+    print(f"{result['events']} events in {result['seconds']:.2f}s: {result['events_per_second']:.0f} events/s, "
+          f"{result['rest_calls']} REST calls, {result['unfinished']} listeners unfinished")
+
+    print(f"\n{'cog':<14}{'listener/command':<52}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in sorted(harness.summary().items(), key=lambda x: (x[1]["cog"], x[0])):
+        print(f"{s['cog']:<14}{name[:51]:<52}{s['calls']:>8}{s['wall_p50'] * 1000:>10.2f}"
+              f"{s['wall_p99'] * 1000:>10.2f}{s['wall_max'] * 1000:>10.2f}")
+
+    harness.close()
+    for name in list(scheduler.jobs):
+        scheduler.cancel(name, running=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="Recording files or directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 1 is real time, 0 as fast as possible")
+    parser.add_argument("--events", nargs="*", default=None, help="Only replay these gateway events")
+    parser.add_argument("--members", type=int, default=1000, help="Members of the fake guild, at least the recorded users")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Seconds every REST call takes")
+    parser.add_argument("--storage", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--extensions", nargs="*", default=bot_config.extensions, help="Extensions to load")
+    args = parser.parse_args()
+
+    storage_config.backend = args.storage
+    import Referee
+    from utils.import_profile import import_profiler
+
+    import_profiler.uninstall()
+    logging.getLogger("Referee").setLevel(logging.WARNING)
+    for ext in args.extensions:
+        Referee.bot.load_extension(f"extensions.{ext}")
+    Referee.bot.loop.run_until_complete(run(args, Referee.bot))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Cost of the db calls on the hot paths of the cogs, per storage backend.
+With the memory backend this is the cost of the surrounding logic alone,
+the difference to the postgres backend is the part spent on the query.
+
+    python -m benchmarks.storage [memory|postgres] [thanks]
+"""
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from db_classes.storage import open_db
+from models.ranks_models import Rank
+from models.reputation_models import Thank
+
+
+async def timed(name: str, calls: int, fn):
+    start = time.perf_counter()
+    for _ in range(calls):
+        await fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28}{elapsed / calls * 1e6:>12.1f}")
+
+
+async def run(backend: str, thanks: int):
+    rng = random.Random(0)
+    users = [rng.randrange(10 ** 17, 10 ** 18) for _ in range(1000)]
+    guild_id = rng.randrange(10 ** 17, 10 ** 18)
+    now = datetime.now()
+
+    reputation = open_db("reputation", backend)
+    ranks = open_db("ranks", backend)
+    await reputation.create_tables()
+    await ranks.create_tables()
+
+    start = time.perf_counter()
+    for i in range(thanks):
+        await reputation.add_thank(Thank(source_user_id=rng.choice(users), target_user_id=rng.choice(users),
+                                         channel_id=1, message_id=i, timestamp=now - timedelta(minutes=i),
+                                         guild_id=guild_id))
+    print(f"Inserted {thanks} thanks into {backend} in {time.perf_counter() - start:.2f}s")
+    for i in range(50):
+        await ranks.add_rank(Rank(name=f"bench-{i}", role_id=i, message_id=10_000 + i, guild_id=guild_id))
+
+    print(f"{'call':<28}{'us/call':>12}")
+    await timed("ranks.get_rank(message_id)", 1000, lambda: ranks.get_rank(message_id=10_000 + rng.randrange(50)))
+    await timed("reputation.get_user_rep", 200, lambda: reputation.get_user_rep(rng.choice(users), guild_id))
+    await timed("reputation.get_thanks(1h)", 200, lambda: reputation.get_thanks(since=now - timedelta(hours=1)))
+    await timed("reputation.get_leaderboard", 5, lambda: reputation.get_leaderboard(guild_id))
+
+    await reputation.close()
+    await ranks.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(sys.argv[1] if len(sys.argv) > 1 else "memory",
+                    int(sys.argv[2]) if len(sys.argv) > 2 else 20_000))
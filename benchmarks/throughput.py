@@ -0,0 +1,102 @@
+"""
+Events/sec and handling latency per extension, with the real bot on a fake guild.
+Uses the memory storage backend, so the numbers are those of the bots own code and discord.py.
+
+    python -m benchmarks.throughput --members 100000 --events 20000
+"""
+import argparse
+import logging
+
+from config.config import Bot as bot_config, Storage as storage_config
+from config.config import Bouncer, EmojiSurvey, ModMail, Ranks, Rolegroups
+
+storage_config.backend = "memory"
+
+import Referee  # noqa: E402, creates the bot
+from benchmarks.harness import EventGenerator, FakeGuild, Harness, snowflake  # noqa: E402
+from db_classes.storage import open_db  # noqa: E402
+from models.ranks_models import Rank  # noqa: E402
+from models.rolegroups_models import Rolegroup  # noqa: E402
+from utils import emoji  # noqa: E402
+from utils.import_profile import import_profiler  # noqa: E402
+from utils.scheduler import scheduler  # noqa: E402
+
+
+async def seed(guild: FakeGuild) -> list:
+    """
+    Creates a rank and a rolegroup to react to
+    :return: The reaction targets for the event generator
+    """
+    rank_message, rolegroup_message = snowflake(), snowflake()
+    await open_db("ranks").add_rank(Rank(name="benchmark", role_id=guild.role_ids[0], message_id=rank_message,
+                                              guild_id=guild.id))
+    rolegroup = Rolegroup(name="benchmark", message_id=rolegroup_message, guild_id=guild.id,
+                          roles=tuple(zip(("🍏", "🍊", "🍋"), guild.role_ids[1:4])))
+    await open_db("rolegroups").add_rolegroup(rolegroup)
+    return [(Ranks.ranks_channel_id, rank_message, emoji.white_check_mark)] + \
+           [(Rolegroups.channel_id, rolegroup_message, e) for e in rolegroup.emojis]
+
+
+async def start(bot, members: int, api_latency: float = 0.0, weights: dict = None):
+    """
+    Logs the bot in to a fake guild with a rank and a rolegroup
+    :return: The :class:`Harness` and an :class:`EventGenerator` for the guild
+    """
+    channel_ids = [Bouncer.first_channel_id, Bouncer.second_channel_id, ModMail.mod_channel_id,
+                   Ranks.ranks_channel_id, Rolegroups.channel_id, EmojiSurvey.channel_id] + \
+                  [snowflake() for _ in range(10)]
+    guild = FakeGuild(members, channel_ids=channel_ids)
+    targets = await seed(guild)
+    harness = Harness(bot, guild, api_latency=api_latency)
+    print(f"Ready with {members} members in {await harness.setup():.2f}s")
+    prefix = bot_config.commandPrefixes[0]
+    generator = EventGenerator(guild, commands=[f"{prefix}rep", f"{prefix}help"], reaction_targets=targets,
+                               weights=weights)
+    return harness, generator
+
+
+def stop(harness: Harness):
+    harness.close()
+    for name in list(scheduler.jobs):
+        scheduler.cancel(name, running=True)
+
+
+async def run(args):
+    harness, generator = await start(Referee.bot, args.members, api_latency=args.api_latency)
+    result = await harness.run(generator.events(args.events, rate=args.rate), speed=1 if args.rate else None)
+    print(f"{result['events']} events in {result['seconds']:.2f}s: {result['events_per_second']:.0f} events/s, "
+          f"{result['rest_calls']} REST calls, {result['unfinished']} listeners unfinished")
+
+    print(f"\n{'cog':<14}{'listener/command':<52}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in sorted(harness.summary().items(), key=lambda x: (x[1]["cog"], x[0])):
+        print(f"{s['cog']:<14}{name[:51]:<52}{s['calls']:>8}{s['wall_p50'] * 1000:>10.2f}"
+              f"{s['wall_p99'] * 1000:>10.2f}{s['wall_max'] * 1000:>10.2f}")
+
+    print(f"\n{'REST route':<66}{'calls':>8}")
+    for route, count in harness.http.routes.most_common(15):
+        print(f"{route:<66}{count:>8}")
+    stop(harness)
+
+
+def load_extensions(extensions):
+    import_profiler.uninstall()
+    logging.getLogger("Referee").setLevel(logging.WARNING)
+    for ext in extensions:
+        Referee.bot.load_extension(f"extensions.{ext}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=10_000, help="Members of the fake guild")
+    parser.add_argument("--events", type=int, default=10_000, help="Number of events to feed")
+    parser.add_argument("--rate", type=float, default=None, help="Events per second, as fast as possible if unset")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Seconds every REST call takes")
+    parser.add_argument("--extensions", nargs="*", default=bot_config.extensions, help="Extensions to load")
+    args = parser.parse_args()
+
+    load_extensions(args.extensions)
+    Referee.bot.loop.run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
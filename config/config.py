@@ -1,4 +1,6 @@
 import configparser
+import os
+from typing import Optional
 
 CONFIG_PATH = "config/options.ini"
 
@@ -20,6 +22,50 @@ class Bot:
     commandPrefixes = config["Bot"]["CommandPrefixes"].split()
     status = config["Bot"]["Status"]
     logging_level = int(config["Bot"]["LoggingLevel"])
+    debug_sample_rate = int(config["Bot"].get("DebugSampleRate", "1"))
+    uvloop = config.getboolean("Bot", "Uvloop", fallback=False)
+    extra_intents = config.get("Bot", "ExtraIntents", fallback="").split()
+    member_loading = config.get("Bot", "MemberLoading", fallback="startup").lower()
+    max_messages = config.getint("Bot", "MaxMessages", fallback=250)
+
+
+class Metrics:
+    enabled = config.getboolean("Metrics", "Enabled", fallback=True)
+    host = config.get("Metrics", "Host", fallback="0.0.0.0")
+    # docker-compose passes the published port as PORT
+    port = int(os.environ.get("PORT", config.get("Metrics", "Port", fallback="8002")))
+
+
+class Launcher:
+    workers = config.getint("Launcher", "Workers", fallback=2)
+    shard_count = config.getint("Launcher", "ShardCount", fallback=0)
+    startup_timeout = config.getfloat("Launcher", "StartupTimeout", fallback=180)
+    stop_timeout = config.getfloat("Launcher", "StopTimeout", fallback=30)
+    restart_delay = config.getfloat("Launcher", "RestartDelay", fallback=5)
+
+
+class LoopMonitor:
+    enabled = config.getboolean("LoopMonitor", "Enabled", fallback=True)
+    interval = config.getfloat("LoopMonitor", "Interval", fallback=0.5)
+    slow_threshold = config.getfloat("LoopMonitor", "SlowCallback", fallback=100) / 1000
+
+
+class ProcessPool:
+    workers = config.getint("ProcessPool", "Workers", fallback=2)
+    task_timeout = config.getfloat("ProcessPool", "TaskTimeout", fallback=30)
+    quick_task_timeout = config.getfloat("ProcessPool", "QuickTaskTimeout", fallback=1)
+    memory_limit = config.getint("ProcessPool", "MemoryLimit", fallback=1024)
+    max_tasks_per_worker = config.getint("ProcessPool", "MaxTasksPerWorker", fallback=200)
+
+
+class Recorder:
+    enabled = config.getboolean("Recorder", "Enabled", fallback=False)
+    path = config.get("Recorder", "Path", fallback="recordings")
+    events = config.get("Recorder", "Events", fallback="MESSAGE_CREATE MESSAGE_REACTION_ADD GUILD_MEMBER_ADD").split()
+    anonymise = config.getboolean("Recorder", "Anonymise", fallback=True)
+    salt = config.get("Recorder", "Salt", fallback="")
+    max_bytes = config.getint("Recorder", "MaxBytes", fallback=50_000_000)
+    keep = config.getint("Recorder", "Keep", fallback=20)
 
 
 class Misc:
@@ -31,13 +77,57 @@ class PostGres:
     PG_Database = config["PostgreSQL"]["Database"]
     PG_User = config["PostgreSQL"]["User"]
     PG_Password = config["PostgreSQL"]["Password"]
+    PG_PoolMinSize = int(config["PostgreSQL"].get("PoolMinSize", "2"))
+    PG_PoolMaxSize = int(config["PostgreSQL"].get("PoolMaxSize", "10"))
+    PG_PoolQuotas = {ext: int(limit) for ext, limit in
+                     (quota.split(":") for quota in config["PostgreSQL"].get("PoolQuotas", "").split())}
+    PG_WriteBatchSize = int(config["PostgreSQL"].get("WriteBatchSize", "0"))
+    PG_WriteBatchDelay = float(config["PostgreSQL"].get("WriteBatchDelay", "1.0"))
+
+
+class Storage:
+    backend = config.get("Storage", "Backend", fallback="postgres").lower()
 
 
-class Bouncer:
-    first_channel_id = int(config["Bouncer"]["first_channel_id"])
-    second_channel_id = int(config["Bouncer"]["second_channel_id"])
-    newbie_role_name = config["Bouncer"]["newbie_role_name"]
-    accept_text = config["Bouncer"]["accept_text"]
+class GuildConfig:
+    """
+    Options a guild can override in a section of its own, named after the section and the guild id: [Ranks:1234].
+    The module level instances hold the options of the plain section, :meth:`for_guild` those of one guild
+    """
+    section = ""
+
+    def __init__(self, guild_id: int = None):
+        self.guild_id = guild_id
+        override = f"{self.section}:{guild_id}"
+        self._overrides = dict(config[override]) if config.has_section(override) else {}
+        self._guilds = {}
+        self.load()
+
+    def load(self):
+        raise NotImplementedError
+
+    def get(self, key: str) -> str:
+        return config.get(self.section, key, vars=self._overrides)
+
+    def getint(self, key: str) -> int:
+        return int(self.get(key))
+
+    def for_guild(self, guild_id: Optional[int]):
+        """
+        The options of a guild, the defaults for guilds without a section of their own and for DMs
+        """
+        options = self._guilds.get(guild_id)
+        if options is None:
+            if guild_id is None or not config.has_section(f"{self.section}:{guild_id}"):
+                options = self
+            else:
+                options = type(self)(guild_id)
+            self._guilds[guild_id] = options
+        return options
+
+
+class __Bouncer(GuildConfig):
+    section = "Bouncer"
     welcome_message = """Here you can find help on programming topics, discuss your ideas, share what you're working on, and more.
     Join the discussion in <#222721769696526337> or check out some of the popular channels at the bottom.
 
@@ -50,57 +140,88 @@ class Bouncer:
     <#479598294084091904> - <#401819392431620106>
     """
 
-
-class ModMail:
-    anonymize_responses = config["ModMail"]["AnonymizeResponses"].lower() in (
-        'yes', 'y', 'true', 't', '1', 'enable', 'on')
-    mod_channel_id = int(config["ModMail"]["ModChannelID"])
-    cooldown = int(config["ModMail"]["Cooldown"])
-
-
-class Ranks:
-    ranks_channel_id = int(config["Ranks"]["RanksChannelID"])
-    cooldown_count = int(config["Ranks"]["CooldownCount"])
-    cooldown_time = int(config["Ranks"]["CooldownTime"])
-    rank_count_limit = int(config["Ranks"]["RankCountLimit"])
-
-
-class Reputation:
-    cooldown = int(config["Reputation"]["DelayBetweenThanks"])
-    leaderboard_max_length = int(config["Reputation"]["LeaderboardLimit"])
-    max_mentions = int(config["Reputation"]["MaxMentions"])
-    thanked_role = int(config["Reputation"]["ThankedRole"])
-    thanked_role_threshold = int(config["Reputation"]["ThankedRoleThreshold"])
-    fontsize = int(config["Reputation"]["FontSize"])
-    default_fontcolor = config["Reputation"]["FontColor"]
-    first_color = config["Reputation"]["FirstColor"]
-    second_color = config["Reputation"]["SecondColor"]
-    third_color = config["Reputation"]["ThirdColor"]
-    font_colors = {
-        1: first_color,
-        2: second_color,
-        3: third_color
-    }
-    highlight_color = config["Reputation"]["HighlightColor"]
-    background = config["Reputation"]["Background"]
-
-
-class Warnings:
-    dyno_id = int(config["Warnings"]["DynoID"])
-    warning_lifetime = int(config["Warnings"]["WarningLifetime"])
-    warned_role_name = config["Warnings"]["WarnedRoleName"]
-    default_warned_color = (int(x) for x in config["Warnings"]["defaultWarnedColor"].split())
-
-
-class Rolegroups:
-    channel_id = int(config["Rolegroups"]["RolegroupsChannelID"])
-    cooldown_count = int(config["Rolegroups"]["CooldownCount"])
-    cooldown_time = int(config["Rolegroups"]["CooldownTime"])
-    role_count_limit = int(config["Rolegroups"]["RoleCountLimit"])
-
-
-class EmojiSurvey:
-    channel_id = int(config["EmojiSurvey"]["ChannelID"])
+    def load(self):
+        self.first_channel_id = self.getint("first_channel_id")
+        self.second_channel_id = self.getint("second_channel_id")
+        self.newbie_role_name = self.get("newbie_role_name")
+        self.accept_text = self.get("accept_text")
+Bouncer = __Bouncer()
+
+
+class __ModMail(GuildConfig):
+    section = "ModMail"
+
+    def load(self):
+        self.anonymize_responses = self.get("AnonymizeResponses").lower() in (
+            'yes', 'y', 'true', 't', '1', 'enable', 'on')
+        self.mod_channel_id = self.getint("ModChannelID")
+        self.cooldown = self.getint("Cooldown")
+ModMail = __ModMail()
+
+
+class __Ranks(GuildConfig):
+    section = "Ranks"
+
+    def load(self):
+        self.ranks_channel_id = self.getint("RanksChannelID")
+        self.cooldown_count = self.getint("CooldownCount")
+        self.cooldown_time = self.getint("CooldownTime")
+        self.rank_count_limit = self.getint("RankCountLimit")
+Ranks = __Ranks()
+
+
+class __Reputation(GuildConfig):
+    section = "Reputation"
+
+    def load(self):
+        self.cooldown = self.getint("DelayBetweenThanks")
+        self.leaderboard_max_length = self.getint("LeaderboardLimit")
+        self.max_mentions = self.getint("MaxMentions")
+        self.thanked_role = self.getint("ThankedRole")
+        self.thanked_role_threshold = self.getint("ThankedRoleThreshold")
+        self.fontsize = self.getint("FontSize")
+        self.default_fontcolor = self.get("FontColor")
+        self.first_color = self.get("FirstColor")
+        self.second_color = self.get("SecondColor")
+        self.third_color = self.get("ThirdColor")
+        self.font_colors = {
+            1: self.first_color,
+            2: self.second_color,
+            3: self.third_color
+        }
+        self.highlight_color = self.get("HighlightColor")
+        self.background = self.get("Background")
+Reputation = __Reputation()
+
+
+class __Warnings(GuildConfig):
+    section = "Warnings"
+
+    def load(self):
+        self.dyno_id = self.getint("DynoID")
+        self.warning_lifetime = self.getint("WarningLifetime")
+        self.warned_role_name = self.get("WarnedRoleName")
+        self.default_warned_color = tuple(int(x) for x in self.get("defaultWarnedColor").split())
+Warnings = __Warnings()
+
+
+class __Rolegroups(GuildConfig):
+    section = "Rolegroups"
+
+    def load(self):
+        self.channel_id = self.getint("RolegroupsChannelID")
+        self.cooldown_count = self.getint("CooldownCount")
+        self.cooldown_time = self.getint("CooldownTime")
+        self.role_count_limit = self.getint("RoleCountLimit")
+Rolegroups = __Rolegroups()
+
+
+class __EmojiSurvey(GuildConfig):
+    section = "EmojiSurvey"
+
+    def load(self):
+        self.channel_id = self.getint("ChannelID")
+EmojiSurvey = __EmojiSurvey()
 
 
 class Christmas_Competition:
@@ -0,0 +1,398 @@
+"""
+In-memory implementations of the db classes, selected with ``Backend = memory`` in the ``Storage`` section.
+They offer the same methods as their postgres counterparts, so cogs can be run and benchmarked without a db.
+Rows are kept as dicts and turned into fresh model objects on every read, like rows fetched from postgres
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from models.modmail_models import ModMail, ModMailAnswer
+from models.ranks_models import Rank
+from models.reputation_models import Thank
+from models.rolegroups_models import Rolegroup
+from models.warnings_models import RefWarning
+
+logger = logging.getLogger("Referee")
+
+
+class MemoryTable:
+    """
+    Rows of one table with a serial ``id``, and hash indexes on the columns given in ``indexes``
+    """
+
+    def __init__(self, indexes: Iterable[str] = ()):
+        self.rows: Dict[int, dict] = {}
+        self.next_id = 1
+        self.indexes: Dict[str, Dict[object, Set[int]]] = {column: defaultdict(set) for column in indexes}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def insert(self, **row) -> int:
+        row_id = row["id"] = self.next_id
+        self.next_id += 1
+        self.rows[row_id] = row
+        for column, index in self.indexes.items():
+            index[row.get(column)].add(row_id)
+        return row_id
+
+    def _matching(self, where: dict) -> List[int]:
+        for column, value in where.items():
+            if column == "id":
+                candidates = [value] if value in self.rows else []
+                break
+            if column in self.indexes:
+                candidates = sorted(self.indexes[column].get(value, ()))
+                break
+        else:
+            candidates = list(self.rows)
+        return [i for i in candidates if all(self.rows[i].get(k) == v for k, v in where.items())]
+
+    def select(self, **where) -> List[dict]:
+        """
+        Copies of the rows whose columns equal ``where``, in insertion order
+        """
+        return [dict(self.rows[i]) for i in self._matching(where)]
+
+    def scan(self, **where) -> Iterable[dict]:
+        """
+        The rows whose columns equal ``where`` themselves, for reads that only look at some of them
+        """
+        return (self.rows[i] for i in self._matching(where))
+
+    def update(self, values: dict, **where) -> int:
+        ids = self._matching(where)
+        for i in ids:
+            row = self.rows[i]
+            for column, index in self.indexes.items():
+                if column in values:
+                    index[row.get(column)].discard(i)
+                    index[values[column]].add(i)
+            row.update(values)
+        return len(ids)
+
+    def delete(self, **where) -> int:
+        ids = self._matching(where)
+        for i in ids:
+            row = self.rows.pop(i)
+            for column, index in self.indexes.items():
+                index[row.get(column)].discard(i)
+        return len(ids)
+
+    def clear(self):
+        self.rows.clear()
+        for index in self.indexes.values():
+            index.clear()
+
+
+class MemoryStore:
+    """
+    The tables of all in-memory db classes. They outlive the db objects, so data survives reloading an extension
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, MemoryTable] = {}
+
+    def table(self, name: str, indexes: Iterable[str] = ()) -> MemoryTable:
+        if name not in self.tables:
+            self.tables[name] = MemoryTable(indexes)
+        return self.tables[name]
+
+    def clear(self):
+        for table in self.tables.values():
+            table.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {name: len(table) for name, table in self.tables.items()}
+
+
+store = MemoryStore()
+
+
+class MemoryDB:
+    """
+    Base of the in-memory db classes, provides the lifecycle methods of the postgres ones
+    """
+
+    async def close(self):
+        pass
+
+    async def create_tables(self):
+        return False
+
+
+class MemoryAutoreactDB(MemoryDB):
+    def __init__(self):
+        self.autoreactions = store.table("autoreactions", indexes=("guild_id",))
+
+    async def add_autoreaction(self, guild_id: int, emoji, regex: str, channel_id: int = None):
+        self.autoreactions.insert(regex=regex, channel_id=channel_id, emoji=emoji, guild_id=guild_id)
+
+    async def remove_autoreaction(self, guild_id: int, autoreaction_id: int):
+        self.autoreactions.delete(id=autoreaction_id, guild_id=guild_id)
+
+    async def get_autoreactions_list(self, guild_id: int = None):
+        return self.autoreactions.select() if guild_id is None else self.autoreactions.select(guild_id=guild_id)
+
+
+class MemoryChristmasDB(MemoryDB):
+    def __init__(self):
+        self.users = store.table("aoc_users", indexes=("discord_id", "aoc_name"))
+        self.cookie = store.table("aoc_cookie")
+
+    async def update_cookie(self, cookie: str):
+        self.cookie.clear()
+        self.cookie.insert(cookie=cookie)
+
+    async def get_cookie(self):
+        results = [r["cookie"] for r in self.cookie.select()]
+        return None if len(results) == 0 else results[0]
+
+    async def add_user(self, aoc_name: str, discord_id: int):
+        # the columns are unique in postgres
+        if self.users.select(aoc_name=aoc_name) or self.users.select(discord_id=discord_id):
+            raise ValueError(f"AoC user {aoc_name} or discord user {discord_id} already exists")
+        self.users.insert(aoc_name=aoc_name, discord_id=discord_id)
+
+    async def update_user(self, aoc_name: str, discord_id: int):
+        self.users.update({"aoc_name": aoc_name}, discord_id=discord_id)
+
+    async def get_all_users(self):
+        return [(row["aoc_name"], row["discord_id"]) for row in self.users.select()]
+
+    async def get_user(self, aoc_name: Optional[str], discord_id: Optional[int]):
+        if aoc_name is None and discord_id is None:
+            return None
+        if aoc_name is not None and discord_id is not None:
+            return aoc_name, discord_id
+        rows = self.users.select(discord_id=discord_id) if aoc_name is None else self.users.select(aoc_name=aoc_name)
+        if not rows:
+            return None
+        return rows[0]["aoc_name"], rows[0]["discord_id"]
+
+
+class MemoryEmojiSurveyDB(MemoryDB):
+    def __init__(self):
+        self.messages = store.table("emojisurvey", indexes=("message_id", "guild_id"))
+
+    async def add_message(self, guild_id: int, message_id: int, emoji: str):
+        self.messages.insert(message_id=message_id, emoji=emoji, guild_id=guild_id)
+
+    async def get_all(self, guild_id: int) -> List[Tuple[int, str]]:
+        return [(row["message_id"], row["emoji"]) for row in self.messages.select(guild_id=guild_id)]
+
+    async def delete_message(self, message_id: int):
+        self.messages.delete(message_id=message_id)
+
+
+class MemoryModMailDB(MemoryDB):
+    def __init__(self):
+        self.modmail = store.table("modmail", indexes=("guild_id",))
+        self.answers = store.table("answers", indexes=("modmail_id",))
+
+    @staticmethod
+    def _to_modmail(row: dict) -> ModMail:
+        return ModMail(author_id=row["author_id"], author_name=row["author_name"], timestamp=row["timestamp"],
+                       content=row["content"], answers=(), modmail_id=row["id"], message_id=row["message_id"],
+                       guild_id=row["guild_id"])
+
+    async def put_modmail(self, mail: ModMail) -> int:
+        return self.modmail.insert(author_id=mail.author_id, author_name=mail.author_name, timestamp=mail.timestamp,
+                                   content=mail.content, answer_count=0, message_id=None, guild_id=mail.guild_id)
+
+    async def assign_message_id(self, modmail_id: int, message_id: int):
+        self.modmail.update({"message_id": message_id}, id=modmail_id)
+
+    async def put_answer(self, answer: ModMailAnswer) -> int:
+        return self.answers.insert(mod_id=answer.mod_id, mod_name=answer.mod_name, timestamp=answer.timestamp,
+                                   content=answer.content, modmail_id=answer.modmail.modmail_id)
+
+    async def get_modmail(self, modmail_id: int) -> ModMail:
+        rows = self.modmail.select(id=modmail_id)
+        if not rows:
+            return None
+        mail = self._to_modmail(rows[0])
+        return mail._replace(answers=tuple(await self.get_answers(mail)))
+
+    async def get_latest_modmail(self, guild_id: int) -> ModMail:
+        ids = self.modmail.indexes["guild_id"].get(guild_id)
+        if not ids:
+            return None
+        return await self.get_modmail(max(ids))
+
+    async def get_answers(self, modmail: ModMail) -> List[ModMailAnswer]:
+        return [await self.get_answer(row["id"], modmail) for row in self.answers.select(modmail_id=modmail.modmail_id)]
+
+    async def get_answer(self, answer_id: int, modmail: ModMail = None) -> ModMailAnswer:
+        row = self.answers.select(id=answer_id)[0]
+        if not modmail:
+            modmail = await self.get_modmail(row["modmail_id"])
+        return ModMailAnswer(mod_id=row["mod_id"], mod_name=row["mod_name"], timestamp=row["timestamp"],
+                             content=row["content"], modmail=modmail)
+
+
+class MemoryRanksDB(MemoryDB):
+    def __init__(self):
+        self.ranks = store.table("ranks", indexes=("message_id", "role_id", "name", "guild_id"))
+
+    @staticmethod
+    def _to_rank(row: dict) -> Rank:
+        return Rank(name=row["name"], role_id=row["role_id"], message_id=row["message_id"], guild_id=row["guild_id"])
+
+    async def add_rank(self, rank: Rank):
+        if self.ranks.select(name=rank.name, guild_id=rank.guild_id):
+            raise ValueError(f"Rank {rank.name} already exists")
+        self.ranks.insert(name=rank.name, role_id=rank.role_id, message_id=rank.message_id, guild_id=rank.guild_id)
+
+    async def get_rank(self, role_id: int = None, name: str = None, message_id: int = None,
+                       guild_id: int = None) -> Rank:
+        if role_id is None and name is None and message_id is None:
+            raise RuntimeError("get_rank called without arguments")
+        if role_id:
+            rows = self.ranks.select(role_id=role_id)
+        elif name:
+            rows = self.ranks.select(name=name, guild_id=guild_id)
+        else:
+            rows = self.ranks.select(message_id=message_id)
+        if rows:
+            return self._to_rank(rows[0])
+
+    async def delete_rank(self, role_id: int):
+        self.ranks.delete(role_id=role_id)
+
+    async def get_all_ranks(self, guild_id: int = None):
+        rows = self.ranks.select() if guild_id is None else self.ranks.select(guild_id=guild_id)
+        return [self._to_rank(row) for row in rows]
+
+
+class MemoryReputationDB(MemoryDB):
+    def __init__(self):
+        self.thanks = store.table("thanks", indexes=("source_user_id", "target_user_id", "guild_id"))
+
+    async def get_user_rep(self, user_id, guild_id, since=datetime(day=1, month=1, year=2000), until=None):
+        if not until:
+            until = datetime.now()
+        return sum(1 for row in self.thanks.scan(target_user_id=user_id, guild_id=guild_id)
+                   if since <= row["time"] <= until)
+
+    async def add_thank(self, new_thank: Thank):
+        self.thanks.insert(source_user_id=new_thank.source_user_id, target_user_id=new_thank.target_user_id,
+                           channel_id=new_thank.channel_id, message_id=new_thank.message_id, time=new_thank.timestamp,
+                           guild_id=new_thank.guild_id)
+
+    async def get_thanks(self, since=datetime(day=1, month=1, year=2000), until=None, source_user_id=None,
+                         target_user_id=None, guild_id=None) -> List[Thank]:
+        if not until:
+            until = datetime(day=1, month=1, year=3000)
+        where = {}
+        if source_user_id:
+            where["source_user_id"] = source_user_id
+        if target_user_id:
+            where["target_user_id"] = target_user_id
+        if guild_id:
+            where["guild_id"] = guild_id
+        rows = sorted((r for r in self.thanks.scan(**where) if since <= r["time"] <= until), key=lambda r: r["time"])
+        return [Thank(source_user_id=r["source_user_id"],
+                      target_user_id=r["target_user_id"],
+                      message_id=r["message_id"],
+                      channel_id=r["channel_id"],
+                      timestamp=r["time"],
+                      guild_id=r["guild_id"])
+                for r in rows]
+
+    async def get_leaderboard(self, guild_id, since=datetime(day=1, month=1, year=2000), until=None):
+        if not until:
+            until = datetime.now()
+        member_scores = defaultdict(int)
+        for thank in await self.get_thanks(since, until, guild_id=guild_id):
+            member_scores[thank.target_user_id] += 1
+        sorted_user_ids = sorted(member_scores, key=member_scores.get, reverse=True)
+        ranked_scores = {score: i + 1 for i, score in enumerate(sorted(set(member_scores.values()), reverse=True))}
+        return [{"user_id": user_id, "score": member_scores[user_id], "rank": ranked_scores[member_scores[user_id]]}
+                for user_id in sorted_user_ids]
+
+
+class MemoryRolegroupsDB(MemoryDB):
+    def __init__(self):
+        self.rolegroups = store.table("rolegroups", indexes=("message_id", "guild_id"))
+        self.roles = store.table("rolegroup_roles", indexes=("rolegroup_id",))
+
+    async def add_rolegroup(self, rolegroup: Rolegroup) -> Rolegroup:
+        if any(r["name"] == rolegroup.name for r in self.rolegroups.scan(guild_id=rolegroup.guild_id)):
+            raise ValueError(f"Rolegroup {rolegroup.name} already exists")
+        rolegroup = rolegroup._replace(db_id=self.rolegroups.insert(name=rolegroup.name,
+                                                                    message_id=rolegroup.message_id,
+                                                                    guild_id=rolegroup.guild_id))
+        for emoji, role_id in rolegroup.roles:
+            self.roles.insert(rolegroup_id=rolegroup.db_id, role_id=role_id, emoji=emoji)
+        return rolegroup
+
+    async def update_rolegroup(self, rolegroup: Rolegroup) -> Rolegroup:
+        old = await self.get_rolegroup(rolegroup_id=rolegroup.db_id)
+        if old.name != rolegroup.name:
+            self.rolegroups.update({"name": rolegroup.name}, id=rolegroup.db_id)
+        for emoji, role_id in old.roles:
+            if rolegroup.get_role(emoji) != role_id:
+                self.roles.delete(rolegroup_id=rolegroup.db_id, emoji=emoji)
+        for emoji, role_id in rolegroup.roles:
+            if old.get_role(emoji) != role_id:
+                self.roles.insert(rolegroup_id=rolegroup.db_id, role_id=role_id, emoji=emoji)
+        return await self.get_rolegroup(rolegroup_id=rolegroup.db_id)
+
+    async def get_rolegroup(self, rolegroup_id: int = None, message_id: int = None) -> Rolegroup:
+        if not rolegroup_id and not message_id:
+            raise Exception("get_rolegroup called without arguments")
+        rows = self.rolegroups.select(id=rolegroup_id) if rolegroup_id else self.rolegroups.select(message_id=message_id)
+        if rows:
+            roles = tuple((row["emoji"], row["role_id"]) for row in self.roles.select(rolegroup_id=rows[0]["id"]))
+            return Rolegroup(name=rows[0]["name"], message_id=rows[0]["message_id"], db_id=rows[0]["id"],
+                             guild_id=rows[0]["guild_id"], roles=roles)
+
+    async def delete_rolegroup(self, rolegroup_id: int):
+        self.rolegroups.delete(id=rolegroup_id)
+        self.roles.delete(rolegroup_id=rolegroup_id)
+
+    async def get_all_rolegroups(self, guild_id: int = None) -> List[Rolegroup]:
+        rows = self.rolegroups.select() if guild_id is None else self.rolegroups.select(guild_id=guild_id)
+        return [await self.get_rolegroup(rolegroup_id=row["id"]) for row in rows]
+
+
+class MemoryWarningDB(MemoryDB):
+    def __init__(self):
+        self.warnings = store.table("warnings", indexes=("user_id", "guild_id"))
+
+    @staticmethod
+    def _to_warning(row: dict) -> RefWarning:
+        return RefWarning(user_id=row["user_id"], timestamp=row["timestamp"], mod_name=row["mod_name"],
+                          reason=row["reason"], expiration_time=row["expiration_time"], guild_id=row["guild_id"])
+
+    async def put_warning(self, warning: RefWarning):
+        self.warnings.insert(user_id=warning.user_id, timestamp=warning.timestamp, mod_name=warning.mod_name,
+                             reason=warning.reason, expiration_time=warning.expiration_time, guild_id=warning.guild_id)
+
+    async def get_warnings(self, user_id: int, guild_id: int) -> List[RefWarning]:
+        return [self._to_warning(row) for row in self.warnings.select(user_id=user_id, guild_id=guild_id)]
+
+    async def get_active_warnings(self, user_id: int, guild_id: int):
+        now = datetime.now()
+        return [self._to_warning(row) for row in self.warnings.select(user_id=user_id, guild_id=guild_id)
+                if row["expiration_time"] > now]
+
+    async def get_all_warnings(self, guild_id: int) -> Dict[int, List[RefWarning]]:
+        warnings = {}
+        for row in sorted(self.warnings.select(guild_id=guild_id), key=lambda r: r["user_id"]):
+            warnings.setdefault(row["user_id"], []).append(self._to_warning(row))
+        return warnings
+
+    async def get_all_active_warnings(self, guild_id: int) -> Dict[int, List[RefWarning]]:
+        now = datetime.now()
+        warnings = {}
+        for row in sorted(self.warnings.select(guild_id=guild_id), key=lambda r: r["user_id"]):
+            if row["expiration_time"] > now:
+                warnings.setdefault(row["user_id"], []).append(self._to_warning(row))
+        return warnings
+
+    async def expire_warnings(self, user_id: int, guild_id: int):
+        self.warnings.update({"expiration_time": datetime.now()}, user_id=user_id, guild_id=guild_id)
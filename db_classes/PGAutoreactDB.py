@@ -1,9 +1,11 @@
-import asyncio
 import logging
-import asyncpg
 import discord
 
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+
+schema_version = 2
 
 creation = (
     """
@@ -11,9 +13,18 @@ creation = (
         id SERIAL PRIMARY KEY,
         regex VARCHAR,
         channel_id BIGINT,
-        emoji VARCHAR
+        emoji VARCHAR,
+        guild_id BIGINT
         )
     """,
+    # version 2: autoreactions apply in one guild
+    """
+    ALTER TABLE autoreactions ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
+)
+
+migrations = (
+    create_index(3, "autoreactions_guild_id_idx", "autoreactions", "guild_id"),
 )
 
 deletion = (
@@ -22,21 +33,23 @@ deletion = (
     """,
 )
 
+statements.register("autoreactions.insert",
+                    "INSERT into autoreactions(regex, channel_id, emoji, guild_id) VALUES($1, $2, $3, $4)")
+statements.register("autoreactions.delete", "DELETE FROM autoreactions WHERE id = $1 AND guild_id = $2")
+statements.register("autoreactions.all", "SELECT id, regex, channel_id, emoji, guild_id FROM autoreactions")
+statements.register("autoreactions.in_guild",
+                    "SELECT id, regex, channel_id, emoji, guild_id FROM autoreactions WHERE guild_id = $1")
+
 logger = logging.getLogger("Referee")
 
 
 # noinspection PyProtectedMember
 class PGAutoreactDB:
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("autoreactions",)
 
     def __init__(self):
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("autoreactions", backend=self)
 
 
     async def close(self):
@@ -48,49 +61,47 @@ class PGAutoreactDB:
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
 
 
-    async def add_autoreaction(self, emoji: discord.Emoji, regex: str, channel_id: int = None):
+    async def add_autoreaction(self, guild_id: int, emoji: discord.Emoji, regex: str, channel_id: int = None):
         """
         Save an autoreaction instruction into the db
         """
-
-        insert = (
-            "INSERT into autoreactions(regex, channel_id, emoji) VALUES($1, $2, $3)"
-        )
         async with self.pool.acquire() as con:
-            await con.execute(insert, regex, channel_id, emoji)
+            await statements.execute(con, "autoreactions.insert", regex, channel_id, emoji, guild_id)
 
 
-    async def remove_autoreaction(self, autoreaction_id: int):
+    async def remove_autoreaction(self, guild_id: int, autoreaction_id: int):
         """
         Remove a reaction instruction
+        :param guild_id: The guild the autoreaction applies in, ids of other guilds are ignored
         :param autoreaction_id: Primary key id from the db
         :return:
         """
-        query = "DELETE FROM autoreactions WHERE id = $1"
         async with self.pool.acquire() as con:
-            await con.execute(query, autoreaction_id)
+            await statements.execute(con, "autoreactions.delete", autoreaction_id, guild_id)
 
 
-    async def get_autoreactions_list(self):
-        query_all = "SELECT id, regex, channel_id, emoji FROM autoreactions"
-
+    async def get_autoreactions_list(self, guild_id: int = None):
+        """
+        :param guild_id: Only the autoreactions of this guild, those of all guilds if None
+        """
         async with self.pool.acquire() as con:
-            results = await con.fetch(query_all)
+            if guild_id is None:
+                results = await statements.fetch(con, "autoreactions.all")
+            else:
+                results = await statements.fetch(con, "autoreactions.in_guild", guild_id)
 
         autoreactions = [dict(
             id=row["id"],
             regex=row["regex"],
             channel_id=row["channel_id"],
-            emoji=row["emoji"])
+            emoji=row["emoji"],
+            guild_id=row["guild_id"])
             for row in results
         ]
 
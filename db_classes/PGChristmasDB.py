@@ -1,10 +1,10 @@
-import asyncio
 import logging
 from typing import Optional
 
-import asyncpg
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
 
-from config.config import PostGres as pg_config
+schema_version = 1
 
 creation = (
     """
@@ -30,18 +30,22 @@ deletion = (
     """
 )
 
+statements.register("christmas_competition.delete_cookie", "DELETE FROM aoc_cookie")
+statements.register("christmas_competition.insert_cookie", "INSERT INTO aoc_cookie(cookie) VALUES ($1)")
+statements.register("christmas_competition.cookie", "SELECT cookie FROM aoc_cookie")
+statements.register("christmas_competition.insert_user", "INSERT into aoc_users(aoc_name, discord_id) VALUES($1, $2)")
+statements.register("christmas_competition.update_user", "UPDATE aoc_users SET aoc_name=$1 WHERE discord_id=$2")
+statements.register("christmas_competition.all_users", "SELECT aoc_name, discord_id FROM aoc_users")
+statements.register("christmas_competition.user_by_discord_id",
+                    "SELECT aoc_name, discord_id FROM aoc_users WHERE discord_id = $1")
+statements.register("christmas_competition.user_by_aoc_name",
+                    "SELECT aoc_name, discord_id FROM aoc_users WHERE aoc_name = $1")
+
 logger = logging.getLogger("Referee")
 
 class PGChristmasDB:
     def __init__(self):
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("christmas_competition", backend=self)
 
     async def close(self):
         """
@@ -51,26 +55,20 @@ class PGChristmasDB:
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
+        return await self.pool.ensure_schema(schema_version, creation)
 
 
     async def update_cookie(self, cookie: str):
-        delete = "DELETE FROM aoc_cookie"
-        insert = "INSERT INTO aoc_cookie(cookie) VALUES ($1)"
         async with self.pool.acquire() as con:
-            await con.execute(delete)
-            await con.execute(insert, cookie)
+            await statements.execute(con, "christmas_competition.delete_cookie")
+            await statements.execute(con, "christmas_competition.insert_cookie", cookie)
 
     async def get_cookie(self):
-        query = "SELECT * FROM aoc_cookie"
         async with self.pool.acquire() as con:
-            results = await con.fetch(query)
+            results = await statements.fetch(con, "christmas_competition.cookie")
 
         results = [r["cookie"] for r in results]
 
@@ -78,21 +76,16 @@ class PGChristmasDB:
 
 
     async def add_user(self, aoc_name: str, discord_id: int):
-        insert = (
-            "INSERT into aoc_users(aoc_name, discord_id) VALUES($1, $2)"
-        )
         async with self.pool.acquire() as con:
-            await con.execute(insert, aoc_name, discord_id)
+            await statements.execute(con, "christmas_competition.insert_user", aoc_name, discord_id)
 
     async def update_user(self, aoc_name: str, discord_id: int):
-        update = "UPDATE aoc_users SET aoc_name=$1 WHERE discord_id=$2"
         async with self.pool.acquire() as con:
-            await con.execute(update, aoc_name, discord_id)
+            await statements.execute(con, "christmas_competition.update_user", aoc_name, discord_id)
 
     async def get_all_users(self):
-        query = "SELECT * FROM aoc_users"
         async with self.pool.acquire() as con:
-            results = await con.fetch(query)
+            results = await statements.fetch(con, "christmas_competition.all_users")
 
         return [(row["aoc_name"], row["discord_id"]) for row in results]
 
@@ -105,13 +98,13 @@ class PGChristmasDB:
             return aoc_name, discord_id
         if aoc_name is None:
             # discord_id is not None, we want aoc_name
-            query = "SELECT aoc_name, discord_id FROM aoc_users WHERE discord_id = $1"
+            statement = "christmas_competition.user_by_discord_id"
         else:
             # aoc_name is not None, we want discord_id
-            query = "SELECT aoc_name, discord_id FROM aoc_users WHERE aoc_name = $1"
+            statement = "christmas_competition.user_by_aoc_name"
 
         async with self.pool.acquire() as con:
-            results = await con.fetch(query, discord_id if aoc_name is None else aoc_name)
+            results = await statements.fetch(con, statement, discord_id if aoc_name is None else aoc_name)
 
         result = [(row["aoc_name"], row["discord_id"]) for row in results]
         if len(result) == 0:
@@ -1,19 +1,31 @@
-import asyncio
 import logging
 from typing import List, Tuple
 
-import asyncpg
 import discord
 
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+from db_classes.write_buffer import WriteBuffer
+
+schema_version = 2
 
 creation = (
     """
     CREATE TABLE IF NOT EXISTS emojisurvey (
         message_id BIGINT PRIMARY KEY,
-        emoji VARCHAR
+        emoji VARCHAR,
+        guild_id BIGINT
         )
     """,
+    # version 2: every guild runs its own survey
+    """
+    ALTER TABLE emojisurvey ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
+)
+
+migrations = (
+    create_index(3, "emojisurvey_guild_id_idx", "emojisurvey", "guild_id"),
 )
 
 deletion = (
@@ -22,55 +34,46 @@ deletion = (
     """,
 )
 
+statements.register("emojisurvey.in_guild", "SELECT message_id, emoji FROM emojisurvey WHERE guild_id = $1")
+statements.register("emojisurvey.delete", "DELETE FROM emojisurvey WHERE message_id = $1")
+
 logger = logging.getLogger("Referee")
 
 
 # noinspection PyProtectedMember
 class PGEmojiSurveyDB:
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("emojisurvey",)
 
     def __init__(self):
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("emojisurvey", backend=self)
+        self.messages = WriteBuffer(self.pool, "emojisurvey", ("message_id", "emoji", "guild_id"))
 
 
     async def close(self):
         """
         Closes the connection to the db
         """
+        await self.messages.flush("close")
         await self.pool.close()
 
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
-
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
 
-    async def add_message(self, message_id: int, emoji: str):
-
-        insert = (
-            "INSERT into emojisurvey(message_id, emoji) VALUES($1, $2)"
-        )
-        async with self.pool.acquire() as con:
-            await con.execute(insert, message_id, emoji)
 
+    async def add_message(self, guild_id: int, message_id: int, emoji: str):
+        await self.messages.add((message_id, emoji, guild_id))
 
-    async def get_all(self) -> List[Tuple[int, str]]:
-        query_all = "SELECT message_id, emoji FROM emojisurvey"
 
+    async def get_all(self, guild_id: int) -> List[Tuple[int, str]]:
+        await self.messages.flush()
         async with self.pool.acquire() as con:
-            results = await con.fetch(query_all)
+            results = await statements.fetch(con, "emojisurvey.in_guild", guild_id)
 
         messages = [(row["message_id"], row["emoji"]) for row in results]
 
@@ -82,6 +85,6 @@ class PGEmojiSurveyDB:
         :param autoreaction_id: Primary key id from the db
         :return:
         """
-        query = "DELETE FROM emojisurvey WHERE message_id = $1"
+        await self.messages.flush()
         async with self.pool.acquire() as con:
-            await con.execute(query, message_id)
+            await statements.execute(con, "emojisurvey.delete", message_id)
@@ -1,11 +1,13 @@
-import asyncio
 from typing import List
 
-import asyncpg
-
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index, drop_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+from db_classes.write_buffer import WriteBuffer
 from models.modmail_models import ModMail, ModMailAnswer
 
+schema_version = 2
+
 creation = (
     """
     CREATE TABLE IF NOT EXISTS modmail (
@@ -15,7 +17,8 @@ creation = (
         timestamp TIMESTAMP NOT NULL,
         content TEXT NOT NULL ,
         answer_count INTEGER,
-        message_id BIGINT
+        message_id BIGINT,
+        guild_id BIGINT
         )
     """,
     """
@@ -42,7 +45,18 @@ creation = (
 
     """
     CREATE INDEX IF NOT EXISTS answer_id_idx ON modmailanswers (answer_id);
+    """,
+    # version 2: mails go to the mods of one guild. answers belong to the guild of their mail
     """
+    ALTER TABLE modmail ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
+)
+
+# the answer ids of a mail come from the index alone, which makes the one on modmail_id redundant
+migrations = (
+    create_index(3, "modmailanswers_modmail_id_answer_id_idx", "modmailanswers", "modmail_id, answer_id"),
+    drop_index(4, "modmail_id_idx"),
+    create_index(5, "modmail_guild_id_idx", "modmail", "guild_id, id"),
 )
 
 deletion = (
@@ -58,93 +72,88 @@ deletion = (
 )
 
 
+# in the order of the ModMail fields, answers aside
+modmail_columns = "author_id, author_name, timestamp, content, id, message_id, guild_id, answer_count"
+
+statements.register("modmail.insert", "INSERT into modmail(author_id, author_name, timestamp, content, answer_count, "
+                                      "guild_id) VALUES($1, $2, $3, $4, 0, $5) RETURNING id")
+statements.register("modmail.assign_message_id", "UPDATE modmail SET message_id = $1 WHERE id = $2")
+statements.register("modmail.insert_answer", "INSERT into answers(mod_id, mod_name, timestamp, content, modmail_id) "
+                                             "VALUES($1, $2, $3, $4, $5) RETURNING id")
+statements.register("modmail.by_id", f"SELECT {modmail_columns} FROM modmail WHERE id = $1")
+statements.register("modmail.latest", f"SELECT {modmail_columns} FROM modmail WHERE guild_id = $1 "
+                                      f"ORDER BY id DESC LIMIT 1")
+statements.register("modmail.answer_ids", "SELECT answer_id from modmailanswers WHERE modmail_id = $1")
+statements.register("modmail.answer", "SELECT mod_id, mod_name, timestamp, content, modmail_id, id "
+                                      "FROM answers WHERE id = $1")
+
+
 # noinspection PyProtectedMember
 class PGModMailDB:
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("modmail",)
 
     def __init__(self):
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("modmail", backend=self)
+        # mails and answers are inserted right away, their callers need the ids they get
+        self.modmailanswers = WriteBuffer(self.pool, "modmailanswers", ("modmail_id", "answer_id"))
 
     async def close(self):
+        await self.modmailanswers.flush("close")
         await self.pool.close()
 
     async def create_tables(self):
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for command in creation:
-                await con.execute(command)
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
 
     async def put_modmail(self, mail: ModMail) -> int:
-        insert = """INSERT into modmail(author_id, author_name, timestamp, content, answer_count) 
-                    VALUES($1, $2, $3, $4, 0) RETURNING id
-                 """
         async with self.pool.acquire() as con:
-            row = await con.fetchrow(insert, mail.author_id, mail.author_name, mail.timestamp, mail.content)
+            row = await statements.fetchrow(con, "modmail.insert", mail.author_id, mail.author_name, mail.timestamp,
+                                            mail.content, mail.guild_id)
 
-        mail.modmail_id = row["id"]
-        return mail.modmail_id
+        return row["id"]
 
     async def assign_message_id(self, modmail_id: int, message_id: int):
-        update = """UPDATE modmail SET message_id = $1 WHERE id = $2"""
         async with self.pool.acquire() as con:
-            await con.execute(update, message_id, modmail_id)
+            await statements.execute(con, "modmail.assign_message_id", message_id, modmail_id)
 
     async def put_answer(self, answer: ModMailAnswer) -> int:
-        insert = """INSERT into answers(mod_id, mod_name, timestamp, content, modmail_id) 
-                    VALUES($1, $2, $3, $4, $5) RETURNING id
-                 """
         async with self.pool.acquire() as con:
-            answer_id = await con.fetchrow(insert, answer.mod_id, answer.mod_name, answer.timestamp, answer.content,
-                                           answer.modmail.modmail_id
-                                           )
+            answer_id = await statements.fetchrow(con, "modmail.insert_answer", answer.mod_id, answer.mod_name,
+                                                  answer.timestamp, answer.content, answer.modmail.modmail_id)
 
         await self._put_modmailanswer(answer.modmail.modmail_id, answer_id["id"])
         return answer_id
 
     async def _put_modmailanswer(self, modmail_id: int, answer_id: int):
-        insert = """INSERT into modmailanswers(modmail_id, answer_id) 
-                    VALUES($1, $2)
-                 """
-        async with self.pool.acquire() as con:
-            await con.execute(insert, modmail_id, answer_id)
+        await self.modmailanswers.add((modmail_id, answer_id))
+
+    async def _to_modmail(self, row) -> ModMail:
+        author_id, author_name, timestamp, content, modmail_id, message_id, guild_id, answer_count = row
+        mail = ModMail(author_id, author_name, timestamp, content, (), modmail_id, message_id, guild_id)
+        if answer_count > 0:
+            mail = mail._replace(answers=tuple(await self.get_answers(mail)))
+        return mail
 
     async def get_modmail(self, modmail_id: int) -> ModMail:
-        query = "SELECT author_id, author_name, timestamp, content, id, message_id, answer_count FROM modmail " \
-                "WHERE id = $1"
         async with self.pool.acquire() as con:
-            row = await con.fetchrow(query, modmail_id)
-
-        mail = ModMail(author_id=row["author_id"], author_name=row["author_name"], timestamp=row["timestamp"],
-                       content=row["content"], answers=[],
-                       modmail_id=row["id"], message_id=row["message_id"])
-        if row["answer_count"] > 0:  # answers_count
-            mail.answers = self.get_answers(mail)
+            row = await statements.fetchrow(con, "modmail.by_id", modmail_id)
 
-        return mail
+        if row is None:
+            return None
+        return await self._to_modmail(row)
 
-    async def get_latest_modmail(self) -> ModMail:
-        query = "SELECT author_id, author_name, timestamp, content, id, message_id, answer_count FROM modmail " \
-                "ORDER BY id DESC LIMIT 1"
+    async def get_latest_modmail(self, guild_id: int) -> ModMail:
         async with self.pool.acquire() as con:
-            row = await con.fetchrow(query)
-
-        mail = ModMail(author_id=row["author_id"], author_name=row["author_name"], timestamp=row["timestamp"],
-                       content=row["content"], answers=[],
-                       modmail_id=row["id"], message_id=row["message_id"])
-        if row["answer_count"] > 0:  # answers_count
-            mail.answers = self.get_answers(mail)
+            row = await statements.fetchrow(con, "modmail.latest", guild_id)
 
-        return mail
+        if row is None:
+            return None
+        return await self._to_modmail(row)
 
     async def get_answers(self, modmail: ModMail) -> List[ModMailAnswer]:
-        id_query = """SELECT answer_id from modmailanswers WHERE modmail_id = $1"""
+        await self.modmailanswers.flush()
         async with self.pool.acquire() as con:
-            rows = await con.fetch(id_query, modmail.modmail_id)
+            rows = await statements.fetch(con, "modmail.answer_ids", modmail.modmail_id)
 
         answer_ids = [r["answer_id"] for r in rows]
         answers = [await self.get_answer(a_id, modmail) for a_id in answer_ids]
@@ -152,15 +161,9 @@ class PGModMailDB:
         return answers
 
     async def get_answer(self, answer_id: int, modmail: ModMail = None) -> ModMailAnswer:
-        query = "SELECT mod_id, mod_name, timestamp, content, modmail_id, id FROM answers WHERE id = $1"
         async with self.pool.acquire() as con:
-            row = await con.fetchrow(query, answer_id)
-
-        answer = ModMailAnswer(mod_id=row["mod_id"], mod_name=row["mod_name"], timestamp=row["timestamp"],
-                               content=row["content"], modmail=modmail)
+            row = await statements.fetchrow(con, "modmail.answer", answer_id)
 
         if not modmail:
             modmail = await self.get_modmail(row["modmail_id"])
-            answer.modmail = modmail
-
-        return answer
+        return ModMailAnswer(*row[:4], modmail)
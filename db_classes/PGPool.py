@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Sequence
+
+import asyncpg
+
+from config.config import PostGres as pg_config
+from db_classes.migrations import Migration, migrate
+from db_classes.statements import PreparingConnection, statements
+from utils import metrics
+from utils.perf import perf
+
+logger = logging.getLogger("Referee")
+
+version_table = """
+    CREATE TABLE IF NOT EXISTS schema_versions (
+        name VARCHAR PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    """
+
+
+class AcquireStats:
+    """
+    Counters for the connections acquired through one :class:`PoolHandle`
+    """
+
+    def __init__(self):
+        self.acquired = 0
+        self.in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.quota_saturated = 0
+        self.pool_saturated = 0
+
+    def record_wait(self, wait: float):
+        self.acquired += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    @property
+    def wait_avg(self) -> float:
+        return self.wait_total / self.acquired if self.acquired else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "in_use": self.in_use,
+            "wait_total": self.wait_total,
+            "wait_avg": self.wait_avg,
+            "wait_max": self.wait_max,
+            "quota_saturated": self.quota_saturated,
+            "pool_saturated": self.pool_saturated,
+        }
+
+
+class PoolHandle:
+    """
+    The part of the shared pool a single db class gets to see.
+    Offers the same ``acquire()`` and ``close()`` as :class:`asyncpg.Pool`,
+    but limits the number of connections held at once to the extensions quota
+    """
+
+    def __init__(self, registry: "PGPool", name: str, quota: int = 0, backend=None):
+        self.registry = registry
+        self.name = name
+        self.quota = quota
+        self.backend = backend
+        self.stats = AcquireStats()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._init_task: Optional[asyncio.Future] = None
+
+    def acquire(self):
+        """
+        Acquires a connection once the schema of the extension has been set up
+        """
+        return self._acquire(wait_for_init=True)
+
+    @asynccontextmanager
+    async def _acquire(self, wait_for_init: bool):
+        if wait_for_init and self._init_task is not None and not self._init_task.done():
+            await asyncio.shield(self._init_task)
+        pool = await self.registry.get_pool()
+        start = time.perf_counter()
+
+        if self.quota:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.quota)
+            if self._semaphore.locked():
+                self.stats.quota_saturated += 1
+            await self._semaphore.acquire()
+
+        try:
+            if self.registry.in_use >= self.registry.max_size:
+                self.stats.pool_saturated += 1
+            async with pool.acquire() as con:
+                self.stats.record_wait(time.perf_counter() - start)
+                self.stats.in_use += 1
+                self.registry.in_use += 1
+                try:
+                    yield con
+                finally:
+                    self.stats.in_use -= 1
+                    self.registry.in_use -= 1
+                    # waiting for and holding the connection both count as db time of the running listener
+                    perf.add_db_time(time.perf_counter() - start)
+        finally:
+            if self._semaphore:
+                self._semaphore.release()
+
+    async def ensure_schema(self, version: int, queries: Sequence[str], migrations: Sequence[Migration] = ()) -> bool:
+        """
+        Brings the schema of the extension up to date, see :func:`migrations.migrate`
+        :param version: The schema version the creation queries create
+        :param queries: The DDL statements creating the tables
+        :param migrations: The steps to the versions after that
+        :return: Whether anything had to be run
+        """
+        async with self._acquire(wait_for_init=False) as con:
+            return await migrate(con, self.name, version, queries, migrations)
+
+    def start_init(self) -> asyncio.Future:
+        """
+        Schedules the schema setup of the db class, connections acquired before it is done wait for it
+        """
+        if self._init_task is None:
+            self._init_task = asyncio.ensure_future(self._timed_init())
+        return self._init_task
+
+    async def _timed_init(self):
+        start = time.perf_counter()
+        try:
+            await asyncio.shield(self.registry.ensure_version_table())
+            changed = await self.backend.create_tables()
+        except Exception as e:
+            logger.error(f"Schema setup for {self.name} failed after {time.perf_counter() - start:.3f}s: {e}")
+            raise
+        logger.info(f"Schema setup for {self.name} took {time.perf_counter() - start:.3f}s"
+                    f"{'' if changed else ' (already current)'}")
+
+    async def close(self):
+        """
+        Gives up this handle. The shared pool is closed once the last handle is gone
+        """
+        await self.registry.release(self)
+
+
+class PGPool:
+    """
+    Process-wide registry around a single :class:`asyncpg.Pool`.
+    Every db class registers itself here instead of opening its own pool
+    """
+
+    def __init__(self, min_size: int, max_size: int, quotas: Dict[str, int] = None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.quotas = quotas or {}
+        self.in_use = 0
+        self.handles: Dict[str, PoolHandle] = {}
+        self._pool: Optional[asyncpg.Pool] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version_table_task: Optional[asyncio.Future] = None
+
+    def register(self, name: str, backend=None) -> PoolHandle:
+        """
+        Creates the handle a db class uses to talk to the db
+        :param name: Name of the extension the db class belongs to, used for quotas, stats and schema versions
+        :param backend: The db class, its ``create_tables`` is run by :meth:`init_backends`
+        """
+        handle = PoolHandle(registry=self, name=name, quota=self.quotas.get(name, 0), backend=backend)
+        self.handles[name] = handle
+        if backend is not None and self._version_table_task is not None:
+            # extension (re)loaded after startup
+            handle.start_init()
+        return handle
+
+    async def get_pool(self) -> asyncpg.Pool:
+        """
+        Returns the shared pool, creates it on first use
+        """
+        if self._pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        host=pg_config.PG_Host,
+                        database=pg_config.PG_Database,
+                        user=pg_config.PG_User,
+                        password=pg_config.PG_Password,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        connection_class=PreparingConnection,
+                        init=self._init_connection
+                    )
+                    logger.info(f"Created shared db pool ({self.min_size}-{self.max_size} connections)")
+        return self._pool
+
+    async def _init_connection(self, con: PreparingConnection):
+        # the extensions registered by now, those loaded later prepare their statements on first use
+        await statements.prepare_all(con, self.handles)
+
+    def ensure_version_table(self) -> asyncio.Future:
+        """
+        Creates the table holding the schema versions of all extensions, once
+        """
+        if self._version_table_task is None:
+            self._version_table_task = asyncio.ensure_future(self._create_version_table())
+        return self._version_table_task
+
+    async def _create_version_table(self):
+        pool = await self.get_pool()
+        async with pool.acquire() as con:
+            await con.execute(version_table)
+
+    async def init_backends(self):
+        """
+        Sets up the schemas of all registered db classes concurrently.
+        Meant to run as a task next to the gateway login instead of blocking before it
+        """
+        start = time.perf_counter()
+        handles = [h for h in self.handles.values() if h.backend is not None]
+        results = await asyncio.gather(*(h.start_init() for h in handles), return_exceptions=True)
+        failed = [h.name for h, r in zip(handles, results) if isinstance(r, Exception)]
+        logger.info(f"Set up {len(handles) - len(failed)}/{len(handles)} db schemas in {time.perf_counter() - start:.3f}s"
+                    + (f", failed: {', '.join(failed)}" if failed else ""))
+
+    async def adopt_unassigned_rows(self, guild_id: int) -> Dict[str, int]:
+        """
+        Assigns the rows written before the tables had a guild_id column to a guild.
+        Only correct while the bot is in a single guild, the one all of these rows were written in
+        :return: The number of adopted rows per table
+        """
+        adopted = {}
+        for handle in list(self.handles.values()):
+            for table in getattr(handle.backend, "guild_tables", ()):
+                async with handle.acquire() as con:
+                    status = await con.execute(f"UPDATE {table} SET guild_id = $1 WHERE guild_id IS NULL", guild_id)
+                adopted[table] = int(status.split()[-1])
+        return adopted
+
+    async def release(self, handle: PoolHandle):
+        if self.handles.get(handle.name) is handle:
+            del self.handles[handle.name]
+        if not self.handles:
+            await self.close()
+
+    async def close(self):
+        """
+        Closes the shared pool
+        """
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+
+    def stats(self) -> dict:
+        """
+        Current pool usage, overall and per extension
+        """
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "in_use": self.in_use,
+            "extensions": {name: dict(handle.stats.as_dict(), quota=handle.quota)
+                           for name, handle in self.handles.items()}
+        }
+
+
+pg_pool = PGPool(min_size=pg_config.PG_PoolMinSize, max_size=pg_config.PG_PoolMaxSize,
+                 quotas=pg_config.PG_PoolQuotas)
+
+
+def _extension_stats(key: str):
+    return lambda: (((name, ), s[key]) for name, s in pg_pool.stats()["extensions"].items())
+
+
+metrics.registry.gauge("db_pool_in_use", "Connections of the shared pool currently in use",
+                       callback=lambda: [((), pg_pool.in_use)])
+metrics.registry.gauge("db_pool_max_size", "Maximum size of the shared pool",
+                       callback=lambda: [((), pg_pool.max_size)])
+metrics.registry.gauge("db_pool_extension_in_use", "Connections currently held per extension", ["extension"],
+                       callback=_extension_stats("in_use"))
+metrics.registry.counter("db_pool_acquired_total", "Connections acquired per extension", ["extension"],
+                         callback=_extension_stats("acquired"))
+metrics.registry.counter("db_pool_acquire_wait_seconds_total", "Time spent waiting for connections per extension",
+                         ["extension"], callback=_extension_stats("wait_total"))
+metrics.registry.counter("db_pool_quota_saturated_total", "Acquires that had to wait for the extensions quota",
+                         ["extension"], callback=_extension_stats("quota_saturated"))
+metrics.registry.counter("db_pool_saturated_total", "Acquires made while the whole pool was in use", ["extension"],
+                         callback=_extension_stats("pool_saturated"))
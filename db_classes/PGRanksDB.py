@@ -1,21 +1,37 @@
-import asyncio
 import asyncpg
 
 from models.ranks_models import Rank
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+
+schema_version = 2
 
 creation = (
     """
     CREATE TABLE IF NOT EXISTS ranks (
         id SERIAL PRIMARY KEY,
-        name VARCHAR UNIQUE NOT NULL,
+        name VARCHAR NOT NULL,
         role_id BIGINT NOT NULL,
-        message_id BIGINT NOT NULL
+        message_id BIGINT NOT NULL,
+        guild_id BIGINT
         )
     """,
     """
     CREATE INDEX IF NOT EXISTS ranks_message_id_idx ON ranks (message_id);
+    """,
+    # version 2: ranks belong to a guild, their names are unique per guild
+    """
+    ALTER TABLE ranks ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
     """
+    ALTER TABLE ranks DROP CONSTRAINT IF EXISTS ranks_name_key
+    """,
+)
+
+migrations = (
+    create_index(3, "ranks_role_id_idx", "ranks", "role_id"),
+    create_index(4, "ranks_guild_id_name_idx", "ranks", "guild_id, name", unique=True),
 )
 
 deletion = (
@@ -25,19 +41,26 @@ deletion = (
 )
 
 
+# in the order of the Rank fields
+rank_columns = "name, role_id, message_id, guild_id"
+
+statements.register("ranks.insert", f"INSERT into ranks({rank_columns}) VALUES($1, $2, $3, $4)")
+statements.register("ranks.by_role_id", f"SELECT {rank_columns} FROM ranks where role_id = $1")
+statements.register("ranks.by_name", f"SELECT {rank_columns} FROM ranks where name = $1 AND guild_id = $2")
+statements.register("ranks.by_message_id", f"SELECT {rank_columns} FROM ranks where message_id = $1")
+statements.register("ranks.delete", "DELETE FROM ranks WHERE role_id = $1")
+statements.register("ranks.all", f"SELECT {rank_columns} FROM ranks")
+statements.register("ranks.all_in_guild", f"SELECT {rank_columns} FROM ranks WHERE guild_id = $1")
+
+
 # noinspection PyProtectedMember
 class PGRanksDB:
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("ranks",)
 
     def __init__(self):
 
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("ranks", backend=self)
 
     async def close(self):
         """
@@ -47,68 +70,64 @@ class PGRanksDB:
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
 
     async def add_rank(self, rank: Rank):
         """
         Inserts a rank row into the db
         :param rank: The new rank object that
         """
-
-        insert = "INSERT into ranks(name, role_id, message_id) " \
-                 "VALUES($1, $2, $3)"
         async with self.pool.acquire() as con:
-            await con.execute(insert, rank.name, rank.role_id, rank.message_id)
+            await statements.execute(con, "ranks.insert", *rank)
 
-    async def get_rank(self, role_id: int = None, name: str = None, message_id: int = None) -> Rank:
+    async def get_rank(self, role_id: int = None, name: str = None, message_id: int = None,
+                       guild_id: int = None) -> Rank:
         """
         This method looks up a rank either by discord role ID, name or discord message ID
         :param role_id: Discord id of the ranks role
         :param name: The name of the rank
         :param message_id: The discord id of the ranks selection message
+        :param guild_id: The guild a rank is looked up in by name, names are only unique per guild
         :return: The found and reconstructed Rank object
         """
         if role_id is None and name is None and message_id is None:
             raise RuntimeError("get_rank called without arguments")
 
         if role_id:
-            query = "SELECT name, role_id, message_id FROM ranks where role_id = $1"
+            statement, args = "ranks.by_role_id", (role_id,)
 
         elif name:
-            query = "SELECT name, role_id, message_id FROM ranks where name = $1"
+            statement, args = "ranks.by_name", (name, guild_id)
 
         else:  # message_id
-            query = "SELECT name, role_id, message_id FROM ranks where message_id = $1"
+            statement, args = "ranks.by_message_id", (message_id,)
 
         async with self.pool.acquire() as con:
-            result: asyncpg.Record = await con.fetchrow(query, role_id or name or message_id)
+            result: asyncpg.Record = await statements.fetchrow(con, statement, *args)
 
         if result:
-            return Rank(name=result["name"], role_id=result["role_id"], message_id=result["message_id"])
+            return Rank._make(result)
 
     async def delete_rank(self, role_id: int):
         """
         Delete a rank by discord role ID
         :param role_id: The ID of the role connected to the rank
         """
-        query = "DELETE FROM ranks WHERE role_id = $1"
-
         async with self.pool.acquire() as con:
-            await con.execute(query, role_id)
+            await statements.execute(con, "ranks.delete", role_id)
 
-    async def get_all_ranks(self):
+    async def get_all_ranks(self, guild_id: int = None):
         """
         Get all entries
+        :param guild_id: Only the ranks of this guild, those of all guilds if None
         :return: List of ranks
         """
         async with self.pool.acquire() as con:
-            query = "SELECT name, role_id, message_id FROM ranks"
-
-            rows = await con.fetch(query)
-            return [Rank(name=row["name"], role_id=row["role_id"], message_id=row["message_id"]) for row in rows]
+            if guild_id is None:
+                rows = await statements.fetch(con, "ranks.all")
+            else:
+                rows = await statements.fetch(con, "ranks.all_in_guild", guild_id)
+            return list(map(Rank._make, rows))
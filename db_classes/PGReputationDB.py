@@ -1,12 +1,15 @@
-import asyncio
+import itertools
 import logging
-from typing import List
+from typing import List, Sequence
 
-import asyncpg
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
 from models.reputation_models import Thank
 from datetime import datetime, timedelta
 
+schema_version = 2
+
 creation = (
     """
     CREATE TABLE IF NOT EXISTS thanks (
@@ -14,9 +17,24 @@ creation = (
         target_user_id BIGINT,
         channel_id BIGINT,
         message_id BIGINT,
-        time TIMESTAMPTZ
+        time TIMESTAMPTZ,
+        guild_id BIGINT
     )
     """,
+    # version 2: thanks are counted per guild
+    """
+    ALTER TABLE thanks ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
+)
+
+# every thank, rep and scoreboard filters thanks by guild and target or source over a time range.
+# The cooldowns are loaded by time across all guilds
+migrations = (
+    create_index(3, "thanks_guild_id_target_user_id_time_idx", "thanks", "guild_id, target_user_id, time"),
+    create_index(4, "thanks_guild_id_source_user_id_time_idx", "thanks", "guild_id, source_user_id, time"),
+    create_index(5, "thanks_time_idx", "thanks", "time"),
+    # was part of the creation queries, where it built under the lock of adding the guild_id column
+    create_index(6, "thanks_guild_id_time_idx", "thanks", "guild_id, time"),
 )
 
 deletion = (
@@ -25,20 +43,36 @@ deletion = (
     """,
 )
 
+# get_thanks filters by any combination of these columns, each combination is a statement of its own
+thanks_filters = ("source_user_id", "target_user_id", "guild_id")
+
+
+def thanks_statement(columns: Sequence[str]) -> str:
+    return "reputation.thanks" + "".join(f"_by_{column}" for column in columns)
+
+
+statements.register("reputation.insert", "INSERT INTO thanks (source_user_id, target_user_id, channel_id, message_id, "
+                                         "time, guild_id) VALUES($1, $2, $3, $4, $5, $6)")
+statements.register("reputation.user_rep", "SELECT COUNT(*) FROM thanks WHERE target_user_id = $1 and guild_id = $2 "
+                                           "and time >= $3 and time <= $4")
+for used in itertools.product((False, True), repeat=len(thanks_filters)):
+    filtered = [column for column, use in zip(thanks_filters, used) if use]
+    statements.register(thanks_statement(filtered),
+                        "SELECT source_user_id, target_user_id, channel_id, message_id, time, guild_id FROM thanks "
+                        "WHERE time >= $1 AND time <= $2"
+                        + "".join(f" AND {column} = ${i + 3}" for i, column in enumerate(filtered))
+                        + " ORDER BY time")
+
 logger = logging.getLogger("Referee")
 
 
 # noinspection PyProtectedMember
 class PGReputationDB:
-    def __init__(self):
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("thanks",)
 
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+    def __init__(self):
+        self.pool = pg_pool.register("reputation", backend=self)
 
 
     async def close(self):
@@ -50,64 +84,49 @@ class PGReputationDB:
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
 
 
-    async def get_user_rep(self, user_id, since=datetime(day=1, month=1, year=2000), until=None):
+    async def get_user_rep(self, user_id, guild_id, since=datetime(day=1, month=1, year=2000), until=None):
         if not until:
             until = datetime.now()
-        sql = "SELECT COUNT(*) FROM thanks WHERE target_user_id = $1 and time >= $2 and time <= $3"
 
         async with self.pool.acquire() as con:
-            results = await con.fetch(sql, user_id, since, until)
-
-        return results[0][0]
+            return await statements.fetchval(con, "reputation.user_rep", user_id, guild_id, since, until)
 
 
     async def add_thank(self, new_thank: Thank):
-        sql = "INSERT INTO thanks (source_user_id, target_user_id, channel_id, message_id, time) VALUES($1, $2, $3, $4, $5)"
+        # written right away, the rep of the thanked user is read right after
         async with self.pool.acquire() as con:
-            await con.execute(sql, new_thank.source_user_id, new_thank.target_user_id, new_thank.channel_id,
-                              new_thank.message_id, new_thank.timestamp)
+            await statements.execute(con, "reputation.insert", *new_thank)
 
 
-    async def get_thanks(self, since=datetime(day=1, month=1, year=2000), until=None, source_user_id=None, target_user_id=None) -> List[Thank]:
+    async def get_thanks(self, since=datetime(day=1, month=1, year=2000), until=None, source_user_id=None,
+                         target_user_id=None, guild_id=None) -> List[Thank]:
+        """
+        :param guild_id: Only thanks given in this guild, those of all guilds if None
+        """
         if not until:
             until = datetime(day=1,month=1,year=3000)
 
+        filtered, args = [], [since, until]
+        for column, value in zip(thanks_filters, (source_user_id, target_user_id, guild_id)):
+            if value:
+                filtered.append(column)
+                args.append(value)
+
         async with self.pool.acquire() as con:
-            if source_user_id and target_user_id:
-                sql = "SELECT * FROM thanks WHERE time >= $1 AND time <= $2 AND source_user_id = $3 AND target_user_id = $4 ORDER BY time"
-                fetch = con.fetch(sql, since, until, source_user_id, target_user_id)
-            elif source_user_id:
-                sql = "SELECT * FROM thanks WHERE time >= $1 AND time <= $2 AND source_user_id = $3 ORDER BY time"
-                fetch = con.fetch(sql, since, until, source_user_id)
-            elif target_user_id:
-                sql = "SELECT * FROM thanks WHERE time >= $1 AND time <= $2 AND target_user_id = $3 ORDER BY time"
-                fetch = con.fetch(sql, since, until, target_user_id)
-            else:
-                sql = "SELECT * FROM thanks WHERE time >= $1 AND time <= $2 ORDER BY time"
-                fetch = con.fetch(sql, since, until)
-
-            results = [Thank(source_user_id=r["source_user_id"],
-                             target_user_id=r["target_user_id"],
-                             message_id=r["message_id"],
-                             channel_id=r["channel_id"],
-                             timestamp=r["time"])
-                       for r in await fetch]
+            results = list(map(Thank._make, await statements.fetch(con, thanks_statement(filtered), *args)))
 
         return results
 
-    async def get_leaderboard(self, since=datetime(day=1, month=1, year=2000), until=None):
+    async def get_leaderboard(self, guild_id, since=datetime(day=1, month=1, year=2000), until=None):
         if not until:
             until = datetime.now()
-        thanks = await self.get_thanks(since, until)
+        thanks = await self.get_thanks(since, until, guild_id=guild_id)
         if not thanks:
             return []
 
@@ -1,17 +1,21 @@
-import asyncio
-from typing import List
+from typing import List, Optional
 
 import asyncpg
 
 from models.rolegroups_models import Rolegroup
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+
+schema_version = 2
 
 creation = (
     """
     CREATE TABLE IF NOT EXISTS rolegroups (
         id SERIAL PRIMARY KEY,
-        name VARCHAR UNIQUE NOT NULL,
-        message_id BIGINT NOT NULL
+        name VARCHAR NOT NULL,
+        message_id BIGINT NOT NULL,
+        guild_id BIGINT
         )
     """,
     """CREATE TABLE IF NOT EXISTS rolegroup_roles (
@@ -20,6 +24,21 @@ creation = (
         emoji VARCHAR NOT NULL
     )
     """,
+    # version 2: rolegroups belong to a guild, their names are unique per guild.
+    # rolegroup_roles rows belong to the guild of their rolegroup
+    """
+    ALTER TABLE rolegroups ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
+    """
+    ALTER TABLE rolegroups DROP CONSTRAINT IF EXISTS rolegroups_name_key
+    """,
+)
+
+# rolegroups are looked up by their message on every reaction, then their roles by rolegroup
+migrations = (
+    create_index(3, "rolegroups_message_id_idx", "rolegroups", "message_id"),
+    create_index(4, "rolegroup_roles_rolegroup_id_idx", "rolegroup_roles", "rolegroup_id"),
+    create_index(5, "rolegroups_guild_id_name_idx", "rolegroups", "guild_id, name", unique=True),
 )
 
 deletion = (
@@ -32,19 +51,30 @@ deletion = (
 )
 
 
+statements.register("rolegroups.insert",
+                    "INSERT into rolegroups(name, message_id, guild_id) VALUES($1, $2, $3) RETURNING id")
+statements.register("rolegroups.insert_role",
+                    "INSERT into rolegroup_roles(rolegroup_id, role_id, emoji) VALUES($1, $2, $3)")
+statements.register("rolegroups.rename", "UPDATE rolegroups SET name = $1 WHERE id = $2")
+statements.register("rolegroups.delete_role", "DELETE FROM rolegroup_roles WHERE rolegroup_id=$1 AND emoji=$2")
+statements.register("rolegroups.by_id", "SELECT id, name, message_id, guild_id FROM rolegroups where id = $1")
+statements.register("rolegroups.by_message_id",
+                    "SELECT id, name, message_id, guild_id FROM rolegroups where message_id = $1")
+statements.register("rolegroups.roles", "SELECT emoji, role_id FROM rolegroup_roles where rolegroup_id = $1")
+statements.register("rolegroups.delete", "DELETE FROM rolegroups WHERE id = $1")
+statements.register("rolegroups.delete_roles", "DELETE FROM rolegroup_roles WHERE rolegroup_id = $1")
+statements.register("rolegroups.all_ids", "SELECT id FROM rolegroups")
+statements.register("rolegroups.ids_in_guild", "SELECT id FROM rolegroups WHERE guild_id = $1")
+
+
 # noinspection PyProtectedMember
 class PGRolegroupsDB:
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("rolegroups",)
 
     def __init__(self):
 
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("rolegroups", backend=self)
 
     async def close(self):
         """
@@ -54,30 +84,24 @@ class PGRolegroupsDB:
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
 
     async def add_rolegroup(self, rolegroup: Rolegroup) -> Rolegroup:
         """
         Inserts a rolegroup row into the db
         :param rolegroup: The new rolegroup_cmd object
+        :return: The rolegroup with its db id
         """
-
-        insert = "INSERT into rolegroups(name, message_id) VALUES($1, $2) RETURNING id"
         async with self.pool.acquire() as con:
-            res = await con.fetch(insert, rolegroup.name, rolegroup.message_id)
-            rolegroup_id = res[0]["id"]
-            rolegroup.db_id = rolegroup_id
+            rolegroup_id = await statements.fetchval(con, "rolegroups.insert", rolegroup.name, rolegroup.message_id,
+                                                     rolegroup.guild_id)
+            rolegroup = rolegroup._replace(db_id=rolegroup_id)
 
-        insert = "INSERT into rolegroup_roles(rolegroup_id, role_id, emoji) VALUES($1, $2, $3)"
-        async with self.pool.acquire() as con:
-            for emoji, role_id in rolegroup.roles.items():
-                await con.execute(insert, rolegroup_id, role_id, emoji)
+            for emoji, role_id in rolegroup.roles:
+                await statements.execute(con, "rolegroups.insert_role", rolegroup_id, role_id, emoji)
 
         return rolegroup
 
@@ -90,23 +114,20 @@ class PGRolegroupsDB:
         old = await self.get_rolegroup(rolegroup_id=rolegroup.db_id)
 
         if old.name != rolegroup.name:
-            update = f"UPDATE rolegroups SET name = $1 WHERE id = $2"
             async with self.pool.acquire() as con:
-                await con.execute(update, rolegroup.name, rolegroup.db_id)
-        old_roles = old.roles
-        new_roles = rolegroup.roles
+                await statements.execute(con, "rolegroups.rename", rolegroup.name, rolegroup.db_id)
+        old_roles = set(old.roles)
+        new_roles = set(rolegroup.roles)
 
-        remove = [x for x in old_roles.items() if x not in new_roles.items()]
-        add = [x for x in new_roles.items() if x not in old_roles.items()]
+        remove = [x for x in old.roles if x not in new_roles]
+        add = [x for x in rolegroup.roles if x not in old_roles]
 
-        delete = f"DELETE FROM rolegroup_roles WHERE rolegroup_id=$1 AND emoji=$2"
-        insert = f"INSERT into rolegroup_roles(rolegroup_id, role_id, emoji) VALUES($1, $2, $3)"
         async with self.pool.acquire() as con:
             for emoji, _ in remove:
-                await con.execute(delete, rolegroup.db_id, emoji)
+                await statements.execute(con, "rolegroups.delete_role", rolegroup.db_id, emoji)
 
             for emoji, role_id in add:
-                await con.execute(insert, rolegroup.db_id, role_id, emoji)
+                await statements.execute(con, "rolegroups.insert_role", rolegroup.db_id, role_id, emoji)
 
         return await self.get_rolegroup(rolegroup_id=rolegroup.db_id)
 
@@ -119,18 +140,20 @@ class PGRolegroupsDB:
         if not rolegroup_id and not message_id:
             raise Exception("get_rolegroup called without arguments")
 
-        query = f"SELECT id, name, message_id FROM rolegroups where {'id' if rolegroup_id else 'message_id'} = $1"
+        statement = "rolegroups.by_id" if rolegroup_id else "rolegroups.by_message_id"
 
         async with self.pool.acquire() as con:
-            result: asyncpg.Record = await con.fetchrow(query, rolegroup_id or message_id)
+            return await self._get_rolegroup(con, statement, rolegroup_id or message_id)
+
+    @staticmethod
+    async def _get_rolegroup(con, statement: str, key: int) -> Optional[Rolegroup]:
+        # on the connection the caller holds, acquiring another one could wait forever for the extension's quota
+        result: asyncpg.Record = await statements.fetchrow(con, statement, key)
 
-            if result:
-                r = Rolegroup(name=result["name"], message_id=result["message_id"], db_id=result["id"])
-                query = "SELECT role_id, emoji FROM rolegroup_roles where rolegroup_id = $1"
-                rows: asyncpg.Record = await con.fetch(query, r.db_id)
-                for row in rows:
-                    r.add_role(role_id=row["role_id"], emoji=row["emoji"])
-                return r
+        if result:
+            rows: List[asyncpg.Record] = await statements.fetch(con, "rolegroups.roles", result["id"])
+            return Rolegroup(name=result["name"], message_id=result["message_id"], db_id=result["id"],
+                             guild_id=result["guild_id"], roles=tuple(map(tuple, rows)))
 
     async def delete_rolegroup(self, rolegroup_id: int):
         """
@@ -138,20 +161,19 @@ class PGRolegroupsDB:
         :param rolegroup_id:
         :param id: The db id of the rolegroup
         """
-        query = "DELETE FROM rolegroups WHERE id = $1"
-
         async with self.pool.acquire() as con:
-            await con.execute(query, rolegroup_id)
-            query = "DELETE FROM rolegroup_roles WHERE rolegroup_id = $1"
-            await con.execute(query, rolegroup_id)
+            await statements.execute(con, "rolegroups.delete", rolegroup_id)
+            await statements.execute(con, "rolegroups.delete_roles", rolegroup_id)
 
-    async def get_all_rolegroups(self) -> List[Rolegroup]:
+    async def get_all_rolegroups(self, guild_id: int = None) -> List[Rolegroup]:
         """
         Get all entries
+        :param guild_id: Only the rolegroups of this guild, those of all guilds if None
         :return: List of Rolegroup objects
         """
         async with self.pool.acquire() as con:
-            query = "SELECT id FROM rolegroups"
-
-            rows = await con.fetch(query)
-            return [await self.get_rolegroup(rolegroup_id=row["id"]) for row in rows]
+            if guild_id is None:
+                rows = await statements.fetch(con, "rolegroups.all_ids")
+            else:
+                rows = await statements.fetch(con, "rolegroups.ids_in_guild", guild_id)
+            return [await self._get_rolegroup(con, "rolegroups.by_id", row["id"]) for row in rows]
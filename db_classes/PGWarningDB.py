@@ -1,10 +1,12 @@
-import asyncio
 import logging
 from typing import Dict, List
-import asyncpg
 
 from models.warnings_models import RefWarning
-from config.config import PostGres as pg_config
+from db_classes.migrations import create_index, drop_index
+from db_classes.PGPool import pg_pool
+from db_classes.statements import statements
+
+schema_version = 2
 
 creation = (
     """
@@ -14,12 +16,19 @@ creation = (
         timestamp TIMESTAMP NOT NULL,
         mod_name VARCHAR,
         expiration_time TIMESTAMP NOT NULL,
-        reason VARCHAR
+        reason VARCHAR,
+        guild_id BIGINT
         )
     """,
+    # version 2: warnings are given per guild, every query filters by guild and user
     """
-    CREATE INDEX IF NOT EXISTS warnings_user_id_idx ON warnings (user_id);
-    """
+    ALTER TABLE warnings ADD COLUMN IF NOT EXISTS guild_id BIGINT
+    """,
+)
+
+migrations = (
+    create_index(3, "warnings_guild_id_user_id_idx", "warnings", "guild_id, user_id"),
+    drop_index(4, "warnings_user_id_idx"),
 )
 
 deletion = (
@@ -28,21 +37,29 @@ deletion = (
     """,
 )
 
+# in the order of the RefWarning fields
+warning_columns = "user_id, timestamp, mod_name, reason, expiration_time, guild_id"
+
+statements.register("warnings.insert", f"INSERT INTO warnings ({warning_columns}) VALUES($1, $2, $3, $4, $5, $6)")
+statements.register("warnings.by_user", f"SELECT {warning_columns} FROM warnings WHERE guild_id = $1 AND user_id = $2")
+statements.register("warnings.active_by_user", f"SELECT {warning_columns} FROM warnings "
+                                               f"WHERE guild_id = $1 AND user_id = $2 AND expiration_time > NOW()")
+statements.register("warnings.all", f"SELECT {warning_columns} FROM warnings WHERE guild_id = $1 ORDER BY user_id")
+statements.register("warnings.all_active", f"SELECT {warning_columns} FROM warnings "
+                                           f"WHERE guild_id = $1 AND expiration_time > NOW() ORDER BY user_id")
+statements.register("warnings.expire",
+                    "UPDATE warnings SET expiration_time = NOW() WHERE guild_id = $1 AND user_id = $2")
+
 logger = logging.getLogger("Referee")
 
 
 # noinspection PyProtectedMember
 class PGWarningDB:
+    # tables with a guild_id column, see :meth:`PGPool.adopt_unassigned_rows`
+    guild_tables = ("warnings",)
 
     def __init__(self):
-        self.pool = asyncpg.create_pool(
-            host=pg_config.PG_Host,
-            database=pg_config.PG_Database,
-            user=pg_config.PG_User,
-            password=pg_config.PG_Password
-        )
-
-        asyncio.get_event_loop().run_until_complete(self.create_tables())
+        self.pool = pg_pool.register("warnings", backend=self)
 
     async def close(self):
         """
@@ -52,114 +69,72 @@ class PGWarningDB:
 
     async def create_tables(self):
         """
-        Creates the tables in the db if they don't exist.
+        Creates the tables in the db if they are not on the current schema version.
         This is called on every startup
         """
-        self.pool = await self.pool
-        async with self.pool.acquire() as con:
-            for query in creation:
-                await con.execute(query)
+        return await self.pool.ensure_schema(schema_version, creation, migrations)
+
+    @staticmethod
+    def _to_warning(row) -> RefWarning:
+        # the columns are selected in the order of the RefWarning fields
+        return RefWarning._make(row)
 
     async def put_warning(self, warning: RefWarning):
         """
         Save a warning into the db
         :param warning:
         """
-
-        insert = (
-            "INSERT into warnings(user_id, timestamp, mod_name, reason, expiration_time) VALUES($1, $2, $3, $4, $5)"
-        )
+        # written right away, the punishments are decided on the active warnings read right after
         async with self.pool.acquire() as con:
-            await con.execute(insert, warning.user_id, warning.timestamp, warning.mod_name, warning.reason, warning.expiration_time)
+            await statements.execute(con, "warnings.insert", *warning)
 
-    async def get_warnings(self, user_id: int) -> List[RefWarning]:
+    async def get_warnings(self, user_id: int, guild_id: int) -> List[RefWarning]:
         """
         Get a list of all logged warnings for a user
         :param user_id:
+        :param guild_id: The guild the warnings were given in
         :return:
         """
-        query = "SELECT user_id, timestamp, mod_name, reason, expiration_time FROM warnings WHERE user_id = $1"
         async with self.pool.acquire() as con:
-            results = await con.fetch(query, user_id)
-
-        warnings = [RefWarning(
-            user_id=row["user_id"],
-            timestamp=row["timestamp"],
-            mod_name=row["mod_name"],
-            reason=row["reason"],
-            expiration_time=row["expiration_time"]
-        ) for row in results]
-
-        return warnings
-
-    async def get_active_warnings(self, user_id: int):
+            results = await statements.fetch(con, "warnings.by_user", guild_id, user_id)
 
-        query = "SELECT user_id, timestamp, mod_name, reason, expiration_time FROM warnings " \
-                "WHERE user_id = $1 AND expiration_time > NOW()"
+        return [self._to_warning(row) for row in results]
 
+    async def get_active_warnings(self, user_id: int, guild_id: int):
         async with self.pool.acquire() as con:
-            results = await con.fetch(query, user_id)
+            results = await statements.fetch(con, "warnings.active_by_user", guild_id, user_id)
 
-        warnings = [RefWarning(
-            user_id=row["user_id"],
-            timestamp=row["timestamp"],
-            mod_name=row["mod_name"],
-            reason=row["reason"],
-            expiration_time=row["expiration_time"]
-        ) for row in results]
+        return [self._to_warning(row) for row in results]
 
-        return warnings
-
-    async def get_all_warnings(self) -> Dict[str, List[RefWarning]]:
+    async def get_all_warnings(self, guild_id: int) -> Dict[int, List[RefWarning]]:
         warnings = {}
 
-        query_all = "SELECT user_id, timestamp, mod_name, reason, expiration_time FROM warnings ORDER BY user_id"
-
         async with self.pool.acquire() as con:
-            results = await con.fetch(query_all)
+            results = await statements.fetch(con, "warnings.all", guild_id)
 
         for row in results:
-            w = RefWarning(
-                user_id=row["user_id"],
-                timestamp=row["timestamp"],
-                mod_name=row["mod_name"],
-                reason=row["reason"],
-                expiration_time=row["expiration_time"]
-            )
+            w = self._to_warning(row)
             if w.user_id not in warnings:
                 warnings[w.user_id] = []
             warnings[w.user_id].append(w)
 
         return warnings
 
-    async def get_all_active_warnings(self) -> Dict[int, List[RefWarning]]:
+    async def get_all_active_warnings(self, guild_id: int) -> Dict[int, List[RefWarning]]:
 
         warnings = {}
 
-        query_all = """
-        SELECT user_id, timestamp, mod_name, reason, expiration_time FROM warnings 
-        WHERE expiration_time > NOW() ORDER BY user_id
-        """
-
         async with self.pool.acquire() as con:
-            results = await con.fetch(query_all)
+            results = await statements.fetch(con, "warnings.all_active", guild_id)
 
         for row in results:
-            w = RefWarning(
-                user_id=row["user_id"],
-                timestamp=row["timestamp"],
-                mod_name=row["mod_name"],
-                reason=row["reason"],
-                expiration_time=row["expiration_time"]
-            )
+            w = self._to_warning(row)
             if w.user_id not in warnings:
                 warnings[w.user_id] = []
             warnings[w.user_id].append(w)
 
         return warnings
 
-    async def expire_warnings(self, user_id: int):
-        query = "UPDATE warnings SET expiration_time = NOW() WHERE user_id = $1"
-
+    async def expire_warnings(self, user_id: int, guild_id: int):
         async with self.pool.acquire() as con:
-            await con.execute(query, user_id)
+            await statements.execute(con, "warnings.expire", guild_id, user_id)
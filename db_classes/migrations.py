@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Sequence, Tuple
+
+logger = logging.getLogger("Referee")
+
+# key of the advisory lock that keeps the processes of a sharded bot from migrating at the same time
+MIGRATION_LOCK = 0x52656665
+
+
+class Migration:
+    """
+    One step from the previous schema version of an extension to ``version``.
+    Runs in a transaction together with recording the new version, unless ``transaction`` is False,
+    which statements like ``CREATE INDEX CONCURRENTLY`` need
+    """
+
+    def __init__(self, version: int, *queries: str, transaction: bool = True, index: Optional[str] = None):
+        """
+        :param index: Name of the index the queries build concurrently. An invalid one left behind
+                      by an interrupted build is dropped before building it again
+        """
+        self.version = version
+        self.queries: Tuple[str, ...] = queries
+        self.transaction = transaction
+        self.index = index
+
+
+def create_index(version: int, name: str, table: str, columns: str, unique: bool = False) -> Migration:
+    """
+    Builds an index without locking writes to the table, for tables that may already be large
+    :param columns: The column list, e.g. "guild_id, time"
+    """
+    unique = "UNIQUE " if unique else ""
+    return Migration(version, f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})",
+                     transaction=False, index=name)
+
+
+def drop_index(version: int, name: str) -> Migration:
+    return Migration(version, f"DROP INDEX CONCURRENTLY IF EXISTS {name}", transaction=False)
+
+
+def latest_version(creation_version: int, migrations: Sequence[Migration]) -> int:
+    return max([creation_version] + [m.version for m in migrations])
+
+
+async def _drop_invalid_index(con, name: str):
+    invalid = await con.fetchval(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = $1 AND pg_catalog.pg_table_is_visible(c.oid)", name)
+    if invalid:
+        logger.warning(f"Dropping the invalid index {name} left by an interrupted build")
+        await con.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+async def _lock(con, poll: float = 0.5):
+    # polled instead of pg_advisory_lock: a session blocked on the lock holds a snapshot,
+    # CREATE INDEX CONCURRENTLY in the session holding it would wait for that snapshot forever
+    while not await con.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK):
+        await asyncio.sleep(poll)
+
+
+async def migrate(con, name: str, creation_version: int, creation: Sequence[str],
+                  migrations: Sequence[Migration] = ()) -> bool:
+    """
+    Brings the schema of an extension to its latest version:
+    the creation queries if the db is older than ``creation_version``, then every newer migration in order.
+    The version is recorded after every step, a failed step is retried on the next start
+    :param name: Name of the extension in the schema_versions table
+    :param creation_version: The schema version the creation queries create
+    :return: Whether anything had to be run
+    """
+    target = latest_version(creation_version, migrations)
+    if await con.fetchval("SELECT version FROM schema_versions WHERE name = $1", name) == target:
+        return False
+
+    async def set_version(version: int):
+        await con.execute("INSERT INTO schema_versions(name, version) VALUES($1, $2) "
+                          "ON CONFLICT (name) DO UPDATE SET version = $2", name, version)
+
+    await _lock(con)
+    try:
+        # another process may have migrated while this one waited for the lock
+        current = await con.fetchval("SELECT version FROM schema_versions WHERE name = $1", name) or 0
+        if current >= target:
+            return False
+        if current < creation_version:
+            async with con.transaction():
+                for query in creation:
+                    await con.execute(query)
+                await set_version(creation_version)
+            current = creation_version
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version <= current:
+                continue
+            start = time.perf_counter()
+            if migration.transaction:
+                async with con.transaction():
+                    for query in migration.queries:
+                        await con.execute(query)
+                    await set_version(migration.version)
+            else:
+                if migration.index:
+                    await _drop_invalid_index(con, migration.index)
+                for query in migration.queries:
+                    await con.execute(query)
+                await set_version(migration.version)
+            current = migration.version
+            logger.info(f"Migrated {name} to schema version {migration.version} "
+                        f"in {time.perf_counter() - start:.3f}s")
+    finally:
+        await con.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK)
+    return True
@@ -0,0 +1,150 @@
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+import asyncpg
+
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+statement_duration = metrics.registry.histogram("db_statement_seconds", "Execution time per named statement",
+                                                ["statement"],
+                                                buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                                                         0.25, 0.5, 1.0, 2.5))
+statement_errors = metrics.registry.counter("db_statement_errors_total", "Failed executions per named statement",
+                                            ["statement"])
+
+
+class PreparingConnection(asyncpg.Connection):
+    """
+    The connections of the shared pool, they keep the statements of the registry they prepared
+    """
+    __slots__ = ("prepared",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+
+class Statement:
+    """
+    A named SQL statement and how often and how long it ran
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.executions = 0
+        self.seconds = 0.0
+        self.prepares = 0
+
+    @property
+    def group(self) -> str:
+        """
+        The extension the statement belongs to, the part of its name before the dot
+        """
+        return self.name.split(".", 1)[0]
+
+
+class StatementRegistry:
+    """
+    All SQL the db classes run, by name. Each connection prepares the statements of the registered
+    extensions when it is opened, and statements it couldn't prepare then, e.g. because the schema wasn't
+    set up yet, on first use. The server parses and plans a statement once per connection,
+    instead of whenever it falls out of asyncpg's statement cache
+    """
+
+    def __init__(self):
+        self.statements: Dict[str, Statement] = {}
+
+    def register(self, name: str, sql: str) -> str:
+        """
+        Adds a statement, usually at import time of its db class
+        :param name: "extension.statement", the extension decides which connections prepare it
+        :return: The name, to call the statement with
+        """
+        existing = self.statements.get(name)
+        if existing is not None and existing.sql != sql:
+            raise ValueError(f"Statement {name} is already registered with different SQL")
+        if existing is None:
+            self.statements[name] = Statement(name, sql)
+        return name
+
+    async def prepare_all(self, con: PreparingConnection, groups: Optional[Iterable[str]] = None):
+        """
+        Prepares the statements on a new connection, the ``init`` of the pool
+        :param groups: Only the statements of these extensions, all if None
+        """
+        groups = None if groups is None else set(groups)
+        start = time.perf_counter()
+        for statement in list(self.statements.values()):
+            if groups is not None and statement.group not in groups:
+                continue
+            try:
+                await self._prepare(con, statement)
+            except asyncpg.PostgresError as e:
+                logger.debug(f"Preparing {statement.name} on first use instead: {e}")
+        logger.debug(f"Prepared {len(con.prepared)} statements in {time.perf_counter() - start:.3f}s")
+
+    @staticmethod
+    async def _prepare(con, statement: Statement):
+        prepared = await con.prepare(statement.sql)
+        con.prepared[statement.name] = prepared
+        statement.prepares += 1
+        return prepared
+
+    async def _run(self, con, name: str, method: str, args: tuple):
+        statement = self.statements[name]
+        # prepared statements have no execute, fetch runs them just the same
+        call = "fetch" if method == "execute" else method
+        start = time.perf_counter()
+        try:
+            prepared = con.prepared.get(name) or await self._prepare(con, statement)
+            try:
+                result = await getattr(prepared, call)(*args)
+            except (asyncpg.InvalidCachedStatementError, asyncpg.OutdatedSchemaCacheError):
+                # the schema changed under the prepared statement, e.g. by a migration
+                prepared = await self._prepare(con, statement)
+                result = await getattr(prepared, call)(*args)
+        except Exception:
+            statement_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            statement.executions += 1
+            statement.seconds += elapsed
+            statement_duration.observe(elapsed, name)
+        return prepared.get_statusmsg() if method == "execute" else result
+
+    async def fetch(self, con, name: str, *args) -> list:
+        return await self._run(con, name, "fetch", args)
+
+    async def fetchrow(self, con, name: str, *args) -> Optional[asyncpg.Record]:
+        return await self._run(con, name, "fetchrow", args)
+
+    async def fetchval(self, con, name: str, *args):
+        return await self._run(con, name, "fetchval", args)
+
+    async def execute(self, con, name: str, *args) -> str:
+        """
+        Runs a statement for its effect
+        :return: The status of the command, like ``Connection.execute``
+        """
+        return await self._run(con, name, "execute", args)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Executions, total time and prepares per statement, the most time consuming first
+        """
+        return {s.name: {"executions": s.executions, "seconds": s.seconds, "prepares": s.prepares}
+                for s in sorted(self.statements.values(), key=lambda s: s.seconds, reverse=True)}
+
+
+statements = StatementRegistry()
+
+metrics.registry.counter("db_statement_executions_total", "Executions per named statement", ["statement"],
+                         callback=lambda: (((s.name,), s.executions) for s in statements.statements.values()))
+metrics.registry.counter("db_statement_prepares_total", "Times a named statement was prepared on a connection",
+                         ["statement"],
+                         callback=lambda: (((s.name,), s.prepares) for s in statements.statements.values()))
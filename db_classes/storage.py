@@ -0,0 +1,41 @@
+from importlib import import_module
+
+from config.config import Storage as storage_config
+
+# module and class of the db class of every extension, per backend
+backends = {
+    "postgres": {
+        "autoreactions": ("db_classes.PGAutoreactDB", "PGAutoreactDB"),
+        "christmas_competition": ("db_classes.PGChristmasDB", "PGChristmasDB"),
+        "emojisurvey": ("db_classes.PGEmojiSurveyDB", "PGEmojiSurveyDB"),
+        "modmail": ("db_classes.PGModMailDB", "PGModMailDB"),
+        "ranks": ("db_classes.PGRanksDB", "PGRanksDB"),
+        "reputation": ("db_classes.PGReputationDB", "PGReputationDB"),
+        "rolegroups": ("db_classes.PGRolegroupsDB", "PGRolegroupsDB"),
+        "warnings": ("db_classes.PGWarningDB", "PGWarningDB"),
+    },
+    "memory": {
+        "autoreactions": ("db_classes.MemoryDB", "MemoryAutoreactDB"),
+        "christmas_competition": ("db_classes.MemoryDB", "MemoryChristmasDB"),
+        "emojisurvey": ("db_classes.MemoryDB", "MemoryEmojiSurveyDB"),
+        "modmail": ("db_classes.MemoryDB", "MemoryModMailDB"),
+        "ranks": ("db_classes.MemoryDB", "MemoryRanksDB"),
+        "reputation": ("db_classes.MemoryDB", "MemoryReputationDB"),
+        "rolegroups": ("db_classes.MemoryDB", "MemoryRolegroupsDB"),
+        "warnings": ("db_classes.MemoryDB", "MemoryWarningDB"),
+    },
+}
+
+
+def open_db(name: str, backend: str = None):
+    """
+    Creates the db class of an extension for the configured storage backend.
+    Only the module of the chosen backend is imported, the memory backend works without asyncpg
+    :param name: Name of the extension
+    :param backend: Overrides the ``Backend`` of the ``Storage`` config section
+    """
+    backend = backend or storage_config.backend
+    if backend not in backends:
+        raise ValueError(f"Unknown storage backend {backend}, expected one of {', '.join(backends)}")
+    module, cls = backends[backend][name]
+    return getattr(import_module(module), cls)()
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import defaultdict
+from typing import List, Optional, Sequence
+
+import asyncpg
+
+from config.config import PostGres as pg_config
+from db_classes.PGPool import PoolHandle
+from db_classes.statements import statements
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+batch_rows = metrics.registry.histogram("db_write_batch_rows", "Rows written per batch of a write buffer", ["table"],
+                                        buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+flush_duration = metrics.registry.histogram("db_write_flush_seconds", "Time to write a batch of a write buffer",
+                                            ["table"])
+flushes = metrics.registry.counter("db_write_flushes_total", "Batches written, by what triggered them",
+                                   ["table", "trigger"])
+failed_rows = metrics.registry.counter("db_write_failed_rows_total",
+                                       "Rows of failed batches, requeued after connection errors, "
+                                       "dropped if postgres rejected them", ["table", "result"])
+
+_buffers: "weakref.WeakSet[WriteBuffer]" = weakref.WeakSet()
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for the inserts of one table. Rows are collected and written with one COPY
+    once ``max_rows`` are waiting or ``max_delay`` seconds after the first of them was added.
+    Rows in the buffer aren't in the table yet: reads and updates of the table call :meth:`flush` first,
+    which also waits for a batch that is being written. With ``max_rows`` 0 every row is inserted right away
+    """
+
+    def __init__(self, pool: PoolHandle, table: str, columns: Sequence[str], max_rows: int = None,
+                 max_delay: float = None):
+        """
+        :param pool: The pool handle of the db class the table belongs to
+        :param columns: Columns of the rows given to :meth:`add`, in order
+        :param max_rows: Rows that trigger a batch, defaults to WriteBatchSize of the PostgreSQL config section
+        :param max_delay: Seconds a row waits at most, defaults to WriteBatchDelay
+        """
+        self.pool = pool
+        self.table = table
+        self.columns = tuple(columns)
+        self.max_rows = pg_config.PG_WriteBatchSize if max_rows is None else max_rows
+        self.max_delay = pg_config.PG_WriteBatchDelay if max_delay is None else max_delay
+        self.rows: List[tuple] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._insert = statements.register(
+            f"{pool.name}.insert_{table}",
+            f"INSERT INTO {table} ({', '.join(self.columns)}) "
+            f"VALUES({', '.join(f'${i + 1}' for i in range(len(self.columns)))})")
+        _buffers.add(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_rows > 0
+
+    async def add(self, row: tuple):
+        """
+        Queues a row for the next batch. The caller that fills a batch writes it,
+        so the buffer can't grow without bound while postgres is slower than the bot
+        """
+        if not self.enabled:
+            async with self.pool.acquire() as con:
+                await statements.execute(con, self._insert, *row)
+            return
+        self.rows.append(row)
+        if len(self.rows) >= self.max_rows:
+            await self.flush("size")
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.max_delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self._flush_logged("time"))
+
+    async def _flush_logged(self, trigger: str):
+        try:
+            await self.flush(trigger)
+        except Exception as e:
+            logger.error(f"Writing {len(self.rows)} buffered rows to {self.table} failed: {e}")
+
+    async def flush(self, trigger: str = "read"):
+        """
+        Writes the buffered rows. Returns once every row added before the call is in the table
+        :param trigger: What caused the flush, for the metrics
+        :raises: The error of the batch if it failed for a reason other than postgres rejecting the rows,
+                 the rows stay buffered then
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if not self.rows and not self._lock.locked():
+            return
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.rows:
+                return
+            rows, self.rows = self.rows, []
+            start = time.perf_counter()
+            try:
+                async with self.pool.acquire() as con:
+                    await con.copy_records_to_table(self.table, records=rows, columns=self.columns)
+            except asyncpg.PostgresError as e:
+                # retrying rows postgres refused would fail the same way and block every later row
+                failed_rows.inc(self.table, "dropped", amount=len(rows))
+                logger.error(f"Dropped a batch of {len(rows)} rows for {self.table}: {e}. Rows: {rows}")
+            except Exception:
+                failed_rows.inc(self.table, "requeued", amount=len(rows))
+                self.rows[:0] = rows
+                if self._timer is None:
+                    self._timer = asyncio.get_event_loop().call_later(self.max_delay, self._on_timer)
+                raise
+            else:
+                flush_duration.observe(time.perf_counter() - start, self.table)
+                batch_rows.observe(len(rows), self.table)
+                flushes.inc(self.table, trigger)
+
+
+async def flush_all():
+    """
+    Writes the rows of every write buffer, called when the bot shuts down
+    """
+    buffers = list(_buffers)
+    results = await asyncio.gather(*(b.flush("close") for b in buffers), return_exceptions=True)
+    for buffer, result in zip(buffers, results):
+        if isinstance(result, Exception):
+            logger.error(f"Lost {len(buffer.rows)} buffered rows for {buffer.table} on shutdown: {result}")
+
+
+def _buffered_rows():
+    counts = defaultdict(int)
+    for buffer in list(_buffers):
+        counts[buffer.table,] += len(buffer.rows)
+    return counts.items()
+
+
+metrics.registry.gauge("db_write_buffered_rows", "Rows waiting in write buffers", ["table"], callback=_buffered_rows)
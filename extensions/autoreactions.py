@@ -3,10 +3,14 @@ import re
 
 import discord
 from discord.ext import commands
-from typing import Optional, Union
+from typing import Dict, List, Optional, Union
 
 import utils
-from db_classes.PGAutoreactDB import PGAutoreactDB
+from config.config import ProcessPool as pool_config
+from db_classes.storage import open_db
+from utils import cpu_tasks
+from utils.message_pipeline import MessageInfo
+from utils.process_pool import TaskTimeout, process_pool
 
 logger = logging.getLogger("Referee")
 
@@ -17,38 +21,58 @@ class Autoreactions(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.db = PGAutoreactDB()
-        self.guild = None
+        self.db = open_db("autoreactions")
         self.autoreactions = []
+        # (regex, emoji, channel_id) of every autoreaction, per guild
+        self.rules: Dict[int, List[tuple]] = {}
+        self.subscription = self.bot.message_pipeline.subscribe(self.react_to, guild_only=True, ignore_bots=True,
+                                                                channels=set())
+        self.bot.startup.register("autoreactions", warm_up=self.update_autoreactions)
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        self.guild = self.bot.guilds[0]
-        self.autoreactions = await self.db.get_autoreactions_list()
-
-
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if not message.author.bot and message.guild:
-            await self.react_to(message)
+    def cog_unload(self):
+        self.bot.message_pipeline.unsubscribe(self)
 
 
-    async def react_to(self, message: discord.Message):
-        reactions = [r["emoji"] for r in self.autoreactions
-                     if re.findall(r["regex"], message.content) and (
-                             message.channel.id == r["channel_id"] or r["channel_id"] is None
-                     )]
+    async def update_autoreactions(self):
+        """
+        Loads the autoreactions of all guilds from the db and narrows the messages
+        passed by the pipeline down to the channels they apply in
+        """
+        self.autoreactions = await self.db.get_autoreactions_list()
+        rules = {}
+        for r in self.autoreactions:
+            rules.setdefault(r["guild_id"], []).append((r["regex"], r["emoji"], r["channel_id"]))
+        self.rules = rules
+        channel_ids = {channel_id for guild_rules in rules.values() for _, _, channel_id in guild_rules}
+        self.subscription.channels = None if None in channel_ids else channel_ids
+
+
+    async def react_to(self, info: MessageInfo):
+        message = info.message
+        rules = [(regex, e) for regex, e, channel_id in self.rules.get(message.guild.id, ())
+                 if channel_id is None or message.channel.id == channel_id]
+        if not rules:
+            return
+        # the regexes come from the mods, a catastrophic one must not stall the loop
+        try:
+            found = await process_pool.submit(cpu_tasks.search_patterns, [regex for regex, _ in rules], message.content,
+                                              timeout=pool_config.quick_task_timeout)
+        except TaskTimeout:
+            logger.warning("Autoreaction regexes took too long on message %s in %s", message.id, message.channel)
+            return
+        reactions = [rules[i][1] for i in found]
         if reactions:
-            logger.debug(f"Reacting to {message.content} in {message.channel} with {reactions}")
+            logger.debug("Reacting to %s in %s with %s", message.content, message.channel, reactions)
         for emoji in reactions:
-            emoji = await self.get_emoji(emoji)
+            emoji = await self.get_emoji(message.guild, emoji)
             await message.add_reaction(emoji)
 
 
-    async def get_emoji(self, emoji):
+    @staticmethod
+    async def get_emoji(guild: discord.Guild, emoji):
         if len(emoji) > 1:
-            emoji = discord.utils.get(self.guild.emojis, id=int(emoji))
+            emoji = discord.utils.get(guild.emojis, id=int(emoji))
         return emoji
 
 
@@ -74,8 +98,8 @@ class Autoreactions(commands.Cog):
         except re.error:
             await ctx.send(f"Invalid regex: <https://regexr.com/?expression={regex}>")
             return
-        await self.db.add_autoreaction(emoji=emoji, channel_id=channel_id, regex=regex)
-        self.autoreactions = await self.db.get_autoreactions_list()
+        await self.db.add_autoreaction(guild_id=ctx.guild.id, emoji=emoji, channel_id=channel_id, regex=regex)
+        await self.update_autoreactions()
         await ctx.message.add_reaction(utils.emoji.thumbs_up)
 
 
@@ -87,8 +111,8 @@ class Autoreactions(commands.Cog):
         """
         embed = discord.Embed(title="Autoreactions")
         autoreact_strings = [
-            f"{r['id']}: {await self.get_emoji(r['emoji'])} - `{r['regex']}` - {self.bot.get_channel(r['channel_id']).mention if r['channel_id'] else 'All channels'}"
-            for r in self.autoreactions]
+            f"{r['id']}: {await self.get_emoji(ctx.guild, r['emoji'])} - `{r['regex']}` - {self.bot.get_channel(r['channel_id']).mention if r['channel_id'] else 'All channels'}"
+            for r in self.autoreactions if r["guild_id"] == ctx.guild.id]
         embed.add_field(name="ID: emoji - regex - channel", value="\n".join(autoreact_strings))
         await ctx.send(embed=embed)
 
@@ -100,8 +124,8 @@ class Autoreactions(commands.Cog):
         Delete an autoreaction instruction
         :param autoreaction_id: The ID as shown in autoreactions list
         """
-        await self.db.remove_autoreaction(autoreaction_id=autoreaction_id)
-        self.autoreactions = await self.db.get_autoreactions_list()
+        await self.db.remove_autoreaction(guild_id=ctx.guild.id, autoreaction_id=autoreaction_id)
+        await self.update_autoreactions()
         await ctx.message.add_reaction(utils.emoji.thumbs_up)
 
 
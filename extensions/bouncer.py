@@ -1,5 +1,6 @@
 import logging
 import os
+from typing import Dict, Optional
 
 import discord
 from discord.ext import commands
@@ -13,30 +14,52 @@ logger = logging.getLogger("Referee")
 CHECK_BUTTON_FILE_NAME = "extensions/checkmsgID.dat"  # TODO: whatever this is supposed to be
 
 
+def read_check_message_ids() -> Dict[Optional[int], int]:
+    """
+    Reads the accept button of every guild from the file, one "guild_id message_id" line per guild.
+    A file written before the bot served several guilds only holds a message id, it's stored under None
+    """
+    check_message_ids = {}
+    try:
+        with open(CHECK_BUTTON_FILE_NAME, "r") as file:
+            for line in file.read().split("\n"):
+                ids = [int(i) for i in line.split()]
+                if len(ids) == 1:
+                    check_message_ids[None] = ids[0]
+                elif len(ids) == 2:
+                    check_message_ids[ids[0]] = ids[1]
+    except Exception as e:
+        logger.warning("Could not read check_message_ids")
+    return check_message_ids
+
+
+def write_check_message_ids(check_message_ids: Dict[Optional[int], int]):
+    if not check_message_ids:
+        if os.path.exists(CHECK_BUTTON_FILE_NAME):
+            os.remove(CHECK_BUTTON_FILE_NAME)
+        return
+    with open(CHECK_BUTTON_FILE_NAME, "w") as file:
+        file.write("\n".join(f"{guild_id} {message_id}" if guild_id else str(message_id)
+                             for guild_id, message_id in check_message_ids.items()))
+
+
 class Bouncer(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        try:
-            with open(CHECK_BUTTON_FILE_NAME, "r") as file:
-                self.check_message_id = int(file.read())
-        except Exception as e:
-            logger.warning("Could not read check_message_id")
-            self.check_message_id = None
-        self.guild: discord.Guild = None
+        self.check_message_ids = read_check_message_ids()
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        self.guild = self.bot.guilds[0]
+    def get_check_message_id(self, guild_id: int) -> Optional[int]:
+        return self.check_message_ids.get(guild_id, self.check_message_ids.get(None))
 
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         """
-        Called by API everytime a member joins the bots guild
+        Called by API everytime a member joins one of the bots guilds
         """
-        await member.add_roles(await self.get_newbie_role())
+        await member.add_roles(await self.get_newbie_role(member.guild))
         logger.info(f"Adding newbie role to {member.name}#{member.discriminator}")
 
 
@@ -45,7 +68,7 @@ class Bouncer(commands.Cog):
         """
         Called by the API when a new channel is created
         """
-        await self.hide_channel(channel, await self.get_newbie_role())
+        await self.hide_channel(channel, await self.get_newbie_role(channel.guild))
 
 
     @commands.Cog.listener()
@@ -55,9 +78,9 @@ class Bouncer(commands.Cog):
         :param payload:
         :return:
         """
-        if self.check_message_id == payload.message_id:
+        if payload.guild_id and self.get_check_message_id(payload.guild_id) == payload.message_id:
             guild: discord.Guild = self.bot.get_guild(payload.guild_id)
-            member: discord.Member = guild.get_member(payload.user_id)
+            member: discord.Member = payload.member or await self.bot.member_loader.get_member(guild, payload.user_id)
             if await self.get_newbie_role(guild=guild) in member.roles:
                 await member.remove_roles(await self.get_newbie_role(guild=guild))
                 logger.info(f"Removed newbie role from {member.name}#{member.discriminator}")
@@ -70,19 +93,22 @@ class Bouncer(commands.Cog):
     async def welcome(member: discord.Member):
         embed = discord.Embed()
         embed.set_footer(icon_url=member.guild.icon_url, text=member.guild.name)
-        embed.add_field(name=f"Welcome to {member.guild.name}!", value=bouncer_config.welcome_message, inline=True)
+        welcome_message = bouncer_config.for_guild(member.guild.id).welcome_message
+        embed.add_field(name=f"Welcome to {member.guild.name}!", value=welcome_message, inline=True)
         await member.send(embed=embed)
 
 
-    async def get_newbie_role(self):
+    @staticmethod
+    async def get_newbie_role(guild: discord.Guild):
         """
         Gets the role meant to keep new users in the first channel.
         If the rule doesn't exist, it creates it.
         """
-        newbie_role = discord.utils.get(self.guild.roles, name=bouncer_config.newbie_role_name)
+        newbie_role_name = bouncer_config.for_guild(guild.id).newbie_role_name
+        newbie_role = discord.utils.get(guild.roles, name=newbie_role_name)
         if newbie_role is None:
-            newbie_role = await self.guild.create_role(
-                reason="Bouncer", name=bouncer_config.newbie_role_name, color=discord.Colour.dark_orange()
+            newbie_role = await guild.create_role(
+                reason="Bouncer", name=newbie_role_name, color=discord.Colour.dark_orange()
             )
         return newbie_role
 
@@ -91,19 +117,23 @@ class Bouncer(commands.Cog):
         """
         Sends the message to which users are supposed to react
         """
-        embed = discord.Embed(title=bouncer_config.accept_text)
+        embed = discord.Embed(title=bouncer_config.for_guild(channel.guild.id).accept_text)
         msg: discord.Message = await channel.send(embed=embed)
         await msg.add_reaction(emoji=emoji.white_check_mark)
-        with open(CHECK_BUTTON_FILE_NAME, "w") as file:
-            file.write(str(msg.id))
+        self.check_message_ids.pop(None, None)
+        self.check_message_ids[channel.guild.id] = msg.id
+        write_check_message_ids(self.check_message_ids)
 
 
     async def delete_accept_button(self, channel: discord.TextChannel):
         """
         Deletes the message created by :meth:`create_accept_button`
         """
-        await self.bot.http.delete_message(channel_id=channel.id, message_id=self.check_message_id)
-        os.remove(CHECK_BUTTON_FILE_NAME)
+        await self.bot.http.delete_message(channel_id=channel.id,
+                                           message_id=self.get_check_message_id(channel.guild.id))
+        self.check_message_ids.pop(channel.guild.id, None)
+        self.check_message_ids.pop(None, None)
+        write_check_message_ids(self.check_message_ids)
 
 
     async def hide_channel(self, channel: discord.abc.GuildChannel, role: discord.Role):
@@ -122,7 +152,7 @@ class Bouncer(commands.Cog):
         Reverses :meth:`hide_channel` for a specific role and channel
         """
         if isinstance(channel, discord.TextChannel):
-            if channel.id != bouncer_config.first_channel_id:
+            if channel.id != bouncer_config.for_guild(channel.guild.id).first_channel_id:
                 await channel.set_permissions(role, overwrite=None)
         else:
             await channel.set_permissions(role, overwrite=None)
@@ -137,7 +167,7 @@ class Bouncer(commands.Cog):
         embed = discord.Embed(title="Bouncer")
         embed.add_field(name="Usage", value=
         f"**{ctx.prefix}{ctx.invoked_with} enable**: Lock all channels except "
-        f"{ctx.guild.get_channel(bouncer_config.first_channel_id).mention} for new members\n"
+        f"{ctx.guild.get_channel(bouncer_config.for_guild(ctx.guild.id).first_channel_id).mention} for new members\n"
         f"**{ctx.prefix}{ctx.invoked_with} disable**: Unlock channels\n"
                         )
         await ctx.send(embed=embed, delete_after=30)
@@ -149,12 +179,13 @@ class Bouncer(commands.Cog):
         """
         Enable the bouncer
         """
-        newbie_role = await self.get_newbie_role()
+        newbie_role = await self.get_newbie_role(ctx.guild)
+        first_channel_id = bouncer_config.for_guild(ctx.guild.id).first_channel_id
 
-        await self.create_accept_button(ctx.guild.get_channel(bouncer_config.first_channel_id))
+        await self.create_accept_button(ctx.guild.get_channel(first_channel_id))
 
         for channel in ctx.guild.channels:
-            if channel.id != bouncer_config.first_channel_id:
+            if channel.id != first_channel_id:
                 await self.hide_channel(channel, newbie_role)
 
         embed = discord.Embed(title="Bouncer enabled")
@@ -168,12 +199,12 @@ class Bouncer(commands.Cog):
         """
         Disable the bouncer
         """
-        newbie_role = await self.get_newbie_role()
+        newbie_role = await self.get_newbie_role(ctx.guild)
 
         for channel in ctx.guild.channels:
             await self.unhide_channel(channel, newbie_role)
 
-        await self.delete_accept_button(ctx.guild.get_channel(bouncer_config.first_channel_id))
+        await self.delete_accept_button(ctx.guild.get_channel(bouncer_config.for_guild(ctx.guild.id).first_channel_id))
 
         await newbie_role.delete()
 
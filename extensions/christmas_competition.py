@@ -12,7 +12,7 @@ import json
 from config.config import Christmas_Competition as config, Timeouts
 
 from Referee import can_kick
-from db_classes.PGChristmasDB import PGChristmasDB
+from db_classes.storage import open_db
 from utils import emoji
 
 logger = logging.getLogger("Referee")
@@ -21,18 +21,10 @@ logger = logging.getLogger("Referee")
 class ChristmasCompetition(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.guild = None
-        self.db = PGChristmasDB()
+        self.db = open_db("christmas_competition")
         self.lb_data = None
         self.last_updated_lb = datetime.fromtimestamp(0)
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """
-        On_ready eventhandler, gets called by api
-        """
-        self.guild: discord.Guild = self.bot.guilds[0]
-
     @commands.command(name="set_cookie", hidden=True)
     @can_kick()
     async def UpdateAocCookie(self, ctx: commands.Context, cookie: str):
@@ -51,10 +43,6 @@ class ChristmasCompetition(commands.Cog):
     async def Register(self, ctx: commands.Context, name: str):
         isUpdate = False
 
-        def check(_reaction: discord.Reaction, _user):
-            return _reaction.message.id == message.id and _user == ctx.message.author and str(_reaction.emoji) in [
-                emoji.thumbs_down, emoji.thumbs_up]
-
         if await self.db.get_user(None, ctx.message.author.id) is not None:
             message = await ctx.message.channel.send(
                 "You are already registered, do you want to update your AoC name instead?", delete_after=Timeouts.short)
@@ -62,11 +50,13 @@ class ChristmasCompetition(commands.Cog):
             await message.add_reaction(emoji.thumbs_down)
 
             try:
-                reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.mid, check=check)
+                reaction = await self.bot.reaction_waiters.wait(message.id, ctx.author.id,
+                                                                [emoji.thumbs_up, emoji.thumbs_down],
+                                                                timeout=Timeouts.mid)
             except asyncio.TimeoutError:
                 pass
             else:
-                if reaction.emoji != emoji.thumbs_up:
+                if reaction != emoji.thumbs_up:
                     return
                 isUpdate = True
             finally:
@@ -76,16 +66,14 @@ class ChristmasCompetition(commands.Cog):
         await message.add_reaction(emoji.thumbs_up)
         await message.add_reaction(emoji.thumbs_down)
 
-        def check(_reaction: discord.Reaction, _user):
-            return _reaction.message.id == message.id and _user == ctx.message.author and str(_reaction.emoji) in [
-                emoji.trashcan, emoji.thumbs_up]
-
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.mid, check=check)
+            reaction = await self.bot.reaction_waiters.wait(message.id, ctx.author.id,
+                                                            [emoji.thumbs_up, emoji.thumbs_down, emoji.trashcan],
+                                                            timeout=Timeouts.mid)
         except asyncio.TimeoutError:
             await ctx.message.channel.send("AoC name wasn't confirmed, cancelling.", delete_after=Timeouts.short)
         else:
-            if reaction.emoji == emoji.thumbs_up:
+            if reaction == emoji.thumbs_up:
                 if isUpdate:
                     await self.db.update_user(name.lower(), ctx.message.author.id)
                 else:
@@ -162,8 +150,8 @@ class ChristmasCompetition(commands.Cog):
             if not cm_info:
                 out += f"{currentMember['name']} ({str(score)} points)\n"
             else:
-                member = self.guild.get_member(cm_info[1])
-                out += f"{member.mention} ({cm_info[0]}, {str(score)} points)\n"
+                member = await self.bot.member_loader.get_member(ctx.guild, cm_info[1])
+                out += f"{member.mention if member else cm_info[0]} ({cm_info[0]}, {str(score)} points)\n"
         embed.add_field(name="-", value=out)
         await ctx.reply(embed=embed)
 
@@ -7,7 +7,7 @@ from typing import Union, Tuple, List
 import discord
 from discord.ext import commands
 
-from db_classes.PGEmojiSurveyDB import PGEmojiSurveyDB
+from db_classes.storage import open_db
 
 from Referee import can_ban
 from Referee import can_kick
@@ -23,18 +23,12 @@ class EmojiSurvey(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.guild: discord.Guild = None
-        self.db = PGEmojiSurveyDB()
-        self.survey_channel: discord.TextChannel = None
+        self.db = open_db("emojisurvey")
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """
-        On_ready eventhandler, gets called by api
-        """
-        self.guild: discord.Guild = self.bot.guilds[0]
-        self.survey_channel = self.guild.get_channel(config.channel_id)
+    @staticmethod
+    def get_survey_channel(guild: discord.Guild) -> discord.TextChannel:
+        return guild.get_channel(config.for_guild(guild.id).channel_id)
 
 
     @can_ban()
@@ -47,15 +41,16 @@ class EmojiSurvey(commands.Cog):
     @can_ban()
     @emoji_survey.command(name="start", aliases=["create"])
     async def start_survey(self, ctx: commands.Context):
-        for custom_emoji in filter(lambda x: not x.animated, self.guild.emojis):
+        survey_channel = self.get_survey_channel(ctx.guild)
+        for custom_emoji in filter(lambda x: not x.animated, ctx.guild.emojis):
             try:
-                msg = await self.survey_channel.send(custom_emoji)
+                msg = await survey_channel.send(custom_emoji)
                 await asyncio.sleep(0.1)
                 await msg.add_reaction(emoji.thumbs_up)
                 await asyncio.sleep(0.1)
                 await msg.add_reaction(emoji.thumbs_down)
                 await asyncio.sleep(0.1)
-                await self.db.add_message(message_id=msg.id, emoji=str(custom_emoji))
+                await self.db.add_message(guild_id=ctx.guild.id, message_id=msg.id, emoji=str(custom_emoji))
             except Exception as e:
                 logger.error(f"Error creating emoji survey message: {e}")
 
@@ -64,8 +59,9 @@ class EmojiSurvey(commands.Cog):
     @emoji_survey.command(name="eval", aliases=["count"])
     async def eval_survey(self, ctx: commands.Context):
         emoji_scores = dict()
-        for message_id, custom_emoji in await self.db.get_all():
-            msg: discord.Message = await self.survey_channel.fetch_message(message_id)
+        survey_channel = self.get_survey_channel(ctx.guild)
+        for message_id, custom_emoji in await self.db.get_all(ctx.guild.id):
+            msg: discord.Message = await survey_channel.fetch_message(message_id)
             upvotes, downvotes = discord.utils.get(msg.reactions, emoji=emoji.thumbs_up).count-1, discord.utils.get(msg.reactions, emoji=emoji.thumbs_down).count-1
             emoji_scores[custom_emoji] = {"upvotes": upvotes,"downvotes": downvotes, "score": upvotes-downvotes}
 
@@ -90,10 +86,11 @@ class EmojiSurvey(commands.Cog):
 
         if delete:
             logger.info(f"Deleting the survey")
-            for message_id, _ in await self.db.get_all():
+            survey_channel = self.get_survey_channel(ctx.guild)
+            for message_id, _ in await self.db.get_all(ctx.guild.id):
                 try:
                     await self.db.delete_message(message_id)
-                    msg = await self.survey_channel.fetch_message(message_id)
+                    msg = await survey_channel.fetch_message(message_id)
                     await msg.delete()
                 except Exception as e:
                     logger.error(f"Error deleting message: {e}")
@@ -108,12 +105,6 @@ class EmojiSurvey(commands.Cog):
         :param reraise_timeout: Whether an exception should be raised on timeout, defaults to True
         :return: bool answer
         """
-
-
-        def check(_reaction, _user):
-            return _user == member and str(_reaction.emoji) in [emoji.x, emoji.white_check_mark]
-
-
         if type(ctx) == commands.Context:
             channel = ctx.channel
             member = ctx.author
@@ -128,7 +119,8 @@ class EmojiSurvey(commands.Cog):
         await msg.add_reaction(emoji.x)
 
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=check)
+            reaction = await self.bot.reaction_waiters.wait(msg.id, member.id, [emoji.white_check_mark, emoji.x],
+                                                            timeout=Timeouts.long)
         except asyncio.TimeoutError as e:
             await msg.delete()
             if reraise_timeout:
@@ -136,8 +128,8 @@ class EmojiSurvey(commands.Cog):
             else:
                 return False
         else:
-            await self.send_simple_embed(channel=channel, content=reaction.emoji, delete_after=2)
-            if reaction.emoji == emoji.white_check_mark:
+            await self.send_simple_embed(channel=channel, content=reaction, delete_after=2)
+            if reaction == emoji.white_check_mark:
                 await msg.delete()
                 return True
             else:
@@ -3,91 +3,112 @@ import logging
 import re
 import urllib.parse
 from base64 import b64decode, b64encode
-from builtins import filter
 
 import aiohttp
 import discord
-import string
-from typing import Union, List, Tuple, Dict, Optional
+from typing import Union, List, Tuple, Optional
 from discord.ext import commands
 from discord.ext.commands import BadArgument
 
 from Referee import can_kick, can_ban
-from config.config import Misc as config, Timeouts
+from config.config import Misc as config, ProcessPool as pool_config, Timeouts
 from extensions.rolegroups import Role_T
-from utils import emoji
+from utils import cpu_tasks, emoji
+from utils.message_pipeline import MessageInfo
+from utils.process_pool import TaskTimeout, process_pool
 
 logger = logging.getLogger("Referee")
 
+b64_candidate_pattern = re.compile(r"[a-zA-Z0-9+/]{8}")
+calc_chars = frozenset("0123456789+-*/().")
+calc_operators = frozenset("+-*/")
+calc_digits = frozenset("0123456789")
+
 
 class Misc(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.guild: discord.Guild = None
+        pipeline = self.bot.message_pipeline
+        pipeline.subscribe(self.on_gif_message, predicate=self.is_gif_request)
+        pipeline.subscribe(self.on_b64_message, ignore_commands=True, predicate=self.may_contain_b64)
+        pipeline.subscribe(self.on_calculation, predicate=lambda info: self.get_calculation(info) is not None)
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """
-        On_ready eventhandler, gets called by api
-        """
-        self.guild: discord.Guild = self.bot.guilds[0]
+    def cog_unload(self):
+        self.bot.message_pipeline.unsubscribe(self)
 
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        def emoji_check(reaction: discord.Reaction, user):
-            return user == message.author and str(
-                reaction.emoji) == emoji.trashcan and reaction.message.id == msg.id
+    @staticmethod
+    def is_gif_request(info: MessageInfo) -> bool:
+        return len(info.words) == 1 and info.lower.endswith(".gif") and not info.lower.startswith("http")
 
 
-        content = message.content.lower()
-        if len(content.split()) == 1 and content.endswith(".gif") and not content.startswith("http"):
-            await self.provide_gif(message)
-        if not any(message.content.startswith(p) for p in self.bot.command_prefix):
-            b64_finds = await self.get_b64_strings(message.content)
-            if b64_finds and min(map(len, b64_finds.keys())) > 6:
-                res = "\n".join(f"'{c}' => **{d}**" for c, d in b64_finds.items())
-                embed = discord.Embed(title="Decoded b64:", description=res)
-                msg = await message.channel.send(embed=embed)
-                await msg.add_reaction(emoji.trashcan)
+    @staticmethod
+    def may_contain_b64(info: MessageInfo) -> bool:
+        # only strings longer than 6 characters get decoded, as multiples of 4 that is at least 8
+        return b64_candidate_pattern.search(info.content) is not None
 
-                try:
-                    reaction, _ = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=emoji_check)
-                except asyncio.TimeoutError:
-                    await msg.remove_reaction(emoji.trashcan, self.bot.user)
-                else:
-                    await msg.delete()
-        calc = message.content.replace("\\", "").replace(" ", "").replace("`", "")
-        if len(calc) >= 3 and set(calc).issubset(set("0123456789+-*/().")) and "**" not in calc and set(calc) & set(
-                "+-*/") and set(calc) & set("0123456789"):
-            logger.debug(f"Calculating {calc} for {message.author}")
-            try:
-                result = eval(calc)
-                answer = f"`{calc}` = **{result}**"
-                if len(answer) >= 2000:
-                    answer = str(result)
-            except SyntaxError:
-                await message.add_reaction(emoji.x)
-                await asyncio.sleep(0.1)
-                await message.remove_reaction(emoji.x, self.bot.user)
-                return
-            except Exception as e:
-                result = e.__class__.__name__
-                answer = result
-            logger.debug(f"Result: {result}")
 
-            embed = discord.Embed(title="Result:", description=answer)
+    @staticmethod
+    def get_calculation(info: MessageInfo) -> Optional[str]:
+        calc = info.content.replace("\\", "").replace(" ", "").replace("`", "")
+        if len(calc) < 3 or "**" in calc:
+            return None
+        chars = set(calc)
+        if chars <= calc_chars and chars & calc_operators and chars & calc_digits:
+            return calc
+        return None
+
+
+    async def on_gif_message(self, info: MessageInfo):
+        await self.provide_gif(info.message)
+
+
+    async def on_b64_message(self, info: MessageInfo):
+        message = info.message
+        # a single pass over one message is cheap enough for the loop, the b64 command decodes nested strings
+        b64_finds = cpu_tasks.decode_b64_strings(message.content)
+        if b64_finds and min(map(len, b64_finds.keys())) > 6:
+            res = "\n".join(f"'{c}' => **{d}**" for c, d in b64_finds.items())
+            embed = discord.Embed(title="Decoded b64:", description=res)
             msg = await message.channel.send(embed=embed)
-            await msg.add_reaction(emoji.trashcan)
+            await self.offer_delete(msg, message.author)
 
-            try:
-                reaction, _ = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=emoji_check)
-            except asyncio.TimeoutError:
-                await msg.remove_reaction(emoji.trashcan, self.bot.user)
-            else:
-                await msg.delete()
+
+    async def on_calculation(self, info: MessageInfo):
+        message = info.message
+        calc = self.get_calculation(info)
+        logger.debug("Calculating %s for %s", calc, message.author)
+        try:
+            answer = await process_pool.submit(cpu_tasks.calculate, calc, timeout=pool_config.quick_task_timeout)
+        except SyntaxError:
+            await message.add_reaction(emoji.x)
+            await asyncio.sleep(0.1)
+            await message.remove_reaction(emoji.x, self.bot.user)
+            return
+        except TaskTimeout:
+            answer = "That takes too long"
+        except Exception as e:
+            answer = e.__class__.__name__
+        logger.debug("Result: %s", answer)
+
+        embed = discord.Embed(title="Result:", description=answer)
+        msg = await message.channel.send(embed=embed)
+        await self.offer_delete(msg, message.author)
+
+
+    async def offer_delete(self, msg: discord.Message, author: discord.abc.User):
+        """
+        Adds a trashcan to a response, the author of the triggering message can use it to delete the response
+        """
+        await msg.add_reaction(emoji.trashcan)
+        try:
+            await self.bot.reaction_waiters.wait(msg.id, author.id, [emoji.trashcan], timeout=Timeouts.long)
+        except asyncio.TimeoutError:
+            await msg.remove_reaction(emoji.trashcan, self.bot.user)
+        else:
+            await msg.delete()
 
 
     async def provide_gif(self, message: discord.Message):
@@ -96,20 +117,7 @@ class Misc(commands.Cog):
         query = content.split(".gif")[0]
         url = await self.fetch_gif(query)
         gif_message = await message.channel.send(url)
-        await gif_message.add_reaction(emoji.trashcan)
-
-
-        def check(reaction: discord.Reaction, user):
-            return user == message.author and str(
-                reaction.emoji) == emoji.trashcan and reaction.message.id == gif_message.id
-
-
-        try:
-            reaction, _ = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=check)
-        except asyncio.TimeoutError:
-            await gif_message.remove_reaction(emoji.trashcan, self.bot.user)
-        else:
-            await gif_message.delete()
+        await self.offer_delete(gif_message, message.author)
 
 
     async def fetch_gif(self, query):
@@ -208,20 +216,6 @@ class Misc(commands.Cog):
                                         color=discord.Colour.dark_gold()), delete_after=15)
 
 
-    async def get_b64_strings(self, text: str) -> Dict[str, str]:
-        enc = filter(lambda x: len(x) % 4 == 0, re.findall(r"[a-zA-Z0-9+/]+={0,2}", text))
-        solved = {}
-        for code in enc:
-            try:
-                dec = b64decode(code).decode()
-                if all(x in string.printable for x in set(dec)):
-                    solved[code] = dec
-            except Exception as ex:
-                # logger.error(ex)  # this is noisy and not neccesary
-                pass
-        return solved
-
-
     @commands.command(name="b64")
     async def b64decode(self, ctx: commands.Context, *, query: Optional[str]):
         """
@@ -230,18 +224,8 @@ class Misc(commands.Cog):
         """
 
         if not query:
-            found_hits = {}
-            async for m in ctx.channel.history(limit=20, oldest_first=False):
-                results = await self.get_b64_strings(m.content)
-                for c, d in results.items():
-                    sub = await self.get_b64_strings(d)
-                    levels = 1
-                    while sub:
-                        sub = await self.get_b64_strings(d)
-                        if sub:
-                            d = sub.get(d)
-                            levels += 1
-                    found_hits[c] = (d, levels)
+            texts = [m.content async for m in ctx.channel.history(limit=20, oldest_first=False)]
+            found_hits = await process_pool.submit(cpu_tasks.decode_nested_b64, texts)
             if found_hits:
                 embed = discord.Embed(description="\n\n".join(
                     [f"*{c}* - **{d[0]}**" + (f" | encoded {d[1]} times" if d[1] > 1 else "") for c, d in
@@ -268,6 +252,7 @@ class Misc(commands.Cog):
         :return:
         """
         if type(subject) == discord.Role:
+            await self.bot.member_loader.ensure(ctx.guild)
             embed = await self.get_role_info_embed(subject)
         elif type(subject) == discord.Member:
             embed = await self.get_member_info_embed(subject)
@@ -279,12 +264,17 @@ class Misc(commands.Cog):
     @commands.command(name="regex_ban", aliases=["ban"])
     @can_ban()
     async def regex_ban(self, ctx: commands.Context, *, regex: str):
+        await self.bot.member_loader.ensure(ctx.guild)
+        members = list(ctx.guild.members)
         try:
-            re.compile(regex)
+            matches = await process_pool.submit(cpu_tasks.fullmatch_names, regex, [m.name for m in members])
         except re.error:
             await ctx.send(f"Invalid regex: <https://regexr.com/?expression={regex}>")
             return
-        targets: List[discord.Member] = [m for m in self.guild.members if re.fullmatch(regex, m.name)]
+        except TaskTimeout:
+            await ctx.send(f"`{regex}` took too long to match against the members")
+            return
+        targets: List[discord.Member] = [members[i] for i in matches]
         if not targets:
             await ctx.send(f"No matches for `{regex}`")
             return
@@ -353,12 +343,6 @@ class Misc(commands.Cog):
         :param reraise_timeout: Whether an exception should be raised on timeout, defaults to True
         :return: bool answer
         """
-
-
-        def check(_reaction, _user):
-            return _user == member and str(_reaction.emoji) in [emoji.x, emoji.white_check_mark]
-
-
         if type(ctx) == commands.Context:
             channel = ctx.channel
             member = ctx.author
@@ -373,7 +357,8 @@ class Misc(commands.Cog):
         await msg.add_reaction(emoji.x)
 
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=check)
+            reaction = await self.bot.reaction_waiters.wait(msg.id, member.id, [emoji.white_check_mark, emoji.x],
+                                                            timeout=Timeouts.long)
         except asyncio.TimeoutError as e:
             await msg.delete()
             if reraise_timeout:
@@ -381,8 +366,8 @@ class Misc(commands.Cog):
             else:
                 return False
         else:
-            await self.send_simple_embed(channel=channel, content=reaction.emoji, delete_after=2)
-            if reaction.emoji == emoji.white_check_mark:
+            await self.send_simple_embed(channel=channel, content=reaction, delete_after=2)
+            if reaction == emoji.white_check_mark:
                 await msg.delete()
                 return True
             else:
@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from datetime import datetime
+import math
 
 import discord
 import typing
@@ -8,9 +8,11 @@ from discord.ext import commands
 
 from Referee import can_ban
 from config.config import ModMail as modmail_config, Timeouts
-from db_classes.PGModMailDB import PGModMailDB
+from db_classes.storage import open_db
 from models import modmail_models
 from utils import emoji
+from utils.ratelimit import KeyedLimiter
+from utils.message_pipeline import MessageInfo
 
 logger = logging.getLogger("Referee")
 
@@ -19,23 +21,24 @@ class ModMail(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.db = PGModMailDB()
-        self.mod_channel: discord.TextChannel = None  # will be loaded in on_ready
-        self.last_messages_times = {}
-        self.guild: discord.Guild = None
+        self.db = open_db("modmail")
+        # one mail per user every Cooldown minutes
+        self.mail_limiter = KeyedLimiter(rate=1, period=modmail_config.cooldown * 60)
+        # Only private messages of more than one word from users can be mails
+        self.bot.message_pipeline.subscribe(self.on_mail_candidate, dm_only=True, ignore_bots=True,
+                                            predicate=lambda info: len(info.words) > 1)
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        self.guild = self.bot.guilds[0]
+    def cog_unload(self):
+        self.bot.message_pipeline.unsubscribe(self)
 
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
+    async def on_mail_candidate(self, info: MessageInfo):
         """
-        Eventlistener for messages, gets called by api
-        :param message: The message object that caused the event
+        Called by the message pipeline for private messages
+        :param info: The parsed message that caused the event
         """
+        message = info.message
         if await self.is_valid_mail(message):
             cooldown = await self.get_cooldown(message.author.id)
             if cooldown <= 0:
@@ -59,16 +62,7 @@ class ModMail(commands.Cog):
         :param user_id:
         :return: The users remaining cooldown in minutes else 0
         """
-        if user_id not in self.last_messages_times:
-            return 0
-        else:
-            minutes_passed = (datetime.now() - self.last_messages_times[user_id]).seconds // 60
-            cooldown = modmail_config.cooldown - minutes_passed
-            if cooldown <= 0:
-                del self.last_messages_times[user_id]
-                return 0
-            else:
-                return cooldown
+        return math.ceil(self.mail_limiter.retry_after(user_id) / 60)
 
 
     async def reset_cooldown(self, user_id: int):
@@ -76,18 +70,30 @@ class ModMail(commands.Cog):
         Restarts the users cooldown
         :param user_id:
         """
-        self.last_messages_times[user_id] = datetime.now()
+        self.mail_limiter.reset(user_id)
+        self.mail_limiter.hit(user_id)
+
+
+    async def get_mail_guild(self, user_id: int) -> typing.Optional[discord.Guild]:
+        """
+        The guild a private message of a user is forwarded to, the first one the bot shares with them
+        """
+        for guild in self.bot.guilds:
+            if await self.bot.member_loader.get_member(guild, user_id):
+                return guild
+        return None
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    def get_mod_channel(self, guild_id: int) -> discord.TextChannel:
         """
-        On_ready eventhandler, gets called by api
+        The channel the mails of a guild are forwarded to
         """
-        self.mod_channel: discord.TextChannel = self.bot.get_channel(modmail_config.mod_channel_id)
-        if not self.mod_channel:
-            logger.error(f"Channel with ID {modmail_config.mod_channel_id} not found")
-            raise RuntimeError(f"Channel with ID {modmail_config.mod_channel_id} not found")
+        channel_id = modmail_config.for_guild(guild_id).mod_channel_id
+        channel: discord.TextChannel = self.bot.get_channel(channel_id)
+        if not channel:
+            logger.error(f"Channel with ID {channel_id} not found")
+            raise RuntimeError(f"Channel with ID {channel_id} not found")
+        return channel
 
 
     async def is_valid_mail(self, message: discord.Message):
@@ -104,7 +110,7 @@ class ModMail(commands.Cog):
             return False
         if len(message.content.split()) <= 1:
             return False
-        if not self.guild.get_member(message.author.id):
+        if not await self.get_mail_guild(message.author.id):
             return False
         return True
 
@@ -116,8 +122,10 @@ class ModMail(commands.Cog):
         """
         author_name = f"{message.author.display_name}#{message.author.discriminator}"  # Username#1337
 
+        guild = await self.get_mail_guild(message.author.id)
         mail = modmail_models.ModMail(author_id=message.author.id, author_name=author_name,
-                                      timestamp=message.created_at, content=message.content)
+                                      timestamp=message.created_at, content=message.content,
+                                      guild_id=guild.id)
 
         modmail_id = await self.db.put_modmail(mail)  # Save to database
         logger.info(f"Saved mail to db: '{mail.content}'. db_id: {modmail_id}")
@@ -138,7 +146,7 @@ class ModMail(commands.Cog):
         embed.add_field(name=f"Answered: {emoji.x}",
                         value=f"Use `ref!answer {mail.modmail_id} <your answer>` to respond", inline=False)
 
-        msg = await self.mod_channel.send(embed=embed)
+        msg = await self.get_mod_channel(mail.guild_id).send(embed=embed)
         return msg.id
 
 
@@ -148,7 +156,8 @@ class ModMail(commands.Cog):
         :param modmail: The :class:`ModMail` that has been answered
         :param answer: The answer as a :class:`ModMailAnswer`
         """
-        report_message: discord.Message = (await self.mod_channel.fetch_message(modmail.message_id))
+        report_message: discord.Message = (
+            await self.get_mod_channel(modmail.guild_id).fetch_message(modmail.message_id))
         embed: discord.Embed = report_message.embeds[0]
         name = f"Answered: {emoji.white_check_mark}"
         if emoji.x in embed.fields[1].name:  # If unanswered yet
@@ -174,7 +183,7 @@ class ModMail(commands.Cog):
         embed = discord.Embed(name="ModMail", color=discord.Color.dark_gold())
         embed.add_field(name=f"Your request from {modmail.timestamp_str}", value=modmail.content, inline=False)
 
-        if modmail_config.anonymize_responses:
+        if modmail_config.for_guild(modmail.guild_id).anonymize_responses:
             name = f"Answer from mods"
         else:
             name = f"Answer from {answer.mod_name}"
@@ -201,12 +210,17 @@ class ModMail(commands.Cog):
             modmail = await self.db.get_modmail(int(modmail_id))
 
         else:  # User omitted id
-            modmail = await self.db.get_latest_modmail()
-            modmail_id = modmail.modmail_id
+            modmail = await self.db.get_latest_modmail(ctx.guild.id)
+
+        if not modmail or modmail.guild_id != ctx.guild.id:
+            await ctx.send(embed=discord.Embed(title="No such modmail", color=discord.Color.dark_gold()),
+                           delete_after=30)
+            return
+        modmail_id = modmail.modmail_id
 
         embed = discord.Embed(title="Preview **(Confirm or cancel below)**", color=discord.Color.dark_gold())
         embed.add_field(name=f"Message by {modmail.author_name}", value=modmail.content, inline=False)
-        if modmail_config.anonymize_responses:
+        if modmail_config.for_guild(ctx.guild.id).anonymize_responses:
             name = f"Answer"
         else:
             name = f"Answer by {ctx.author.display_name}"
@@ -217,10 +231,6 @@ class ModMail(commands.Cog):
         await preview.add_reaction(emoji.x)
 
 
-        def check(_reaction, _user):
-            return _user == ctx.author and str(_reaction.emoji) in [emoji.x, emoji.white_check_mark]
-
-
         async def send_cancelled_answer():
             """
             Inner helpmethod to signal a cancelled response
@@ -238,12 +248,13 @@ class ModMail(commands.Cog):
 
 
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.long,
-                                                     check=check)  # Wait for a choice by user who invoked command
+            # Wait for a choice by user who invoked command
+            reaction = await self.bot.reaction_waiters.wait(preview.id, ctx.author.id,
+                                                            [emoji.white_check_mark, emoji.x], timeout=Timeouts.long)
         except asyncio.TimeoutError:
             await send_cancelled_answer()
         else:
-            if str(reaction) == emoji.white_check_mark:  # only path where user gets a response
+            if reaction == emoji.white_check_mark:  # only path where user gets a response
                 answer = modmail_models.ModMailAnswer(content=message, mod_id=ctx.author.id,
                                                       mod_name=ctx.author.display_name, modmail=modmail,
                                                       timestamp=ctx.message.created_at)
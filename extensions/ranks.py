@@ -1,19 +1,45 @@
 import asyncio
 import logging
+from collections import defaultdict
 
 import discord
 from discord.ext import commands
-from typing import List, Union, Dict
+from typing import FrozenSet, List, Union, Dict
 
 from Referee import can_ban, can_kick
 from config.config import Ranks as ranks_config, Timeouts
-from db_classes.PGRanksDB import PGRanksDB
+from db_classes.storage import open_db
 from models.ranks_models import Rank
-from utils import emoji
+from utils import emoji, metrics
+from utils.guild_state import GuildStates
+from utils.ratelimit import KeyedLimiter
+from utils.scheduler import scheduler
 
 logger = logging.getLogger("Referee")
 
 
+class RanksState:
+    """
+    The ranks of one guild and the reaction cooldowns of its members
+    """
+
+    def __init__(self, guild_id: int):
+        config = ranks_config.for_guild(guild_id)
+        # more than CooldownCount reactions within CooldownTime seconds are removed unprocessed
+        self.reaction_limiter = KeyedLimiter(rate=config.cooldown_count, period=config.cooldown_time,
+                                             burst=config.cooldown_count)
+        self.loaded = False
+        self.ranks: List[Rank] = []
+        self.ranks_by_message: Dict[int, Rank] = {}
+        self.role_ids: FrozenSet[int] = frozenset()
+
+    def set_ranks(self, ranks: List[Rank]):
+        self.loaded = True
+        self.ranks = ranks
+        self.ranks_by_message = {rank.message_id: rank for rank in ranks}
+        self.role_ids = frozenset(rank.role_id for rank in ranks)
+
+
 class Ranks(commands.Cog):
 
     class Role(commands.RoleConverter):
@@ -33,74 +59,72 @@ class Ranks(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.db = PGRanksDB()
-        self.on_cooldown: List[int] = []
-        self.latest_reactions: Dict[int: int] = {}
-        self.ranks_cache: List[Rank] = []
-        self.guild: discord.Guild = None
+        self.db = open_db("ranks")
+        self.states: GuildStates[RanksState] = GuildStates("ranks", RanksState)
+        self.bot.startup.register("ranks", warm_up=self.warm_up)
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    async def warm_up(self):
         """
-        On_ready eventhandler, gets called by api
+        Called by the startup pipeline once per process
         """
+        # one query for the ranks of all guilds instead of one per guild
+        ranks_by_guild = defaultdict(list)
+        for rank in await self.db.get_all_ranks():
+            ranks_by_guild[rank.guild_id].append(rank)
+        for guild in self.bot.guilds:
+            self.states[guild.id].set_ranks(ranks_by_guild[guild.id])
+        # clear reactions that were missed every 24h
+        scheduler.every("ranks.clear_reactions", 60 * 60 * 24, self.clear_all_user_reactions, jitter=60)
 
-        self.guild: discord.Guild = self.bot.guilds[0]
-        logger.info(f"Set guild to {self.guild}")
+    def cog_unload(self):
+        scheduler.cancel_owner(self)
 
-        self.bot.loop.create_task(self.bg_clear_cooldowns())
-        self.bot.loop.create_task(self.bg_check())
-        await self.update_ranks_cache()
-
-    async def bg_check(self):
+    async def get_state(self, guild_id: int) -> RanksState:
         """
-        Runs every 24h to clear reactions that were missed
+        The state of a guild, with its ranks loaded from the db on first use
         """
-        while not self.bot.is_ready():
-            await asyncio.sleep(1)
+        state = self.states[guild_id]
+        if not state.loaded:
+            await self.update_ranks_cache(guild_id)
+        return state
 
-        while not self.bot.is_closed():
-            await self.clear_user_reactions()
-            await asyncio.sleep(60 * 60 * 24)  # task runs every 24h
+    async def clear_all_user_reactions(self):
+        for guild in self.bot.guilds:
+            await self.clear_user_reactions(guild)
 
-    async def clear_user_reactions(self):
-        channel: discord.TextChannel = self.guild.get_channel(ranks_config.ranks_channel_id)
-        for rank in self.ranks_cache:
+    async def clear_user_reactions(self, guild: discord.Guild):
+        channel_id = ranks_config.for_guild(guild.id).ranks_channel_id
+        channel: discord.TextChannel = guild.get_channel(channel_id)
+        for rank in (await self.get_state(guild.id)).ranks:
             message: discord.Message = await channel.fetch_message(rank.message_id)
             for reaction in message.reactions:
                 async for user in reaction.users():
                     if not user == self.bot.user:
                         await self.bot.http.remove_reaction(
                             message_id=rank.message_id,
-                            channel_id=ranks_config.ranks_channel_id,
+                            channel_id=channel_id,
                             emoji=reaction.emoji,
                             member_id=user.id
                         )
 
-    async def update_ranks_cache(self):
+    async def update_ranks_cache(self, guild_id: int):
         """
-        Update the cache from the db
+        Update the cache of a guild from the db
         """
-        self.ranks_cache = await self.db.get_all_ranks()
+        self.states[guild_id].set_ranks(await self.db.get_all_ranks(guild_id))
 
-    async def bg_clear_cooldowns(self):
+    async def get_rank_by_message(self, state: RanksState, message_id: int) -> Rank:
         """
-        Background task to reset cooldown
+        Looks up the rank of a selection message in the cache, falls back to the db
+        :param state: The state of the guild the message is in
+        :param message_id: The discord id of the ranks selection message
         """
-        while not self.bot.is_closed():
-            self.on_cooldown = []
-            self.latest_reactions = {}
-            await asyncio.sleep(ranks_config.cooldown_time)
-
-    async def process_cooldown(self, user_id: int):
-        """
-        Controls whether the user has violated the rate-limit and places them on cooldown
-        :param user_id: ID of the user that added
-        """
-        self.latest_reactions[user_id] = self.latest_reactions.get(user_id, 1) + 1
-        if self.latest_reactions.get(user_id) > ranks_config.cooldown_count:
-            logger.info(f"Placed {user_id} on cooldown")
-            self.on_cooldown.append(user_id)
+        rank = state.ranks_by_message.get(message_id)
+        if rank:
+            metrics.cache_requests.inc("ranks", "hit")
+            return rank
+        metrics.cache_requests.inc("ranks", "miss")
+        return await self.db.get_rank(message_id=message_id)
 
     @staticmethod
     async def warn_limit_exceeded(member: discord.Member, role: discord.Role):
@@ -109,7 +133,8 @@ class Ranks(commands.Cog):
         :param member: The user that has exceeded the role limit
         :param role: The :class:`Role` the user was trying to add
         """
-        embed = discord.Embed(title=f"You can not have more than **{ranks_config.rank_count_limit}** ranks.\n"
+        limit = ranks_config.for_guild(member.guild.id).rank_count_limit
+        embed = discord.Embed(title=f"You can not have more than **{limit}** ranks.\n"
                                     f"Remove a rank first to add **{role.name}**.")
         await member.send(embed=embed)
 
@@ -139,8 +164,11 @@ class Ranks(commands.Cog):
         Called by api whenever a reaction is added.
         :param payload: A :class:`discord.RawReactionActionEvent`
         """
-        if payload.channel_id == ranks_config.ranks_channel_id and payload.user_id != self.bot.user.id:
-            if payload.user_id in self.on_cooldown:
+        config = ranks_config.for_guild(payload.guild_id)
+        if payload.channel_id == config.ranks_channel_id and payload.user_id != self.bot.user.id:
+            state = await self.get_state(payload.guild_id)
+            if not state.reaction_limiter.hit(payload.user_id):
+                logger.info("%s is on cooldown", payload.user_id)
                 await asyncio.sleep(1)
                 await self.bot.http.remove_reaction(
                     message_id=payload.message_id,
@@ -149,28 +177,27 @@ class Ranks(commands.Cog):
                     member_id=payload.user_id
                 )
                 return
-            await self.process_cooldown(payload.user_id)
-            member: discord.Member = self.guild.get_member(payload.user_id)
+            guild: discord.Guild = self.bot.get_guild(payload.guild_id)
+            member: discord.Member = payload.member or await self.bot.member_loader.get_member(guild, payload.user_id)
 
-            rank = await self.db.get_rank(message_id=payload.message_id)
+            rank = await self.get_rank_by_message(state, payload.message_id)
 
             if rank:
-                role = self.guild.get_role(rank.role_id)
+                role = guild.get_role(rank.role_id)
 
                 if str(payload.emoji) == emoji.white_check_mark:
                     if role not in member.roles:
-                        if len([ro.id for ro in member.roles if
-                                ro.id in [ra.role_id for ra in self.ranks_cache]]) >= ranks_config.rank_count_limit:
+                        if sum(1 for ro in member.roles if ro.id in state.role_ids) >= config.rank_count_limit:
                             await self.warn_limit_exceeded(member, role)
-                            logger.info(f"Stopped {member.name} from adding {role.name}, too many roles")
+                            logger.info("Stopped %s from adding %s, too many roles", member.name, role.name)
                         else:
                             await member.add_roles(role)
-                            logger.info(f"Added {role.name} to {member.name}")
+                            logger.info("Added %s to %s", role.name, member.name)
                             await self.notify_role_added(member, role)
                 elif str(payload.emoji) == emoji.x:
                     if role in member.roles:
                         await member.remove_roles(role)
-                        logger.info(f"Removed {role.name} from {member.name}")
+                        logger.info("Removed %s from %s", role.name, member.name)
                         await self.notify_role_removed(member, role)
 
             await self.bot.http.remove_reaction(message_id=payload.message_id, channel_id=payload.channel_id, emoji=payload.emoji, member_id=payload.user_id)
@@ -198,7 +225,7 @@ class Ranks(commands.Cog):
                 else:
                     await ctx.send(f"Rank {rank.name} already exists", delete_after=5)
         await ctx.message.delete()
-        await self.update_ranks_cache()
+        await self.update_ranks_cache(ctx.guild.id)
 
     @commands.command(aliases=["delete_ranks", "remove_rank", "remove_ranks", "del_rank"])
     @can_ban()
@@ -219,9 +246,9 @@ class Ranks(commands.Cog):
             if delete_role:
                 await self.bot.http.delete_role(ctx.guild.id, rank.role_id)
             await self.db.delete_rank(role_id=rank.role_id)
-            await self.bot.http.delete_message(ranks_config.ranks_channel_id, rank.message_id)
+            await self.bot.http.delete_message(ranks_config.for_guild(ctx.guild.id).ranks_channel_id, rank.message_id)
         await ctx.message.delete()
-        await self.update_ranks_cache()
+        await self.update_ranks_cache(ctx.guild.id)
 
 
     @commands.command(aliases=["renew_rank", "refresh_rank"])
@@ -236,12 +263,12 @@ class Ranks(commands.Cog):
         for role in roles:
             rank = await self.db.get_rank(role_id=role.id)
             await self.db.delete_rank(role_id=rank.role_id)
-            await self.bot.http.delete_message(ranks_config.ranks_channel_id, rank.message_id)
+            await self.bot.http.delete_message(ranks_config.for_guild(ctx.guild.id).ranks_channel_id, rank.message_id)
 
             if not await self.db.get_rank(role_id=role.id):
                 await self.create_rank_message(name=rank.name, role=role)
         await ctx.message.delete()
-        await self.update_ranks_cache()
+        await self.update_ranks_cache(ctx.guild.id)
 
     @commands.command()
     @can_kick()
@@ -249,7 +276,7 @@ class Ranks(commands.Cog):
         """
         Resets the reactions on the rank messages
         """
-        await self.clear_user_reactions()
+        await self.clear_user_reactions(ctx.guild)
         await ctx.message.delete()
 
     @commands.command(aliases=["count_roles", "count_rank"])
@@ -259,7 +286,9 @@ class Ranks(commands.Cog):
         Displays a list of all ranks and the number of assigned members
         """
         embed = discord.Embed(title=f"Ranks distribution {ctx.message.created_at.strftime('%d.%m.%Y %H:%M')}", color=discord.Colour.teal())
-        rank_members = [(rank.name, len(self.guild.get_role(rank.role_id).members)) for rank in await self.db.get_all_ranks()]
+        await self.bot.member_loader.ensure(ctx.guild)
+        rank_members = [(rank.name, len(ctx.guild.get_role(rank.role_id).members))
+                        for rank in await self.db.get_all_ranks(ctx.guild.id)]
         for r in sorted(rank_members, key=lambda x: x[1], reverse=True):
             embed.add_field(name=r[0], value=str(r[1]), inline=True)
         await ctx.send(embed=embed)
@@ -273,9 +302,6 @@ class Ranks(commands.Cog):
         :param reraise_timeout: Whether an exception should be raised on timeout, defaults to False
         :return: bool answer
         """
-        def check(_reaction, _user):
-            return _user == ctx.author and str(_reaction.emoji) in [emoji.x, emoji.white_check_mark]
-
         embed = discord.Embed(title=question, color=discord.Color.dark_gold())
 
         msg = await ctx.send(embed=embed)
@@ -283,7 +309,8 @@ class Ranks(commands.Cog):
         await msg.add_reaction(emoji.x)
 
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=check)
+            reaction = await self.bot.reaction_waiters.wait(msg.id, ctx.author.id, [emoji.white_check_mark, emoji.x],
+                                                            timeout=Timeouts.long)
         except asyncio.TimeoutError as e:
             await msg.delete()
             if reraise_timeout:
@@ -291,8 +318,8 @@ class Ranks(commands.Cog):
             else:
                 return False
         else:
-            await ctx.send(embed=discord.Embed(title=reaction.emoji), delete_after=5)
-            if reaction.emoji == emoji.white_check_mark:
+            await ctx.send(embed=discord.Embed(title=reaction), delete_after=5)
+            if reaction == emoji.white_check_mark:
                 await msg.delete()
                 return True
             else:
@@ -305,10 +332,10 @@ class Ranks(commands.Cog):
         :param name: Name of the new rank
         :param role: The existing discord tole to be linked with the rank
         """
-        channel = role.guild.get_channel(ranks_config.ranks_channel_id)
+        channel = role.guild.get_channel(ranks_config.for_guild(role.guild.id).ranks_channel_id)
         msg = await channel.send(f"Get: **{role.name}**")
 
-        rank = Rank(name=name, role_id=role.id, message_id=msg.id)
+        rank = Rank(name=name, role_id=role.id, message_id=msg.id, guild_id=role.guild.id)
         await self.db.add_rank(rank=rank)
         await msg.add_reaction(emoji.white_check_mark)
         await msg.add_reaction(emoji.x)
@@ -1,44 +1,94 @@
 import asyncio
+import io
 import logging
 import re
+import time
 from datetime import datetime, date, timedelta
 
 import discord
 from discord.ext import commands
-from typing import Optional
+from typing import List, Optional
 
 from config.config import Reputation as reputation_config, Timeouts
-from db_classes.PGReputationDB import PGReputationDB
-from extensions.reputation_graphics import *
+from db_classes.storage import open_db
 from models.reputation_models import Thank
 from utils import emoji
+from utils.guild_state import GuildStates
+from utils.message_pipeline import MessageInfo
+from utils.process_pool import process_pool
+from utils.ratelimit import KeyedLimiter, WindowLimiter
 
 logger = logging.getLogger("Referee")
 
+thx_pattern = re.compile(r"\bthx\b")
+non_word_pattern = re.compile(r"\W+")
+
 from Referee import can_kick, can_ban
 
+
+class ReputationState:
+    """
+    The thank cooldowns of the members of one guild
+    """
+
+    def __init__(self, guild_id: int):
+        config = reputation_config.for_guild(guild_id)
+        # MaxMentions thanks in any Cooldown seconds from one user, and one per Cooldown seconds to the same user
+        self.thank_limiter = WindowLimiter(limit=config.max_mentions, period=config.cooldown)
+        self.pair_limiter = KeyedLimiter(rate=1, period=config.cooldown)
+
+
 class Reputation(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.db = PGReputationDB()
-        self.guild = None
+        self.db = open_db("reputation")
+        self.states: GuildStates[ReputationState] = GuildStates("reputation", ReputationState)
+        # this has to be a message handler, since it's not technically a command
+        # in the sense that it starts with our prefix
+        self.bot.message_pipeline.subscribe(self.on_thank_candidate, guild_only=True, ignore_bots=True,
+                                            contains=("thank", "thx"))
+        self.bot.startup.register("reputation", warm_up=self.warm_up)
+
+    def cog_unload(self):
+        self.bot.message_pipeline.unsubscribe(self)
+
+    async def warm_up(self):
+        """
+        Called by the startup pipeline once per process
+        """
+        await self.load_cooldowns()
+        for guild in self.bot.guilds:
+            await self.check_thanked_roles(guild)
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        self.guild: discord.Guild = self.bot.guilds[0]
-        self.self_thank_emoji = discord.utils.get(self.guild.emojis, name="cmonBruh") or emoji.x
-        await self.check_thanked_roles()
+    async def load_cooldowns(self):
+        """
+        Replays the thanks of the last cooldown period into the limiters, so a restart doesn't reset them
+        """
+        now = datetime.now()
+        longest_cooldown = max([reputation_config.cooldown] +
+                               [reputation_config.for_guild(g.id).cooldown for g in self.bot.guilds])
+        for thank in sorted(await self.db.get_thanks(since=now - timedelta(seconds=longest_cooldown)),
+                            key=lambda t: t.timestamp):
+            if thank.guild_id is None:
+                continue
+            at = time.monotonic() - (now - thank.timestamp).total_seconds()
+            self.record_thank(thank.guild_id, thank.source_user_id, thank.target_user_id, at=at)
+
+    def record_thank(self, guild_id: int, source_user_id: int, target_user_id: int, at: float = None):
+        state = self.states[guild_id]
+        state.thank_limiter.add(source_user_id, now=at)
+        state.pair_limiter.hit((source_user_id, target_user_id), now=at)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.guild:
-            # this has to be in on_message, since it's not technically a command
-            # in the sense that it starts with our prefix
-            if message.author.bot:
-                return
+    @staticmethod
+    def get_self_thank_emoji(guild: discord.Guild):
+        return discord.utils.get(guild.emojis, name="cmonBruh") or emoji.x
 
-            if await self.is_thank_message(message):
-                await self.handle_thank_message(message)
+    async def on_thank_candidate(self, info: MessageInfo):
+        """
+        Called by the message pipeline for guild messages containing "thank" or "thx"
+        """
+        if await self.is_thank_message(info):
+            await self.handle_thank_message(info.message)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
@@ -54,24 +104,26 @@ class Reputation(commands.Cog):
             if all({member.id in before_mentions for member in after.mentions}):
                 return
 
-            if await self.is_thank_message(after):
+            if await self.is_thank_message(MessageInfo(after)):
                 await self.handle_thank_message(after)
 
     async def handle_thank_message(self, message: discord.Message):
         mentioned_members = message.mentions
-        logger.info(
-            f"Received thanks from {message.author} to {', '.join(str(m) for m in mentioned_members)}: {message.content}")
+        logger.info("Received thanks from %s to %s: %s",
+                    message.author, ", ".join(str(m) for m in mentioned_members), message.content)
 
-        if await self.is_on_cooldown(source_user_id=message.author.id):
+        guild = message.guild
+        if self.is_on_cooldown(guild.id, source_user_id=message.author.id):
             if mentioned_members:
                 await message.add_reaction(emoji.hourglass)
             logger.debug("General cooldown active, returning")
             return
 
-        if len(mentioned_members) > reputation_config.max_mentions:
+        max_mentions = reputation_config.for_guild(guild.id).max_mentions
+        if len(mentioned_members) > max_mentions:
             logger.debug("Sending 'Too many mentions'")
             await message.channel.send(
-                f"Maximum number of thanks is {reputation_config.max_mentions}. Try again with less mentions.",
+                f"Maximum number of thanks is {max_mentions}. Try again with less mentions.",
                 delete_after=Timeouts.short
             )
         elif not mentioned_members:
@@ -87,15 +139,15 @@ class Reputation(commands.Cog):
                 if member.bot:
                     invalid.append(member)
                     error_emojis.append(emoji.robot)
-                    logger.debug(f"Thanking {member} canceled: User is bot")
+                    logger.debug("Thanking %s canceled: User is bot", member)
                 elif member == message.author:
                     invalid.append(member)
-                    error_emojis.append(self.self_thank_emoji)
-                    logger.debug(f"Thanking {member} canceled: User thanking themselves")
-                elif await self.is_on_cooldown(source_user_id=message.author.id, target_user_id=member.id):
+                    error_emojis.append(self.get_self_thank_emoji(guild))
+                    logger.debug("Thanking %s canceled: User thanking themselves", member)
+                elif self.is_on_cooldown(guild.id, source_user_id=message.author.id, target_user_id=member.id):
                     invalid.append(member)
                     error_emojis.append(emoji.hourglass)
-                    logger.debug(f"Thanking {member} cancelled: Cooldown active")
+                    logger.debug("Thanking %s cancelled: Cooldown active", member)
 
             valid = [m for m in mentioned_members if m not in invalid]
             if not valid:
@@ -109,28 +161,27 @@ class Reputation(commands.Cog):
                 thumbs_up_reaction = discord.utils.find(lambda x: x.emoji == emoji.thumbs_up,
                                                         message.reactions)
 
-                def check(_reaction: discord.Reaction, _user):
-                    return _reaction.message.id == message.id and _user == message.author and str(
-                        _reaction.emoji) in [emoji.trashcan, emoji.thumbs_up]
-
                 async def save_thanks(members):
                     for member in members:
+                        self.record_thank(guild.id, message.author.id, member.id)
                         await self.db.add_thank(Thank(
                             source_user_id=message.author.id,
                             target_user_id=member.id,
                             channel_id=message.channel.id,
                             message_id=message.id,
-                            timestamp=datetime.now())
+                            timestamp=datetime.now(),
+                            guild_id=guild.id)
                         )
-                        member_rep = await self.db.get_user_rep(member.id)
+                        member_rep = await self.db.get_user_rep(member.id, guild.id)
                         if member_rep == 1:
                             await self.notify_user_of_thank(member, message.author)
 
-                        await self.check_thanked_roles(member)
+                        await self.check_thanked_roles(guild, member)
 
                 try:
-                    reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.short,
-                                                             check=check)
+                    reaction = await self.bot.reaction_waiters.wait(message.id, message.author.id,
+                                                                    [emoji.trashcan, emoji.thumbs_up],
+                                                                    timeout=Timeouts.short)
                 except asyncio.TimeoutError:
                     logger.debug("Thank confirmed: Timeout")
                     async for user in trash_reaction.users():
@@ -138,7 +189,7 @@ class Reputation(commands.Cog):
                     await save_thanks(valid)
 
                 else:
-                    if reaction.emoji == emoji.trashcan:
+                    if reaction == emoji.trashcan:
                         logger.debug("Thank cancelled")
                         async for user in thumbs_up_reaction.users():
                             await message.remove_reaction(emoji.thumbs_up, user)
@@ -167,28 +218,26 @@ class Reputation(commands.Cog):
         embed.add_field(name=f"{member.display_name.replace(' ', '_').lower()}.reputation += 1;", value=thankHelp)
         await member.send(embed=embed)
 
-    async def is_on_cooldown(self, source_user_id, target_user_id=None):
-        all_thanks = await self.db.get_thanks(since=datetime.now() - timedelta(seconds=reputation_config.cooldown))
-        thanks = [t for t in all_thanks if t.source_user_id == source_user_id]
-        if len(thanks) >= reputation_config.max_mentions:
+    def is_on_cooldown(self, guild_id, source_user_id, target_user_id=None):
+        state = self.states[guild_id]
+        if source_user_id in state.thank_limiter:
             return True
         if target_user_id:
-            if target_user_id in [t.target_user_id for t in thanks]:
+            if (source_user_id, target_user_id) in state.pair_limiter:
                 return True
         return False
 
     @staticmethod
-    async def is_thank_message(message: discord.Message) -> bool:
+    async def is_thank_message(info: MessageInfo) -> bool:
+        message = info.message
         ignore_list = ["thanking", "thanker", "thanked"]
 
-        text = message.content.lower()
+        text = info.unquoted
 
         for word in ignore_list:
             text = text.replace(word, "")
 
-        text = "\n".join(line for line in text.split("\n") if not line.startswith("> "))
-
-        if re.findall(r"\bthx\b", text) and message.mentions:  # Thx @Trapture
+        if thx_pattern.search(text) and message.mentions:  # Thx @Trapture
             logger.debug("Is thank: thx mentions")
             return True
 
@@ -199,10 +248,11 @@ class Reputation(commands.Cog):
             elif text.startswith("thank"):  # Thanks bro
                 logger.debug("Is thank: startswith")
                 return True
-            elif any(s.strip().startswith("thank") for s in re.split("\\W+", text)):  # Alright, thanks a lot
+            words = non_word_pattern.split(text)
+            if any(s.strip().startswith("thank") for s in words):  # Alright, thanks a lot
                 logger.debug("Is thank: punctuation startswith")
                 return True
-            elif any(s.strip().endswith("thanks") for s in re.split("\\W+", text)):  # Ah thanks. Cool.
+            elif any(s.strip().endswith("thanks") for s in words):  # Ah thanks. Cool.
                 logger.debug("Is thank: punctuation endswith thanks")
                 return True
             elif "thank you" in text and text[text.find("thank you") - 1] == " ":  # Not "thank you"
@@ -213,17 +263,52 @@ class Reputation(commands.Cog):
         else:
             return False
 
-    async def check_thanked_roles(self, member=None):
+    async def check_thanked_roles(self, guild: discord.Guild, member=None):
         if not member:
-            logger.debug("Checking all members for thank autorole")
-        thanked_role = self.guild.get_role(reputation_config.thanked_role)
-        for member in self.guild.members if not member else [member]:
+            logger.debug("Checking all members of %s for thank autorole", guild)
+        config = reputation_config.for_guild(guild.id)
+        thanked_role = guild.get_role(config.thanked_role)
+        if thanked_role is None:
+            return
+        if member:
+            members = [member]
+        else:
+            # with lazy member loading only some members are cached, those with enough thanks are requested by id
+            qualified = [row["user_id"] for row in await self.db.get_leaderboard(guild.id)
+                         if row["score"] >= config.thanked_role_threshold]
+            members = (await self.bot.member_loader.get_members(guild, qualified)).values()
+        for member in members:
             if thanked_role not in member.roles:
-                member_rep = await self.db.get_user_rep(member.id)
-                if member_rep >= reputation_config.thanked_role_threshold:
+                member_rep = await self.db.get_user_rep(member.id, guild.id)
+                if member_rep >= config.thanked_role_threshold:
                     await member.add_roles(thanked_role, reason="Reached enough thanks")
                     logger.info(f"Added {thanked_role.name} to {member.name} with {member_rep} points")
 
+    async def draw_scoreboard(self, leaderboard: list, guild: discord.Guild, highlight=None) -> io.BytesIO:
+        """
+        Renders the scoreboard in the process pool, members who left the server are left out
+        """
+        options = reputation_config.for_guild(guild.id)
+        members = await self.bot.member_loader.get_members(guild, [row["user_id"] for row in leaderboard])
+        rows = []
+        for row in leaderboard:
+            member = members.get(row["user_id"])
+            if not member:
+                logger.error(f"No member with user_id {row['user_id']}")
+                continue
+            rows.append((row["rank"], row["user_id"], member.display_name, row["score"]))
+        style = {"fontsize": options.fontsize, "font_colors": options.font_colors,
+                 "default_fontcolor": options.default_fontcolor, "highlight_color": options.highlight_color}
+        png = await process_pool.submit("extensions.reputation_graphics:draw_scoreboard", rows, style, highlight)
+        return io.BytesIO(png)
+
+    async def generate_graph(self, guild: discord.Guild, history: List[Thank], format="png") -> io.BytesIO:
+        members = await self.bot.member_loader.get_members(guild, [t.target_user_id for t in history])
+        names = {user_id: f"{m.name}#{m.discriminator}" for user_id, m in members.items()}
+        image = await process_pool.submit("extensions.reputation_graphics:generate_graph",
+                                          [(t.target_user_id, t.timestamp) for t in history], names, format)
+        return io.BytesIO(image)
+
     @commands.command(hidden=True)
     @can_kick()
     async def test_notify(self, ctx: commands.Context):
@@ -238,13 +323,13 @@ class Reputation(commands.Cog):
         if ctx.invoked_subcommand is None:
             if not member:
                 member = ctx.author
-            leaderboard = await self.db.get_leaderboard()
+            leaderboard = await self.db.get_leaderboard(ctx.guild.id)
 
             rank = [m["rank"] for m in leaderboard if m["user_id"] == member.id]
             if rank:
                 rank = rank[0]
 
-            rep = await self.db.get_user_rep(member.id)
+            rep = await self.db.get_user_rep(member.id, ctx.guild.id)
 
             if member.bot:
                 rep = "Math.Infinity"  # Not python, but it looks better than math.inf
@@ -260,22 +345,22 @@ class Reputation(commands.Cog):
     async def thank_stats(self, ctx: commands.Context, member: Optional[discord.Member] = None):
 
         def display_name(u_id):  # TODO: put this where it belongs
-            if not self.guild.get_member(u_id):
+            if u_id not in members:
                 return str(u_id)
             else:
-                return self.guild.get_member(u_id).display_name
+                return members[u_id].display_name
 
         if not member:
             member = ctx.author
 
         if member.bot:
             embed = discord.Embed(title=f"Thanking history of {member.display_name}", color=discord.Color.dark_gold())
-            embed.add_field(name=f"Received: 0", value=f"{member.display_name}, the thankless hero of {self.guild.name}")
+            embed.add_field(name=f"Received: 0", value=f"{member.display_name}, the thankless hero of {ctx.guild.name}")
             await ctx.send(embed=embed)
             return
 
-        thanks_received = await self.db.get_thanks(target_user_id=member.id)
-        thanks_given = await self.db.get_thanks(source_user_id=member.id)
+        thanks_received = await self.db.get_thanks(target_user_id=member.id, guild_id=ctx.guild.id)
+        thanks_given = await self.db.get_thanks(source_user_id=member.id, guild_id=ctx.guild.id)
         embed = discord.Embed(title=f"Thanking history of {member.display_name}", color=discord.Color.dark_gold())
         thankers = dict()
         for t in thanks_received:
@@ -286,6 +371,7 @@ class Reputation(commands.Cog):
         for t in thanks_given:
             date_str = t.timestamp.strftime('%d %b %Y')
             thankees[t.target_user_id] = thankees.get(t.target_user_id, []) + [date_str]
+        members = await self.bot.member_loader.get_members(ctx.guild, [*thankers, *thankees])
 
         received = "\n".join(
             f"{display_name(u_id)}{'(' + str(len(dates)) + ')' if len(dates) > 1 else ''}" for u_id, dates in
@@ -302,11 +388,11 @@ class Reputation(commands.Cog):
     async def thanks_graph(self, ctx: commands.Context):
         try:
             async with ctx.typing():
-                filename = await generate_graph(self.guild, await self.db.get_thanks())
+                graph = await self.generate_graph(ctx.guild, await self.db.get_thanks(guild_id=ctx.guild.id))
 
-            await ctx.send(f"There you go {ctx.author.mention}", file=discord.File(filename))
+            await ctx.send(f"There you go {ctx.author.mention}", file=discord.File(graph, filename="graph.png"))
         except Exception as e:
-            await ctx.send(f"Nope, graph machine broke. {self.guild.get_member(238359385888260096).mention}!!!")
+            await ctx.send(f"Nope, graph machine broke. <@238359385888260096>!!!")
             raise e
 
     @commands.command(name="scoreboard", hidden=True)
@@ -323,14 +409,14 @@ class Reputation(commands.Cog):
         """
         await ctx.trigger_typing()
         if ctx.invoked_subcommand is None:
-            leaderboard = await self.db.get_leaderboard()
+            leaderboard = await self.db.get_leaderboard(ctx.guild.id)
 
             if not leaderboard:
                 embed = discord.Embed(title=f"No entries", color=discord.Color.dark_gold())
                 await ctx.send(embed=embed)
             else:
-                img = await draw_scoreboard(leaderboard=leaderboard[:reputation_config.leaderboard_max_length],
-                                            guild=self.guild)
+                limit = reputation_config.for_guild(ctx.guild.id).leaderboard_max_length
+                img = await self.draw_scoreboard(leaderboard=leaderboard[:limit], guild=ctx.guild)
                 await ctx.send(file=discord.File(img, filename="scoreboard.png"))
 
     @leaderboard.command()
@@ -338,13 +424,13 @@ class Reputation(commands.Cog):
         """
         Display entire scoreboard, not only first places
         """
-        leaderboard = await self.db.get_leaderboard()
+        leaderboard = await self.db.get_leaderboard(ctx.guild.id)
 
         if not leaderboard:
             embed = discord.Embed(title=f"No entries", color=discord.Color.dark_gold())
             await ctx.send(embed=embed)
         else:
-            img = await draw_scoreboard(leaderboard=leaderboard, guild=self.guild)
+            img = await self.draw_scoreboard(leaderboard=leaderboard, guild=ctx.guild)
             await ctx.send(file=discord.File(img, filename="scoreboard.png"))
 
     @leaderboard.command()
@@ -359,13 +445,13 @@ class Reputation(commands.Cog):
         since = date(date.today().year, month_number, 1)
         until = since + timedelta(days=30)
 
-        leaderboard = await self.db.get_leaderboard(since, until)
+        leaderboard = await self.db.get_leaderboard(ctx.guild.id, since, until)
 
         if not leaderboard:
             embed = discord.Embed(title=f"No entries for {month_name}", color=discord.Color.dark_gold())
             await ctx.send(embed=embed)
         else:
-            img = await draw_scoreboard(leaderboard=leaderboard, guild=self.guild)
+            img = await self.draw_scoreboard(leaderboard=leaderboard, guild=ctx.guild)
             await ctx.send(file=discord.File(img, filename="scoreboard.png"))
 
     @leaderboard.command()
@@ -377,13 +463,13 @@ class Reputation(commands.Cog):
         until = date.today() + timedelta(days=1)
         since = until - timedelta(days=8)
 
-        leaderboard = await self.db.get_leaderboard(since, until)
+        leaderboard = await self.db.get_leaderboard(ctx.guild.id, since, until)
 
         if not leaderboard:
             embed = discord.Embed(title=f"No entries for the last week", color=discord.Color.dark_gold())
             await ctx.send(embed=embed)
         else:
-            img = await draw_scoreboard(leaderboard=leaderboard, guild=self.guild)
+            img = await self.draw_scoreboard(leaderboard=leaderboard, guild=ctx.guild)
             await ctx.send(file=discord.File(img, filename="scoreboard.png"))
 
     @leaderboard.command()
@@ -394,7 +480,7 @@ class Reputation(commands.Cog):
         :return:
         """
 
-        leaderboard = await self.db.get_leaderboard()
+        leaderboard = await self.db.get_leaderboard(ctx.guild.id)
 
         if ctx.author.id not in (user_ids := [m["user_id"] for m in leaderboard]):
             embed = discord.Embed(
@@ -408,8 +494,8 @@ class Reputation(commands.Cog):
                 a, b = a - 1, b - 1
             while a < 0:
                 a, b = a + 1, b + 1
-            img = await draw_scoreboard(leaderboard=leaderboard[a:b], highlight={"member_id": ctx.author.id},
-                                        guild=self.guild)
+            img = await self.draw_scoreboard(leaderboard=leaderboard[a:b], highlight={"member_id": ctx.author.id},
+                                        guild=ctx.guild)
             await ctx.send(file=discord.File(img, filename="scoreboard.png"))
 
 def setup(bot: commands.Bot):
@@ -7,9 +7,12 @@ from typing import List, Union, Dict, Tuple
 
 from Referee import can_ban, can_kick
 from config.config import Rolegroups as rolegroups_config, Timeouts
-from db_classes.PGRolegroupsDB import PGRolegroupsDB
+from db_classes.storage import open_db
 from models.rolegroups_models import Rolegroup
 from utils import emoji
+from utils.guild_state import GuildStates
+from utils.ratelimit import KeyedLimiter
+from utils.scheduler import scheduler
 
 logger = logging.getLogger("Referee")
 
@@ -43,8 +46,8 @@ class Rolegroup_T(commands.RoleConverter):
 
 
     async def convert(self, ctx: commands.Context, argument: str) -> Rolegroup:
-        db: PGRolegroupsDB = ctx.bot.cogs["Rolegroups"].db
-        rolegroups = await db.get_all_rolegroups()
+        db = ctx.bot.cogs["Rolegroups"].db
+        rolegroups = await db.get_all_rolegroups(ctx.guild.id)
 
         id_matches = list(filter(lambda r: str(r.db_id) == argument, rolegroups))
         name_matches = list(filter(lambda r: r.name.lower().startswith(argument.lower()), rolegroups))
@@ -66,84 +69,71 @@ class Rolegroup_T(commands.RoleConverter):
             raise commands.BadArgument(f"No Rolegroups found with {argument}")
 
 
-class Rolegroups(commands.Cog):
+class RolegroupsState:
+    """
+    The reaction cooldowns of the members of one guild and its rolegroup editing session
+    """
 
-    def __init__(self, bot: commands.Bot):
-        self.bot = bot
-        self.db = PGRolegroupsDB()
-        self.on_cooldown: List[int] = []
-        self.latest_reactions: Dict[int: int] = {}
+    def __init__(self, guild_id: int):
+        config = rolegroups_config.for_guild(guild_id)
+        # more than CooldownCount reactions within CooldownTime seconds are removed unprocessed
+        self.reaction_limiter = KeyedLimiter(rate=config.cooldown_count, period=config.cooldown_time,
+                                             burst=config.cooldown_count)
         self.editing_mod: discord.Member = None
         self.edit_save_actions = []
         self.edit_cancel_actions = []
-        self.temp_rolegroups: Dict[str: Rolegroup] = dict()
-        self.guild: discord.Guild = None
+        self.temp_rolegroups: Dict[int, Rolegroup] = dict()
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """
-        On_ready eventhandler, gets called by api
-        """
+class Rolegroups(commands.Cog):
 
-        self.guild: discord.Guild = self.bot.guilds[0]
-        logger.info(f"Set guild to {self.guild}")
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.db = open_db("rolegroups")
+        self.states: GuildStates[RolegroupsState] = GuildStates("rolegroups", RolegroupsState)
+        self.bot.startup.register("rolegroups", warm_up=self.warm_up)
 
-        self.bot.loop.create_task(self.bg_clear_cooldowns())
-        self.bot.loop.create_task(self.bg_check())
 
+    async def warm_up(self):
+        """
+        Called by the startup pipeline once per process
+        """
         for rg in await self.db.get_all_rolegroups():
-            await self.stop_editing(rg, save_changes=False)
+            if self.bot.get_guild(rg.guild_id):
+                await self.stop_editing(rg, save_changes=False)
 
+        # clear reactions that were missed every hour
+        scheduler.every("rolegroups.clear_reactions", 60 * 60, self.autoclear_user_reactions, jitter=60)
 
-    async def bg_check(self):
-        """
-        Runs every 24h to clear reactions that were missed
-        """
-        while not self.bot.is_ready():
-            await asyncio.sleep(1)
 
-        while not self.bot.is_closed():
-            logger.info(f"Autoclearing user reactions")
-            await self.clear_user_reactions()
-            await asyncio.sleep(60 * 60)  # task runs every hour
+    def cog_unload(self):
+        scheduler.cancel_owner(self)
+
+
+    async def autoclear_user_reactions(self):
+        logger.info(f"Autoclearing user reactions")
+        await self.clear_user_reactions()
 
 
-    async def clear_user_reactions(self):
-        for rolegroup in await self.db.get_all_rolegroups():
+    async def clear_user_reactions(self, guild_id: int = None):
+        """
+        :param guild_id: Only clear the rolegroups of this guild, those of all guilds if None
+        """
+        for rolegroup in await self.db.get_all_rolegroups(guild_id):
+            if not self.bot.get_guild(rolegroup.guild_id):
+                continue
             rolegroup_msg = await self.get_rolegroup_message(rolegroup=rolegroup)
             for reaction in rolegroup_msg.reactions:
                 async for user in reaction.users():
                     if not user == self.bot.user:
                         await self.bot.http.remove_reaction(
                             message_id=rolegroup.message_id,
-                            channel_id=rolegroups_config.channel_id,
+                            channel_id=rolegroup_msg.channel.id,
                             emoji=reaction.emoji,
                             member_id=user.id
                         )
 
 
-    async def bg_clear_cooldowns(self):
-        """
-        Background task to reset cooldown
-        """
-        while not self.bot.is_closed():
-            self.on_cooldown = []
-            self.latest_reactions = {}
-            await asyncio.sleep(rolegroups_config.cooldown_time)
-
-
-    async def process_cooldown(self, user_id: int):
-        """
-        Controls whether the user has violated the rate-limit and places them on cooldown
-        :param user_id: ID of the user that added
-        """
-        self.latest_reactions[user_id] = self.latest_reactions.get(user_id, 1) + 1
-        if self.latest_reactions.get(user_id) > rolegroups_config.cooldown_count:
-            logger.info(f"Placed {user_id} on cooldown")
-            self.on_cooldown.append(user_id)
-
-
     @staticmethod
     async def warn_limit_exceeded(member: discord.Member, rolegroup: Rolegroup):
         """
@@ -151,8 +141,9 @@ class Rolegroups(commands.Cog):
         :param member: The user that has exceeded the role limit
         :param rolegroup: The :class:`Rolegroup` the user was trying to add a role from
         """
+        limit = rolegroups_config.for_guild(member.guild.id).role_count_limit
         embed = discord.Embed(
-            title=f"You can not have more than **{rolegroups_config.role_count_limit}** roles from {rolegroup.name}. Remove a role by clicking the reaction again.")
+            title=f"You can not have more than **{limit}** roles from {rolegroup.name}. Remove a role by clicking the reaction again.")
         await member.send(embed=embed)
 
 
@@ -184,10 +175,11 @@ class Rolegroups(commands.Cog):
         Called by api whenever a reaction is added.
         :param payload: A :class:`discord.RawReactionActionEvent`
         """
-        if payload.channel_id == rolegroups_config.channel_id and payload.user_id != self.bot.user.id:
+        if payload.channel_id == rolegroups_config.for_guild(payload.guild_id).channel_id \
+                and payload.user_id != self.bot.user.id:
 
-            if payload.user_id in self.on_cooldown:
-                logger.debug(f"User {payload.user_id} on cooldown, ignoring")
+            if not self.states[payload.guild_id].reaction_limiter.hit(payload.user_id):
+                logger.debug("User %s on cooldown, ignoring", payload.user_id)
                 await asyncio.sleep(1)
                 await self.bot.http.remove_reaction(
                     message_id=payload.message_id,
@@ -196,12 +188,12 @@ class Rolegroups(commands.Cog):
                     member_id=payload.user_id
                 )
                 return
-            await self.process_cooldown(payload.user_id)
-            member: discord.Member = self.guild.get_member(payload.user_id)
+            member: discord.Member = payload.member or await self.bot.member_loader.get_member(
+                self.bot.get_guild(payload.guild_id), payload.user_id)
 
             rolegroup: Rolegroup = await self.db.get_rolegroup(message_id=payload.message_id)
             if rolegroup:
-                logger.debug(f"Reaction {payload.emoji} to {rolegroup.name} from {member.name}")
+                logger.debug("Reaction %s to %s from %s", payload.emoji, rolegroup.name, member.name)
                 try:
                     await self.handle_rolegroup_reaction(rolegroup=rolegroup, member=member,
                                                          reaction_emoji=str(payload.emoji))
@@ -213,24 +205,25 @@ class Rolegroups(commands.Cog):
 
 
     async def handle_rolegroup_reaction(self, rolegroup: Rolegroup, member: discord.Member, reaction_emoji: str):
-        if self.editing_mod:
+        state = self.states[member.guild.id]
+        if state.editing_mod:
             rolegroup = self.get_temp_rolegroup(rolegroup)
 
         role_id = rolegroup.get_role(reaction_emoji)
         if not role_id:
-            logger.debug(f"No role_id for emoji {reaction_emoji}")
-        role = self.guild.get_role(role_id)
+            logger.debug("No role_id for emoji %s", reaction_emoji)
+        role = member.guild.get_role(role_id)
         if role_id and role is None and reaction_emoji not in control_emojis:
-            logger.info(f"Forgetting inexistent role with id {role_id}")
-            rolegroup.del_role(role_id=role_id)
-            if self.editing_mod:
+            logger.info("Forgetting inexistent role with id %s", role_id)
+            rolegroup = rolegroup.without_role(role_id=role_id)
+            if state.editing_mod:
                 await self.update_temp_rolegroup(rolegroup)
             else:
                 await self.db.update_rolegroup(rolegroup)
             await self.update_rolegroup_message(rolegroup)
 
-        if self.editing_mod and member.id == self.editing_mod.id:
-            logger.debug(f"Editing mode: {reaction_emoji}")
+        if state.editing_mod and member.id == state.editing_mod.id:
+            logger.debug("Editing mode: %s", reaction_emoji)
             if reaction_emoji == emoji.plus:
                 await self.add_new_role_prompt(member, rolegroup)
             elif reaction_emoji == emoji.pencil:
@@ -244,23 +237,23 @@ class Rolegroups(commands.Cog):
             return
 
         if not role:
-            logger.debug(f"No role with id {role_id}")
+            logger.debug("No role with id %s", role_id)
             return
         else:
-            logger.debug(f"Matched {reaction_emoji} to {role.name}")
+            logger.debug("Matched %s to %s", reaction_emoji, role.name)
 
         if role not in member.roles:
             if sum(1 for role in member.roles if
-                   role.id in rolegroup.roles.values()) >= rolegroups_config.role_count_limit:
+                   role.id in rolegroup.role_ids) >= rolegroups_config.for_guild(member.guild.id).role_count_limit:
                 await self.warn_limit_exceeded(member, rolegroup)
-                logger.info(f"Stopped {member.name} from adding {role.name}, too many roles")
+                logger.info("Stopped %s from adding %s, too many roles", member.name, role.name)
             else:
                 await member.add_roles(role)
-                logger.info(f"Added {role.name} to {member.name}")
+                logger.info("Added %s to %s", role.name, member.name)
                 await self.notify_role_added(member, role)
         else:
             await member.remove_roles(role)
-            logger.info(f"Removed {role.name} from {member.name}")
+            logger.info("Removed %s from %s", role.name, member.name)
             await self.notify_role_removed(member, role)
 
 
@@ -305,15 +298,14 @@ del *RLEGROUP_NAME* *ROLENAME*
             finally:
                 await prompt.delete()
 
-        if list(filter(lambda x: x.name == name, await self.db.get_all_rolegroups())):
+        if list(filter(lambda x: x.name == name, await self.db.get_all_rolegroups(ctx.guild.id))):
             await self.send_simple_embed(channel=ctx, content="A role group with that name already exists",
                                          delete_after=5)
             await ctx.message.delete()
             return
-        rolegroup = Rolegroup(name=name)
+        rolegroup = Rolegroup(name=name, guild_id=ctx.guild.id)
         msg = await self.create_rolegroup_message(rolegroup=rolegroup)
-        rolegroup.message_id = msg.id
-        await self.db.add_rolegroup(rolegroup=rolegroup)
+        await self.db.add_rolegroup(rolegroup=rolegroup._replace(message_id=msg.id))
         await ctx.message.delete()
 
 
@@ -333,9 +325,9 @@ del *RLEGROUP_NAME* *ROLENAME*
         else:
             if delete_all:
                 logger.info(f"Deleting all roles from rolegroup {rolegroup.name}")
-                for role_id in rolegroup.roles.values():
+                for role_id in rolegroup.role_ids:
                     try:
-                        role = self.guild.get_role(role_id)
+                        role = ctx.guild.get_role(role_id)
                         await role.delete(reason=f"Bulk delete by {ctx.author.name}")
                     except Exception as e:
                         logger.error(e)
@@ -361,8 +353,9 @@ del *RLEGROUP_NAME* *ROLENAME*
 Click an existing roles reaction to edit the role
 """
         msg = await self.send_simple_embed(channel=ctx, content=helpmsg)
-        self.edit_cancel_actions.append(msg.delete())
-        self.edit_save_actions.append(msg.delete())
+        state = self.states[ctx.guild.id]
+        state.edit_cancel_actions.append(msg.delete())
+        state.edit_save_actions.append(msg.delete())
         await ctx.message.delete()
 
 
@@ -379,10 +372,10 @@ Click an existing roles reaction to edit the role
             temp = {"emoji": role_emoji, "role_id": from_group.get_role(emoji=role_emoji)}
 
         if temp.get("emoji") and temp.get("role_id"):
-            to_group.add_role(role_id=temp.get("role_id"), emoji=temp.get("emoji"))
+            to_group = to_group.with_role(role_id=temp.get("role_id"), emoji=temp.get("emoji"))
             await self.db.update_rolegroup(to_group)
 
-            from_group.del_role(role_id=temp.get("role_id"))
+            from_group = from_group.without_role(role_id=temp.get("role_id"))
             await self.db.update_rolegroup(from_group)
 
             await self.update_rolegroup_message(from_group)
@@ -442,9 +435,9 @@ Click an existing roles reaction to edit the role
         if type(role) == str:
             logger.info(f"Creating new role {role} for {rolegroup.name}")
             name = role
-            role = await self.guild.create_role(name=name, reason=f"Added to {rolegroup.name} by {ctx.author.name}")
+            role = await ctx.guild.create_role(name=name, reason=f"Added to {rolegroup.name} by {ctx.author.name}")
 
-        rolegroup.add_role(role_id=role.id, emoji=role_emoji)
+        rolegroup = rolegroup.with_role(role_id=role.id, emoji=role_emoji)
         await self.db.update_rolegroup(rolegroup)
         await self.update_rolegroup_message(rolegroup)
 
@@ -458,7 +451,7 @@ Click an existing roles reaction to edit the role
         except asyncio.TimeoutError:
             logger.error("del_role timed out")
             return
-        rolegroup.del_role(role_id=role.id)
+        rolegroup = rolegroup.without_role(role_id=role.id)
         if delete_role:
             await role.delete(reason=f"Deleted by {ctx.author.name}")
         await self.db.update_rolegroup(rolegroup)
@@ -469,7 +462,7 @@ Click an existing roles reaction to edit the role
     @rolegroup_cmd.command(name="rename")
     @can_ban()
     async def rename_rolegroup(self, ctx: commands.Context, rolegroup: Rolegroup_T, *, name: str):
-        rolegroup.name = name
+        rolegroup = rolegroup._replace(name=name)
         await self.db.update_rolegroup(rolegroup)
         await self.update_rolegroup_message(rolegroup)
         await ctx.message.delete()
@@ -478,7 +471,7 @@ Click an existing roles reaction to edit the role
     @rolegroup_cmd.command(name="id", aliases=["ids"])
     @can_kick()
     async def rolegroup_ids(self, ctx: commands.Context):
-        rolegroups = await self.db.get_all_rolegroups()
+        rolegroups = await self.db.get_all_rolegroups(ctx.guild.id)
         text = "\n".join(
             f"{r.db_id}: {r.name} ({len(r.roles)} roles)" for r in sorted(rolegroups, key=lambda x: x.db_id))
         await self.send_simple_embed(channel=ctx, content=text, delete_after=30)
@@ -493,7 +486,7 @@ Click an existing roles reaction to edit the role
             async for user in reaction.users():
                 await self.bot.http.remove_reaction(
                     message_id=rolegroup.message_id,
-                    channel_id=rolegroups_config.channel_id,
+                    channel_id=rolegroup_msg.channel.id,
                     emoji=reaction.emoji,
                     member_id=user.id
                 )
@@ -505,7 +498,8 @@ Click an existing roles reaction to edit the role
     @can_kick()
     async def count_rolegroup_members(self, ctx: commands.Context, rolegroup: Rolegroup_T):
         embed = discord.Embed(title=f"{rolegroup.name}")
-        roles = sorted([self.guild.get_role(r_id) for r_id in rolegroup.roles.values()], key=lambda x: len(x.members),
+        await self.bot.member_loader.ensure(ctx.guild)
+        roles = sorted([ctx.guild.get_role(r_id) for r_id in rolegroup.role_ids], key=lambda x: len(x.members),
                        reverse=True)
         text = "\n".join(f"{rolegroup.get_emoji(r.id)} {r.name}: {len(r.members)}" for r in roles)
         embed.add_field(name="*", value=text)
@@ -522,12 +516,6 @@ Click an existing roles reaction to edit the role
         :param reraise_timeout: Whether an exception should be raised on timeout, defaults to True
         :return: bool answer
         """
-
-
-        def check(_reaction, _user):
-            return _user == member and str(_reaction.emoji) in [emoji.x, emoji.white_check_mark]
-
-
         if type(ctx) == commands.Context:
             channel = ctx.channel
             member = ctx.author
@@ -542,7 +530,8 @@ Click an existing roles reaction to edit the role
         await msg.add_reaction(emoji.x)
 
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=Timeouts.long, check=check)
+            reaction = await self.bot.reaction_waiters.wait(msg.id, member.id, [emoji.white_check_mark, emoji.x],
+                                                            timeout=Timeouts.long)
         except asyncio.TimeoutError as e:
             await msg.delete()
             if reraise_timeout:
@@ -550,8 +539,8 @@ Click an existing roles reaction to edit the role
             else:
                 return False
         else:
-            await self.send_simple_embed(channel=channel, content=reaction.emoji, delete_after=2)
-            if reaction.emoji == emoji.white_check_mark:
+            await self.send_simple_embed(channel=channel, content=reaction, delete_after=2)
+            if reaction == emoji.white_check_mark:
                 await msg.delete()
                 return True
             else:
@@ -563,9 +552,7 @@ Click an existing roles reaction to edit the role
         """
         This function sends the "Rolegroup" to the ranks channel
         """
-        channel = self.guild.get_channel(rolegroups_config.channel_id)
-
-        msg = await self.send_simple_embed(channel=channel, content=rolegroup.name)
+        msg = await self.send_simple_embed(channel=self.get_channel(rolegroup.guild_id), content=rolegroup.name)
         return msg
 
 
@@ -578,18 +565,19 @@ Click an existing roles reaction to edit the role
             if not rolegroup.get_role(reaction.emoji):
                 await self.bot.http.remove_reaction(
                     message_id=rolegroup.message_id,
-                    channel_id=rolegroups_config.channel_id,
+                    channel_id=rolegroup_msg.channel.id,
                     emoji=reaction.emoji,
                     member_id=self.bot.user.id
                 )
         embed_roles_texts = []
-        emoji_full_role = [(role_emoji, self.guild.get_role(role_id) or role_id) for role_emoji, role_id in
-                           rolegroup.roles.items()]
+        guild = rolegroup_msg.guild
+        emoji_full_role = [(role_emoji, guild.get_role(role_id) or role_id) for role_emoji, role_id in
+                           rolegroup.roles]
         for role_emoji, role in sorted(emoji_full_role, key=lambda r: r[1].name.lower()):
             if type(role) != discord.Role:
                 logger.info(f"Forgetting role with id {role}")
-                rolegroup.del_role(role_id=role)
-                if self.editing_mod:
+                rolegroup = rolegroup.without_role(role_id=role)
+                if self.states[guild.id].editing_mod:
                     await self.update_temp_rolegroup(rolegroup)
                 else:
                     await self.db.update_rolegroup(rolegroup)
@@ -612,7 +600,7 @@ Click an existing roles reaction to edit the role
 
         rolegroup = self.get_temp_rolegroup(rolegroup)
 
-        channel: discord.TextChannel = self.guild.get_channel(rolegroups_config.channel_id)
+        channel: discord.TextChannel = self.get_channel(member.guild.id)
         if self.is_full(rolegroup):
             await self.send_simple_embed(channel=channel,
                                          content=f"The maximum number of roles for {rolegroup.name} has been reached.\nRemove some roles or create a new group",
@@ -662,21 +650,21 @@ Click an existing roles reaction to edit the role
                                                  delete_after=5)
                     return
 
-                if role_emoji in rolegroup.roles.keys():
+                if role_emoji in rolegroup.emojis:
                     await self.send_simple_embed(channel=channel,
-                                                 content=f"{role_emoji} is already assigned to {await self.guild.get_role(rolegroup.get_role(role_emoji)).name}.\nIf you want to rename it, click the {role_emoji} reaction")
+                                                 content=f"{role_emoji} is already assigned to {member.guild.get_role(rolegroup.get_role(role_emoji)).name}.\nIf you want to rename it, click the {role_emoji} reaction")
                     return
 
                 role = None
                 if name.isnumeric():
-                    role = self.guild.get_role(int(name))
+                    role = member.guild.get_role(int(name))
                 if not role:
-                    role = await self.guild.create_role(name=name, reason=f"Added to {rolegroup.name} by {member.name}")
-                    self.edit_cancel_actions.append(role.delete(reason=f"Cancelled rolegroup editing"))
+                    role = await member.guild.create_role(name=name, reason=f"Added to {rolegroup.name} by {member.name}")
+                    self.states[member.guild.id].edit_cancel_actions.append(
+                        role.delete(reason=f"Cancelled rolegroup editing"))
                     logger.info(f"Created role {role.name}")
 
-                rolegroup.add_role(role_id=role.id, emoji=role_emoji)
-                await self.update_temp_rolegroup(rolegroup)
+                await self.update_temp_rolegroup(rolegroup.with_role(role_id=role.id, emoji=role_emoji))
             finally:
                 await message.delete()
                 await prompt.delete()
@@ -687,13 +675,9 @@ Click an existing roles reaction to edit the role
             return _message.author.id == member.id and _message.content
 
 
-        def reaction_check(_reaction, _user):
-            return _reaction.message == prompt and _user.id == member.id and _reaction.emoji in edit_control_emojis
-
-
         rolegroup = self.get_temp_rolegroup(rolegroup)
 
-        channel: discord.TextChannel = self.guild.get_channel(rolegroups_config.channel_id)
+        channel: discord.TextChannel = self.get_channel(member.guild.id)
         embed = discord.Embed(title=f"{rolegroup.get_emoji(role.id)} {role.name}", color=discord.Color.dark_gold())
         embed.add_field(name=f"Use reactions to edit {role.name}",
                         value=f"{emoji.pencil}: edit name\n{emoji.rotating_arrows}: change emoji\n{emoji.trashcan}: delete")
@@ -701,12 +685,13 @@ Click an existing roles reaction to edit the role
         for e in edit_control_emojis:
             await prompt.add_reaction(e)
         try:
-            reaction, user = await self.bot.wait_for("reaction_add", check=reaction_check, timeout=Timeouts.long)
+            reaction = await self.bot.reaction_waiters.wait(prompt.id, member.id, edit_control_emojis,
+                                                            timeout=Timeouts.long)
         except asyncio.TimeoutError:
             logger.error("edit prompt timed out")
             return
         else:
-            if reaction.emoji == emoji.pencil:
+            if reaction == emoji.pencil:
                 sub_prompt = await self.send_simple_embed(channel=channel,
                                                           content=f"Send a new name for {rolegroup.get_emoji(role.id)}")
                 try:
@@ -717,11 +702,11 @@ Click an existing roles reaction to edit the role
                 else:
                     prev = role.name
                     await role.edit(name=message.content)
-                    self.edit_cancel_actions.append(role.edit(name=prev))
+                    self.states[member.guild.id].edit_cancel_actions.append(role.edit(name=prev))
                     await message.delete()
                 finally:
                     await sub_prompt.delete()
-            elif reaction.emoji == emoji.rotating_arrows:
+            elif reaction == emoji.rotating_arrows:
                 sub_prompt = await self.send_simple_embed(channel=channel,
                                                           content=f"Send a new non-custom emoji for {role.name}")
                 try:
@@ -750,13 +735,13 @@ Click an existing roles reaction to edit the role
                                                          delete_after=5)
                             return
 
-                        rolegroup.del_role(role_id=role.id)
-                        rolegroup.add_role(role_id=role.id, emoji=role_emoji)
+                        rolegroup = rolegroup.without_role(role_id=role.id).with_role(role_id=role.id,
+                                                                                      emoji=role_emoji)
                     finally:
                         await message.delete()
                 finally:
                     await sub_prompt.delete()
-            elif reaction.emoji == emoji.trashcan:
+            elif reaction == emoji.trashcan:
                 try:
                     delete_role = await self.quick_embed_query(ctx=(channel, member),
                                                                question="Also delete discord role?",
@@ -765,9 +750,10 @@ Click an existing roles reaction to edit the role
                     logger.error("edit prompt, delete role timed out")
                     return
                 else:
-                    rolegroup.del_role(role.id)
+                    rolegroup = rolegroup.without_role(role.id)
                     if delete_role:
-                        self.edit_save_actions.append(role.delete(reason=f"Deleted by {member.name}"))
+                        self.states[member.guild.id].edit_save_actions.append(
+                            role.delete(reason=f"Deleted by {member.name}"))
             await self.update_temp_rolegroup(rolegroup)
         finally:
             await prompt.delete()
@@ -780,7 +766,7 @@ Click an existing roles reaction to edit the role
 
         rolegroup = self.get_temp_rolegroup(rolegroup)
 
-        channel: discord.TextChannel = self.guild.get_channel(rolegroups_config.channel_id)
+        channel: discord.TextChannel = self.get_channel(member.guild.id)
         prompt = await self.send_simple_embed(channel=channel, content=f"Send a new name for {rolegroup.name}",
                                               mentions=member)
         try:
@@ -792,73 +778,79 @@ Click an existing roles reaction to edit the role
             name: str = message.content
             await message.delete()
 
-            rolegroup.name = name
-            await self.update_temp_rolegroup(rolegroup)
+            await self.update_temp_rolegroup(rolegroup._replace(name=name))
 
         finally:
             await prompt.delete()
 
 
     async def start_editing(self, rolegroup: Rolegroup, editor: discord.Member):
-        logger.info(f"Started editing")
-        await self.load_temp_rolegroups()
-        self.editing_mod = editor
+        logger.info(f"Started editing in {editor.guild}")
+        await self.load_temp_rolegroups(rolegroup.guild_id)
+        self.states[rolegroup.guild_id].editing_mod = editor
         rolegroup_msg = await self.get_rolegroup_message(rolegroup=rolegroup)
         for e in control_emojis:
             await rolegroup_msg.add_reaction(e)
 
 
     async def stop_editing(self, rolegroup: Rolegroup, save_changes: bool):
+        state = self.states[rolegroup.guild_id]
         rolegroup_msg = await self.get_rolegroup_message(rolegroup=rolegroup)
         for e in control_emojis:
             await rolegroup_msg.remove_reaction(e, member=self.bot.user)
-        await self.clear_user_reactions()
-        actions = self.edit_save_actions if save_changes else self.edit_cancel_actions[::-1]
+        await self.clear_user_reactions(rolegroup.guild_id)
+        actions = state.edit_save_actions if save_changes else state.edit_cancel_actions[::-1]
         for action in actions:
             try:
                 await action
             except Exception as e:
                 logger.error(e)
 
-        self.edit_save_actions = []
-        self.edit_cancel_actions = []
-        self.editing_mod = None
+        state.edit_save_actions = []
+        state.edit_cancel_actions = []
+        state.editing_mod = None
 
         if save_changes:
-            await self.save_temp_rolegroups()
-        await self.clear_temp_rolegroups()
+            await self.save_temp_rolegroups(rolegroup.guild_id)
+        await self.clear_temp_rolegroups(rolegroup.guild_id)
         await self.update_rolegroup_message(await self.db.get_rolegroup(rolegroup_id=rolegroup.db_id))
         logger.info(f"Stopped editing. {'Saved' if save_changes else 'Discarded'} changes.")
 
 
+    def get_channel(self, guild_id: int) -> discord.TextChannel:
+        """
+        The rolegroups channel of a guild
+        """
+        return self.bot.get_guild(guild_id).get_channel(rolegroups_config.for_guild(guild_id).channel_id)
+
+
     async def get_rolegroup_message(self, rolegroup: Rolegroup) -> discord.Message:
-        channel = self.guild.get_channel(rolegroups_config.channel_id)
-        msg = await channel.fetch_message(rolegroup.message_id)
+        msg = await self.get_channel(rolegroup.guild_id).fetch_message(rolegroup.message_id)
         return msg
 
 
-    async def load_temp_rolegroups(self):
+    async def load_temp_rolegroups(self, guild_id: int):
         logger.debug(f"Loading temp rolegroups from db")
-        self.temp_rolegroups = {r.name: r for r in await self.db.get_all_rolegroups()}
+        self.states[guild_id].temp_rolegroups = {r.db_id: r for r in await self.db.get_all_rolegroups(guild_id)}
 
 
     async def update_temp_rolegroup(self, rolegroup: Rolegroup):
-        self.temp_rolegroups[rolegroup.name] = rolegroup
+        self.states[rolegroup.guild_id].temp_rolegroups[rolegroup.db_id] = rolegroup
         await self.update_rolegroup_message(rolegroup)
 
 
     def get_temp_rolegroup(self, rolegroup: Rolegroup) -> Rolegroup:
-        return self.temp_rolegroups.get(rolegroup.name)
+        return self.states[rolegroup.guild_id].temp_rolegroups.get(rolegroup.db_id)
 
 
-    async def save_temp_rolegroups(self):
+    async def save_temp_rolegroups(self, guild_id: int):
         logger.debug(f"Saving temp rolegroups to db")
-        for name, rg in self.temp_rolegroups.items():
+        for rg in self.states[guild_id].temp_rolegroups.values():
             await self.db.update_rolegroup(rg)
 
 
-    async def clear_temp_rolegroups(self):
-        self.temp_rolegroups = {}
+    async def clear_temp_rolegroups(self, guild_id: int):
+        self.states[guild_id].temp_rolegroups = {}
 
 
     @staticmethod
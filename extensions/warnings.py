@@ -7,23 +7,25 @@ from discord.ext import commands
 
 from Referee import can_kick
 from config.config import Warnings as warnings_config
-from db_classes.PGWarningDB import PGWarningDB
+from db_classes.storage import open_db
 from models.warnings_models import RefWarning
 from utils import emoji
+from utils.message_pipeline import MessageInfo
+from utils.scheduler import scheduler
 
 logger = logging.getLogger("Referee")
 
 punishments = {2: 4, 3: 24}
 
 
-def get_warned_color(color: tuple) -> tuple:
+def get_warned_color(color: tuple, default: tuple = warnings_config.default_warned_color) -> tuple:
     def is_grey(c):
         return max([abs(c[0] - c[1]), abs(c[1] - c[2]), abs(c[0] - c[2])]) < 25
 
 
     new_color = (color[0] // 2, color[1] // 2, color[2] // 2)
     if sum(new_color) / 3 < 100 and is_grey(new_color):
-        return warnings_config.default_warned_color
+        return default
     else:
         return new_color
 
@@ -32,46 +34,35 @@ class Warnings(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.db = PGWarningDB()
-        self.guild: discord.Guild = None  # initialized in on_ready
+        self.db = open_db("warnings")
+        self.bot.message_pipeline.subscribe(self.on_warn_message, guild_only=True,
+                                            predicate=lambda info: info.content.startswith("?warn "))
+        self.bot.startup.register("warnings", warm_up=self.warm_up)
 
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        self.bot.loop.create_task(self.bg_check())
-        self.guild = self.bot.guilds[0]
-
+    def cog_unload(self):
+        self.bot.message_pipeline.unsubscribe(self)
+        scheduler.cancel_owner(self)
 
-    async def bg_check(self):
-        """
-        Runs every 120 seconds to check whether warnings have expired
-        """
-        while not self.bot.is_ready():
-            await asyncio.sleep(1)
 
-        while not self.bot.is_closed():
-            await self.check_all_members()
-            await asyncio.sleep(120)  # task runs every second minute
+    async def warm_up(self):
+        # check whether warnings have expired every second minute
+        scheduler.every("warnings.check_expired", 120, self.check_all_members, jitter=5)
 
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
+    async def on_warn_message(self, info: MessageInfo):
         """
-        Called by api whenever a message is received.
-        Checks for warnings and clears
+        Called by the message pipeline for guild messages starting with ?warn
         """
-        if not message.guild:
-            return
-
-        if message.content.startswith("?warn "):
-            logger.info(f"Identified warn command: '{message.content}' from "
-                        f"{message.author.name}#{message.author.discriminator}")
-            if message.author.top_role >= discord.utils.find(lambda m: m.name == 'Support', self.guild.roles):
-                ctx = await self.bot.get_context(message)
-                member = await discord.ext.commands.MemberConverter().convert(ctx=ctx,
-                                                                              argument=message.content.split()[1])
-                reason = message.content.split(" ", 2)[2]
-                await self.warn(ctx=ctx, member=member, reason=reason)
+        message = info.message
+        logger.info(f"Identified warn command: '{message.content}' from "
+                    f"{message.author.name}#{message.author.discriminator}")
+        if message.author.top_role >= discord.utils.find(lambda m: m.name == 'Support', message.guild.roles):
+            ctx = await self.bot.get_context(message)
+            member = await discord.ext.commands.MemberConverter().convert(ctx=ctx,
+                                                                          argument=message.content.split()[1])
+            reason = message.content.split(" ", 2)[2]
+            await self.warn(ctx=ctx, member=member, reason=reason)
 
 
     @commands.Cog.listener()
@@ -97,7 +88,8 @@ class Warnings(commands.Cog):
         """
         Filters through a members roles to return only the ones related to warning
         """
-        warned_roles = list(filter(lambda r: r.name == warnings_config.warned_role_name, member.roles))
+        warned_role_name = warnings_config.for_guild(member.guild.id).warned_role_name
+        warned_roles = list(filter(lambda r: r.name == warned_role_name, member.roles))
         return warned_roles
 
 
@@ -117,11 +109,11 @@ class Warnings(commands.Cog):
 
         """
         await self.check_warnings(member)
-        num_warnings = len(await self.db.get_active_warnings(member.id))
+        num_warnings = len(await self.db.get_active_warnings(member.id, member.guild.id))
         if num_warnings in punishments.keys():
             await ctx.channel.send(
                 f"{member.display_name} has been warned {num_warnings}"
-                f" times in the last {warnings_config.warning_lifetime} hours. "
+                f" times in the last {warnings_config.for_guild(member.guild.id).warning_lifetime} hours. "
                 f"Automatically muting them for {punishments.get(num_warnings)} hours",
                 delete_after=30
             )
@@ -134,7 +126,7 @@ class Warnings(commands.Cog):
         """
         is_warned = bool(self.get_warned_roles(member))
 
-        active_warnings = await self.db.get_active_warnings(member.id)
+        active_warnings = await self.db.get_active_warnings(member.id, member.guild.id)
 
         if active_warnings:
             if not is_warned:
@@ -145,10 +137,16 @@ class Warnings(commands.Cog):
 
     async def check_all_members(self):
         """
-        Checks the warnings for all members in a guiöd
+        Checks the warnings for all members in all guilds
         """
-        for member in self.guild.members:
-            await self.check_warnings(member)
+        for guild in self.bot.guilds:
+            # with lazy member loading only some members are cached, the warned role is only
+            # given for warnings, so every member whose role may be out of date has a warning in the db
+            members = {m.id: m for m in guild.members}
+            warned_ids = list(await self.db.get_all_warnings(guild.id))
+            members.update(await self.bot.member_loader.get_members(guild, warned_ids))
+            for member in members.values():
+                await self.check_warnings(member)
 
 
     async def assign_warned_role(self, member: discord.Member):
@@ -161,14 +159,15 @@ class Warnings(commands.Cog):
         if self.get_warned_roles(member):
             return
 
-        warning_color = discord.Colour.from_rgb(*get_warned_color(member.colour.to_rgb()))
+        config = warnings_config.for_guild(member.guild.id)
+        warning_color = discord.Colour.from_rgb(*get_warned_color(member.colour.to_rgb(), config.default_warned_color))
         warned_roles = list(
-            filter(lambda r: r.name == warnings_config.warned_role_name and r.colour == warning_color,
-                   self.guild.roles))
+            filter(lambda r: r.name == config.warned_role_name and r.colour == warning_color,
+                   member.guild.roles))
 
         if not warned_roles:
-            role = await self.guild.create_role(name=warnings_config.warned_role_name,
-                                                colour=warning_color)
+            role = await member.guild.create_role(name=config.warned_role_name,
+                                                  colour=warning_color)
             await asyncio.sleep(0.5)
         else:
             role = warned_roles[0]
@@ -196,8 +195,7 @@ class Warnings(commands.Cog):
         if isinstance(muted_roles, list):
             muted_roles = muted_roles[0]
         await member.add_roles(muted_roles)
-        await asyncio.sleep(mute_time_seconds)
-        await member.remove_roles(*muted_roles)
+        scheduler.call_later(mute_time_seconds, member.remove_roles, muted_roles)
 
 
     async def warning_str(self, warning: RefWarning, show_expiration: bool = False,
@@ -233,7 +231,8 @@ class Warnings(commands.Cog):
             reason=reason,
             timestamp=datetime.now(),
             mod_name=f"{ctx.author.display_name}#{ctx.author.discriminator}",
-            expiration_time=datetime.now() + timedelta(hours=warnings_config.warning_lifetime))
+            expiration_time=datetime.now() + timedelta(hours=warnings_config.for_guild(ctx.guild.id).warning_lifetime),
+            guild_id=ctx.guild.id)
         await self.db.put_warning(warning)
         await self.enforce_punishments(ctx, member, warning)
         await self.acknowledge(ctx.message)
@@ -246,7 +245,7 @@ class Warnings(commands.Cog):
         Removes all active warnings from a member. The warnings persist in an expired state.
         :param member:
         """
-        await self.db.expire_warnings(member.id)
+        await self.db.expire_warnings(member.id, ctx.guild.id)
         await self.remove_warned_roles(member)
         await self.acknowledge(ctx.message)
 
@@ -262,8 +261,8 @@ class Warnings(commands.Cog):
             await ctx.send("Usage: `ref!warnings @member`", delete_after=30)
             return
 
-        all_warnings = await self.db.get_warnings(member.id)
-        active_warnings = await self.db.get_active_warnings(member.id)
+        all_warnings = await self.db.get_warnings(member.id, ctx.guild.id)
+        active_warnings = await self.db.get_active_warnings(member.id, ctx.guild.id)
         expired_warnings = list(filter(lambda x: x not in active_warnings, all_warnings))
 
         if all_warnings:
@@ -290,17 +289,18 @@ class Warnings(commands.Cog):
         """
         Lists all currently active warnings
         """
-        active_warnings = await self.db.get_all_active_warnings()
+        active_warnings = await self.db.get_all_active_warnings(ctx.guild.id)
 
         title = "Active warnings" if active_warnings else "No active warnings"
         embed = discord.Embed(title=title, color=discord.Color.dark_gold())
 
+        members = await self.bot.member_loader.get_members(ctx.guild, active_warnings)
         for member_id in active_warnings:
-            warnings = await self.db.get_active_warnings(member_id)
+            warnings = await self.db.get_active_warnings(member_id, ctx.guild.id)
             active_str = "\n".join(
                 [await self.warning_str(w, show_warned_name=True, show_expiration=True) for w in warnings])
             if active_str:
-                embed.add_field(name=ctx.guild.get_member(member_id), value=active_str, inline=False)
+                embed.add_field(name=members.get(member_id), value=active_str, inline=False)
 
         await ctx.send(embed=embed)
 
@@ -0,0 +1,275 @@
+"""
+Runs the bot in several worker processes that share its shards between them.
+Every worker is a normal Referee process connected to a contiguous range of shards, reading the same options.ini.
+
+    python3 launcher.py [--workers 2] [--shards 0]
+
+Workers are started one after another, so only one of them identifies with the gateway at a time.
+SIGTERM or Ctrl+C stops all workers, SIGHUP restarts them one after another, a worker that exits on its own
+is restarted with a growing delay. The metrics of all workers are served on the port of the Metrics section
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from config.config import Bot as bot_config, Launcher as launcher_config, Metrics as metrics_config
+from utils import metrics
+from utils.sharding import ShardAssignment, split_shards
+
+logger = logging.getLogger("Referee")
+
+MAX_RESTART_DELAY = 300
+# a worker that ran this long before it exited starts over with the shortest restart delay
+HEALTHY_UPTIME = 60
+
+
+def run_worker(assignment: ShardAssignment, conn):
+    """
+    Entry point of a worker process, runs the bot on the assigned shards and reports to the launcher when it is ready
+    """
+    # Referee creates the bot on import and reads its shards from the environment
+    os.environ.update(assignment.to_env())
+    import Referee
+
+    async def report_ready():
+        conn.send(("ready", len(Referee.bot.guilds)))
+
+    Referee.logger = Referee.setup_logger()
+    Referee.bot.add_listener(report_ready, "on_ready")
+    Referee.main()
+
+
+async def recommended_shard_count(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v8/gateway/bot",
+                               headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+class Worker:
+    """
+    One worker process and the shards it owns, restarted with the same shards
+    """
+
+    def __init__(self, assignment: ShardAssignment):
+        self.assignment = assignment
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn = None
+        self.ready = False
+        self.guilds = 0
+        self.restarts = 0
+        self.failures = 0
+        self.restart_at: Optional[float] = None
+        self.started_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, context):
+        conn, child_conn = context.Pipe(duplex=False)
+        self.process = context.Process(target=run_worker, args=(self.assignment, child_conn),
+                                       name=f"referee-worker-{self.assignment.worker}")
+        self.process.start()
+        child_conn.close()
+        self.conn = conn
+        self.ready = False
+        self.restart_at = None
+        self.started_at = time.monotonic()
+        logger.info(f"Started {self.assignment.name}, pid {self.process.pid}")
+
+    def poll(self):
+        """
+        Reads the messages the worker sent since the last poll
+        """
+        try:
+            while self.conn is not None and self.conn.poll():
+                kind, value = self.conn.recv()
+                if kind == "ready":
+                    self.ready = True
+                    self.guilds = value
+        except (EOFError, OSError):
+            self.conn = None
+
+    async def wait_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.poll()
+            if self.ready:
+                return True
+            if not self.alive:
+                return False
+            await asyncio.sleep(0.2)
+        return False
+
+    async def stop(self, timeout: float):
+        """
+        Asks the worker to disconnect, the bot closes itself on SIGTERM. Kills it if it takes longer than timeout
+        """
+        if self.alive:
+            self.process.terminate()
+            deadline = time.monotonic() + timeout
+            while self.process.is_alive() and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+            if self.process.is_alive():
+                logger.warning(f"Killing {self.assignment.name}, it didn't stop within {timeout:.0f}s")
+                self.process.kill()
+        if self.process is not None:
+            self.process.join()
+        self.ready = False
+
+
+class Launcher:
+
+    def __init__(self, workers: int, shard_count: int):
+        self.worker_count = workers
+        self.shard_count = shard_count
+        self.workers: List[Worker] = []
+        self.context = multiprocessing.get_context("spawn")
+        self.stopping: Optional[asyncio.Event] = None
+        self.restart_requested = False
+        # a registry of its own, the workers import this module as well
+        self.registry = metrics.MetricsRegistry("referee_launcher_")
+        self.registry.gauge("worker_up", "Whether the worker process is running", ["worker"],
+                            callback=lambda: [((str(w.assignment.worker),), int(w.alive)) for w in self.workers])
+        self.registry.gauge("worker_ready", "Whether the worker is connected to all its shards", ["worker"],
+                            callback=lambda: [((str(w.assignment.worker),), int(w.ready)) for w in self.workers])
+        self.registry.gauge("worker_shards", "Shards owned by the worker", ["worker"],
+                            callback=lambda: [((str(w.assignment.worker),), len(w.assignment.shard_ids))
+                                              for w in self.workers])
+        self.registry.gauge("worker_guilds", "Guilds the worker saw when it got ready", ["worker"],
+                            callback=lambda: [((str(w.assignment.worker),), w.guilds) for w in self.workers])
+        self.registry.counter("worker_restarts_total", "Restarts of the worker process", ["worker"],
+                              callback=lambda: [((str(w.assignment.worker),), w.restarts) for w in self.workers])
+
+    def request_stop(self):
+        logger.info("Stopping all workers")
+        self.stopping.set()
+
+    def request_restart(self):
+        logger.info("Restarting all workers one after another")
+        self.restart_requested = True
+
+    async def start_worker(self, worker: Worker):
+        worker.start(self.context)
+        if await worker.wait_ready(launcher_config.startup_timeout):
+            logger.info(f"{worker.assignment.name} is ready with {worker.guilds} guilds")
+        elif worker.alive:
+            logger.warning(f"{worker.assignment.name} not ready after {launcher_config.startup_timeout:.0f}s")
+
+    async def rolling_restart(self):
+        self.restart_requested = False
+        for worker in self.workers:
+            if self.stopping.is_set():
+                return
+            await worker.stop(launcher_config.stop_timeout)
+            worker.restarts += 1
+            await self.start_worker(worker)
+
+    async def supervise(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            worker.poll()
+            if worker.alive or self.stopping.is_set():
+                continue
+            if worker.restart_at is None:
+                if now - worker.started_at >= HEALTHY_UPTIME:
+                    worker.failures = 0
+                delay = min(launcher_config.restart_delay * 2 ** worker.failures, MAX_RESTART_DELAY)
+                worker.failures += 1
+                worker.restart_at = now + delay
+                logger.error(f"{worker.assignment.name} exited with {worker.process.exitcode}, "
+                             f"restarting in {delay:.0f}s")
+            elif now >= worker.restart_at:
+                worker.process.join()
+                worker.restarts += 1
+                await self.start_worker(worker)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        async def scrape(session: aiohttp.ClientSession, worker: Worker):
+            try:
+                async with session.get(f"http://127.0.0.1:{worker.assignment.metrics_port}/metrics") as response:
+                    return str(worker.assignment.worker), await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return str(worker.assignment.worker), ""
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            texts = dict(await asyncio.gather(*(scrape(session, w) for w in self.workers if w.alive)))
+        body = self.registry.render() + metrics.merge_expositions(texts, "worker")
+        return web.Response(body=body.encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start_metrics_server(self) -> Optional[web.AppRunner]:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, metrics_config.host, metrics_config.port).start()
+        except OSError as e:
+            logger.error(f"Could not start metrics server on {metrics_config.host}:{metrics_config.port}: {e}")
+            await runner.cleanup()
+            return None
+        return runner
+
+    async def run(self):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGINT, self.request_stop)
+        loop.add_signal_handler(signal.SIGTERM, self.request_stop)
+        loop.add_signal_handler(signal.SIGHUP, self.request_restart)
+
+        shard_count = self.shard_count or await recommended_shard_count(bot_config.token)
+        self.workers = [Worker(ShardAssignment(worker=i, shard_ids=shard_ids, shard_count=shard_count,
+                                               metrics_port=metrics_config.port + 1 + i))
+                        for i, shard_ids in enumerate(split_shards(shard_count, self.worker_count))]
+        logger.info(f"Running {shard_count} shards in {len(self.workers)} workers")
+        runner = await self.start_metrics_server() if metrics_config.enabled else None
+
+        try:
+            for worker in self.workers:
+                if self.stopping.is_set():
+                    break
+                await self.start_worker(worker)
+
+            while not self.stopping.is_set():
+                if self.restart_requested:
+                    await self.rolling_restart()
+                await self.supervise()
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await asyncio.gather(*(w.stop(launcher_config.stop_timeout) for w in self.workers))
+            if runner is not None:
+                await runner.cleanup()
+        logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=launcher_config.workers, help="Worker processes")
+    parser.add_argument("--shards", type=int, default=launcher_config.shard_count,
+                        help="Total number of shards, 0 for the number Discord recommends")
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s launcher: %(message)s", datefmt="[%d/%m/%Y %H:%M]"))
+    logger.addHandler(handler)
+    logger.setLevel(bot_config.logging_level)
+
+    asyncio.run(Launcher(workers=args.workers, shard_count=args.shards).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,20 @@
 from __future__ import annotations
 from datetime import datetime
-from typing import List
-
-
-class ModMail:
-
-    def __init__(self, author_id: int, author_name: str, timestamp: datetime, content: str,
-                 answers: List[ModMailAnswer] = None, modmail_id: int = None, message_id: int = None):
-        self.author_id = author_id
-        self.author_name = author_name
-        self.timestamp = timestamp
-        self.content = content
-        self.answers = answers
-        self.modmail_id = modmail_id
-        self.message_id = message_id
-
-    def __eq__(self, other):
-        if not isinstance(other, type(self)):
-            return False
-        return self.__dict__ == other.__dict__
-
-    def __ne__(self, other):
-        return not self == other
-
-    def __hash__(self):
-        return hash((self.author_id, self.timestamp, self.content, self.answers, self.modmail_id))
-
-    def __str__(self):
-        return str(self.__dict__)
+from typing import NamedTuple, Optional, Tuple
+
+
+class ModMail(NamedTuple):
+    """
+    A mail to the mods, immutable. Its answers are added with ``mail._replace(answers=...)`` once loaded
+    """
+    author_id: int
+    author_name: str
+    timestamp: datetime
+    content: str
+    answers: Tuple[ModMailAnswer, ...] = ()
+    modmail_id: Optional[int] = None
+    message_id: Optional[int] = None
+    guild_id: Optional[int] = None
 
     @property
     def timestamp_str(self):
@@ -38,28 +25,15 @@ class ModMail:
         return self.timestamp.strftime("%b-%d-%Y")
 
 
-class ModMailAnswer:
-
-    def __init__(self, mod_id: str, mod_name: str, timestamp: datetime, content: str, modmail: ModMail):
-        self.mod_id = mod_id
-        self.mod_name = mod_name
-        self.timestamp = timestamp
-        self.content = content
-        self.modmail = modmail
-
-    def __eq__(self, other):
-        if not isinstance(other, type(self)):
-            return False
-        return self.__dict__ == other.__dict__
-
-    def __ne__(self, other):
-        return not self == other
-
-    def __hash__(self):
-        return hash((self.mod_id, self.timestamp, self.content))
-
-    def __str__(self):
-        return str(self.__dict__)
+class ModMailAnswer(NamedTuple):
+    """
+    An answer of a mod to a mail, immutable. ``modmail`` is the mail without its answers
+    """
+    mod_id: int
+    mod_name: str
+    timestamp: datetime
+    content: str
+    modmail: Optional[ModMail]
 
     @property
     def timestamp_str(self):
@@ -1,42 +1,56 @@
-from typing import Dict
+from typing import Dict, NamedTuple, Optional, Tuple
 
-class Rolegroup:
 
-    def __init__(self, name: str, message_id: int = None, db_id: int = None):
-        self.name: str = name
-        self.message_id: int = message_id
-        self.db_id: int = db_id
-        self.roles: Dict[str: int] = dict()
+class Rolegroup(NamedTuple):
+    """
+    A rolegroup, immutable. ``roles`` holds (emoji, role id) pairs in the order they were added,
+    :meth:`with_role` and :meth:`without_role` return a changed copy
+    """
+    name: str
+    message_id: Optional[int] = None
+    db_id: Optional[int] = None
+    guild_id: Optional[int] = None
+    roles: Tuple[Tuple[str, int], ...] = ()
 
     @property
-    def emojis_by_role(self):
-        return {v: k for k, v in self.roles.items()}
+    def emojis_by_role(self) -> Dict[int, str]:
+        return {role_id: emoji for emoji, role_id in self.roles}
 
-    def add_role(self, role_id: int, emoji: str):
-        self.roles[emoji] = role_id
-
-    def del_role(self, role_id: int = None, emoji: str = None):
-        if emoji:
-            self.roles.pop(emoji)
-        elif role_id:
-            self.roles.pop(self.emojis_by_role.get(role_id))
-
-    def get_role(self, emoji: str):
-        return self.roles.get(emoji)
-
-    def get_emoji(self, role_id: int):
-        return self.emojis_by_role.get(role_id, None)
-
-    def __eq__(self, other):
-        if not isinstance(other, type(self)):
-            return False
-        return self.__dict__ == other.__dict__
-
-    def __ne__(self, other):
-        return not self == other
-
-    def __hash__(self):
-        return hash((self.name, self.message_id))
+    @property
+    def emojis(self) -> Tuple[str, ...]:
+        return tuple(emoji for emoji, _ in self.roles)
 
-    def __str__(self):
-        return str(self.__dict__)
+    @property
+    def role_ids(self) -> Tuple[int, ...]:
+        return tuple(role_id for _, role_id in self.roles)
+
+    def with_role(self, role_id: int, emoji: str) -> "Rolegroup":
+        """
+        A copy with the role added, replacing the role the emoji stood for before
+        """
+        if emoji not in self.emojis:
+            return self._replace(roles=self.roles + ((emoji, role_id),))
+        return self._replace(roles=tuple((e, role_id if e == emoji else r) for e, r in self.roles))
+
+    def without_role(self, role_id: int = None, emoji: str = None) -> "Rolegroup":
+        """
+        A copy without the role of the emoji, or the role with the id
+        :raises KeyError: If the rolegroup doesn't have the role
+        """
+        if not emoji:
+            emoji = self.get_emoji(role_id)
+        if emoji is None or emoji not in self.emojis:
+            raise KeyError(emoji if emoji is not None else role_id)
+        return self._replace(roles=tuple((e, r) for e, r in self.roles if e != emoji))
+
+    def get_role(self, emoji: str) -> Optional[int]:
+        for e, role_id in self.roles:
+            if e == emoji:
+                return role_id
+        return None
+
+    def get_emoji(self, role_id: int) -> Optional[str]:
+        for emoji, r in self.roles:
+            if r == role_id:
+                return emoji
+        return None
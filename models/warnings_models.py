@@ -1,31 +1,22 @@
 from __future__ import annotations
 from datetime import datetime
+from typing import NamedTuple, Optional
 
+NEVER = datetime(9999, 1, 1)
 
-class RefWarning:
-    NEVER = datetime(9999, 1, 1)
 
-    def __init__(self, user_id: int, timestamp: datetime, mod_name: str, reason: str = "",
-                 expiration_time: datetime = NEVER):
-        self.user_id = user_id
-        self.timestamp = timestamp
-        self.mod_name = mod_name
-        self.reason = reason
-        self.expiration_time = expiration_time
+class RefWarning(NamedTuple):
+    """
+    A warning, immutable. Decodes from rows selected in field order with ``RefWarning._make(record)``
+    """
+    NEVER = NEVER
 
-    def __eq__(self, other):
-        if not isinstance(other, type(self)):
-            return False
-        return self.__dict__ == other.__dict__
-
-    def __ne__(self, other):
-        return not self == other
-
-    def __hash__(self):
-        return hash((self.user_id, self.timestamp, self.reason, self.expiration_time))
-
-    def __repr__(self):
-        return str(self.__dict__)
+    user_id: int
+    timestamp: datetime
+    mod_name: str
+    reason: str = ""
+    expiration_time: datetime = NEVER
+    guild_id: Optional[int] = None
 
     @property
     def timestamp_str(self):
@@ -0,0 +1,77 @@
+"""
+Tasks for the process pool that work on user input and could take arbitrarily long:
+calculations, user supplied regexes and nested base64. Workers import this module, it must not import discord
+"""
+import re
+import string
+from base64 import b64decode
+from typing import Dict, List, Tuple
+
+b64_pattern = re.compile(r"[a-zA-Z0-9+/]+={0,2}")
+
+printable = set(string.printable)
+
+
+def calculate(calc: str) -> str:
+    """
+    Evaluates a calculation already checked to contain only digits and operators.
+    Errors besides a SyntaxError are answered with their name, a MemoryError gets the worker replaced
+    """
+    try:
+        result = eval(calc)
+    except (SyntaxError, MemoryError):
+        raise
+    except Exception as e:
+        return e.__class__.__name__
+    answer = f"`{calc}` = **{result}**"
+    if len(answer) >= 2000:
+        answer = str(result)
+    return answer
+
+
+def search_patterns(patterns: List[str], text: str) -> List[int]:
+    """
+    :return: Indices of the patterns found in the text
+    """
+    return [i for i, pattern in enumerate(patterns) if re.search(pattern, text)]
+
+
+def fullmatch_names(pattern: str, names: List[str]) -> List[int]:
+    """
+    :return: Indices of the names the pattern matches entirely
+    """
+    regex = re.compile(pattern)
+    return [i for i, name in enumerate(names) if regex.fullmatch(name)]
+
+
+def decode_b64_strings(text: str) -> Dict[str, str]:
+    """
+    :return: Every base64 string in the text that decodes to printable text -> the decoded text
+    """
+    solved = {}
+    for code in b64_pattern.findall(text):
+        if len(code) % 4:
+            continue
+        try:
+            dec = b64decode(code).decode()
+        except ValueError:
+            continue
+        if set(dec) <= printable:
+            solved[code] = dec
+    return solved
+
+
+def decode_nested_b64(texts: List[str]) -> Dict[str, Tuple[str, int]]:
+    """
+    Decodes the base64 strings in the texts for as long as the result is base64 again
+    :return: The base64 strings found -> (innermost decoded text, times it was encoded)
+    """
+    found = {}
+    for text in texts:
+        for code, decoded in decode_b64_strings(text).items():
+            levels = 1
+            while (inner := decode_b64_strings(decoded).get(decoded)) is not None:
+                decoded = inner
+                levels += 1
+            found[code] = (decoded, levels)
+    return found
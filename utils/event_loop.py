@@ -0,0 +1,18 @@
+import asyncio
+
+
+def install_uvloop() -> bool:
+    """
+    Makes new event loops uvloop loops. discord.py gets its loop when the bot is created, so this has to run before
+    :return: Whether uvloop is used, False if it isn't installed
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def loop_name(loop: asyncio.AbstractEventLoop) -> str:
+    return f"{type(loop).__module__}.{type(loop).__qualname__}"
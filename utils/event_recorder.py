@@ -0,0 +1,210 @@
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+recorded_events = metrics.registry.counter("recorder_events_total", "Gateway events handled by the recorder",
+                                           ["result"])
+
+# (seconds since the first event, gateway event name, payload), the event format of benchmarks.harness
+Event = Tuple[float, str, dict]
+
+_mention = re.compile(r"<@(!?)(\d+)>")
+_word = re.compile(r"[^\W\d_]+")
+
+
+class Anonymiser:
+    """
+    Replaces user ids, names and message contents in gateway payloads.
+    The same user always gets the same made up id, so the traffic keeps its shape: who talks, reacts and joins how often.
+    Guild, channel, role and message ids are kept, the bots config and db refer to them
+    """
+
+    def __init__(self, salt: str, keep_words: Iterable[str] = ()):
+        self.salt = salt.encode()
+        self.keep_words = frozenset(w.lower() for w in keep_words)
+
+    def user_id(self, user_id) -> str:
+        digest = hashlib.blake2b(str(user_id).encode(), key=self.salt, digest_size=8).digest()
+        return str(int.from_bytes(digest, "big") >> 2)
+
+    def user(self, user: dict) -> dict:
+        user_id = self.user_id(user["id"])
+        return {"id": user_id, "username": f"user{user_id[-5:]}", "discriminator": user_id[-4:], "avatar": None,
+                "bot": user.get("bot", False)}
+
+    def content(self, content: str) -> str:
+        """
+        Masks every word that is not one of ``keep_words``, keeping mentions, punctuation and word lengths
+        """
+        content = _mention.sub(lambda m: f"<@{m.group(1)}{self.user_id(m.group(2))}>", content)
+        return _word.sub(lambda m: m.group() if m.group().lower() in self.keep_words else "x" * len(m.group()),
+                         content)
+
+    def payload(self, data):
+        if isinstance(data, list):
+            return [self.payload(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        result = {}
+        for key, value in data.items():
+            if key in ("author", "user") and isinstance(value, dict) and "id" in value:
+                result[key] = self.user(value)
+            elif key == "user_id" and value is not None:
+                result[key] = self.user_id(value)
+            elif key == "mentions" and isinstance(value, list):
+                result[key] = [dict(self.payload(m), **self.user(m)) for m in value]
+            elif key == "content" and isinstance(value, str):
+                result[key] = self.content(value)
+            elif key in ("nick", "avatar", "email"):
+                result[key] = None
+            elif key in ("embeds", "attachments", "stickers"):
+                result[key] = []
+            else:
+                result[key] = self.payload(value)
+        return result
+
+
+class EventRecorder:
+    """
+    Appends gateway events to gzipped JSON lines files, one ``[unix time, event name, payload]`` array per line.
+    :meth:`record` only checks the event name and enqueues the payload, encoding, anonymising
+    and writing happen in a background thread. A full queue drops events instead of slowing down the bot.
+    A new file is started when the current one holds ``max_bytes`` of JSON, only the newest ``keep`` files are kept
+    """
+
+    def __init__(self, path: str, events: Iterable[str], anonymiser: Optional[Anonymiser] = None,
+                 max_bytes: int = 50_000_000, keep: int = 20, flush_interval: float = 1.0, max_queue: int = 100_000):
+        self.path = path
+        self.events = frozenset(events)
+        self.anonymiser = anonymiser
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.written = 0
+        self._file = None
+        self._file_bytes = 0
+        self._files = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, msg: dict):
+        """
+        Called with every message received from the gateway
+        """
+        if msg.get("t") not in self.events:
+            return
+        try:
+            self.queue.put_nowait((time.time(), msg["t"], msg["d"]))
+        except queue.Full:
+            self.dropped += 1
+            recorded_events.inc("dropped")
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="event-recorder", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info("Recording %s to %s", ", ".join(sorted(self.events)), self.path)
+
+    def stop(self):
+        """
+        Writes the queued events and closes the current file
+        """
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        self._files += 1
+        name = os.path.join(self.path,
+                            f"events-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._files:04}.jsonl.gz")
+        self._file = gzip.open(name, "at", encoding="utf-8")
+        self._file_bytes = 0
+        for old in recordings(self.path)[:-self.keep]:
+            os.remove(old)
+
+    def _run(self):
+        self._open()
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._write(*item)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.close()
+        self._file = None
+
+    def _write(self, timestamp: float, event: str, payload: dict):
+        try:
+            if self.anonymiser is not None:
+                payload = self.anonymiser.payload(payload)
+            line = json.dumps([round(timestamp, 3), event, payload], separators=(",", ":"), ensure_ascii=False)
+        except (RuntimeError, TypeError, ValueError):
+            # discord.py parses the payload on the loop thread while it is encoded here
+            self.dropped += 1
+            recorded_events.inc("dropped")
+            return
+        self._file.write(line)
+        self._file.write("\n")
+        self.written += 1
+        recorded_events.inc("written")
+        self._file_bytes += len(line) + 1
+        if self._file_bytes >= self.max_bytes:
+            self._open()
+
+
+def recordings(path: str) -> list:
+    """
+    The recording files in ``path``, oldest first
+    """
+    return sorted(glob.glob(os.path.join(path, "events-*.jsonl.gz")))
+
+
+def read_recording(paths: Sequence[str], events: Iterable[str] = None) -> Iterator[Event]:
+    """
+    Reads recorded events in order, with their time relative to the first one
+    :param paths: Recording files or directories of them
+    :param events: Only yield these event names
+    """
+    files = []
+    for path in paths:
+        files.extend(recordings(path) if os.path.isdir(path) else [path])
+    wanted = frozenset(events) if events else None
+    start = None
+    for file in files:
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    timestamp, event, payload = json.loads(line)
+                except ValueError:
+                    # the last line of a file that wasn't closed properly
+                    continue
+                if wanted is not None and event not in wanted:
+                    continue
+                if start is None:
+                    start = timestamp
+                yield timestamp - start, event, payload
@@ -0,0 +1,55 @@
+import weakref
+from typing import Callable, Dict, Generic, Iterator, Tuple, TypeVar
+
+from utils import metrics
+
+T = TypeVar("T")
+
+_all_states: "weakref.WeakSet[GuildStates]" = weakref.WeakSet()
+
+
+class GuildStates(Generic[T]):
+    """
+    The state a cog keeps for every guild the bot is in: caches, limiters, editing sessions.
+    States are created by ``factory(guild_id)`` on first use, so a guild costs nothing until it is active,
+    and are dropped when the bot leaves the guild
+    """
+
+    def __init__(self, name: str, factory: Callable[[int], T]):
+        self.name = name
+        self.factory = factory
+        self.states: Dict[int, T] = {}
+        _all_states.add(self)
+
+    def __getitem__(self, guild_id: int) -> T:
+        state = self.states.get(guild_id)
+        if state is None:
+            state = self.states[guild_id] = self.factory(guild_id)
+        return state
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.states
+
+    def __len__(self):
+        return len(self.states)
+
+    def items(self) -> Iterator[Tuple[int, T]]:
+        return iter(list(self.states.items()))
+
+    def forget(self, guild_id: int):
+        self.states.pop(guild_id, None)
+
+    def clear(self):
+        self.states.clear()
+
+
+def forget_guild(guild_id: int):
+    """
+    Drops the state of a guild from every cog, called when the bot leaves it
+    """
+    for states in list(_all_states):
+        states.forget(guild_id)
+
+
+metrics.registry.gauge("guild_states", "Guilds with state per cog", ["cog"],
+                       callback=lambda: [((s.name,), len(s)) for s in list(_all_states)])
@@ -0,0 +1,78 @@
+import sys
+import time
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+from typing import List, Tuple
+
+_timed_loaders = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+
+class ImportProfiler:
+    """
+    Meta path finder that records how long every module takes to import, like ``python -X importtime``.
+    Has to be installed before the imports it should measure
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.installed = False
+        # (name, self time, cumulative time, depth) in the order the imports finished
+        self.records: List[Tuple[str, float, float, int]] = []
+        self._stack = []
+
+    def install(self):
+        if not self.installed:
+            sys.meta_path.insert(0, self)
+            self.installed = True
+
+    def uninstall(self):
+        if self.installed:
+            sys.meta_path.remove(self)
+            self.installed = False
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        # only file based loaders are per module instances that can be wrapped, builtins are fast anyway
+        if isinstance(spec.loader, _timed_loaders):
+            spec.loader.exec_module = self._timed(fullname, spec.loader.exec_module)
+        return spec
+
+    def _timed(self, fullname, exec_module):
+        def timed_exec_module(module):
+            self._stack.append([fullname, 0.0])
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                cumulative = time.perf_counter() - start
+                _, children = self._stack.pop()
+                if self._stack:
+                    self._stack[-1][1] += cumulative
+                self.records.append((fullname, cumulative - children, cumulative, len(self._stack)))
+
+        return timed_exec_module
+
+    def slowest(self, n: int = 15) -> List[Tuple[str, float, float, int]]:
+        """
+        The top level imports that took longest, including their own imports
+        """
+        return sorted((r for r in self.records if r[3] == 0), key=lambda r: r[2], reverse=True)[:n]
+
+    def report(self) -> str:
+        """
+        Full report in the format of ``-X importtime``
+        """
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for name, self_time, cumulative, depth in self.records:
+            lines.append(f"import time: {int(self_time * 1e6):>9} | {int(cumulative * 1e6):>10} | {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+
+import_profiler = ImportProfiler()
@@ -0,0 +1,52 @@
+import logging
+from typing import Dict, FrozenSet, Iterable
+
+import discord
+
+logger = logging.getLogger("Referee")
+
+# messages and reactions in guilds and DMs, for commands, the pipeline and the reaction waiters.
+# emojis keeps guild.emojis up to date for autoreactions and rolegroups
+CORE_INTENTS = frozenset({"guilds", "guild_messages", "dm_messages", "guild_reactions", "dm_reactions", "emojis"})
+
+# Intents an extension needs beyond the core ones. members is privileged: it sends member joins
+# and allows requesting the member list, which every extension looking members up by id relies on
+EXTENSION_INTENTS: Dict[str, FrozenSet[str]] = {
+    "autoreactions": frozenset(),
+    "bouncer": frozenset({"members"}),
+    "christmas_competition": frozenset({"members"}),
+    "emojisurvey": frozenset(),
+    "misc": frozenset({"members"}),
+    "modmail": frozenset({"members"}),
+    "ranks": frozenset({"members"}),
+    "reputation": frozenset({"members"}),
+    "rolegroups": frozenset({"members"}),
+    "warnings": frozenset({"members"}),
+}
+
+
+def required_intents(extensions: Iterable[str], extra: Iterable[str] = ()) -> discord.Intents:
+    """
+    The gateway intents the extensions need, so Discord doesn't send events nobody reads.
+    Extensions missing from :data:`EXTENSION_INTENTS` get the default intents and members
+    :param extra: Names of intents to enable in addition
+    """
+    names = set(CORE_INTENTS) | set(extra)
+    for ext in extensions:
+        needed = EXTENSION_INTENTS.get(ext)
+        if needed is None:
+            logger.warning(f"No intents known for extension {ext}, enabling the default intents and members")
+            names.update(name for name, enabled in discord.Intents.default() if enabled)
+            names.add("members")
+        else:
+            names.update(needed)
+    intents = discord.Intents.none()
+    for name in names:
+        if name not in discord.Intents.VALID_FLAGS:
+            raise ValueError(f"Unknown intent: {name}")
+        setattr(intents, name, True)
+    return intents
+
+
+def describe(intents: discord.Intents) -> str:
+    return " ".join(sorted(name for name, enabled in intents if enabled))
@@ -0,0 +1,62 @@
+import atexit
+import copy
+import itertools
+import logging
+import logging.handlers
+import queue
+from typing import List
+
+
+class DebugSampler(logging.Filter):
+    """
+    Lets through only every ``rate``-th debug record, records of higher levels always pass
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate == 1:
+            return True
+        return next(self._counter) % self.rate == 0
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Only merges the arguments into the message, the stdlib version also runs the formatter in the calling thread
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # the arguments may change after the call, so they have to be resolved here
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class QueueLogging:
+    """
+    Moves formatting and writing of log records to a background thread.
+    The logger only gets a :class:`logging.handlers.QueueHandler`, which never blocks on I/O
+    """
+
+    def __init__(self, logger: logging.Logger, handlers: List[logging.Handler]):
+        self.logger = logger
+        self.queue = queue.SimpleQueue()
+        self.handler = _QueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    def start(self):
+        """
+        Attaches the queue handler and starts the writer thread, which is flushed and stopped at exit
+        """
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.logger.removeHandler(self.handler)
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import Counter as _Counter, deque
+from typing import Deque, List, Optional, Tuple
+
+from config.config import LoopMonitor as loop_config
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+loop_lag = metrics.registry.histogram("loop_lag_seconds", "Delay of the event loop waking up a sleeping task",
+                                      buckets=LAG_BUCKETS)
+slow_callbacks = metrics.registry.counter("slow_callbacks_total", "Callbacks that held the event loop too long",
+                                          ["callback"])
+slow_callback_seconds = metrics.registry.counter("slow_callback_seconds_total",
+                                                 "Time the event loop was held by slow callbacks", ["callback"])
+
+
+def describe_handle(handle: asyncio.Handle) -> str:
+    """
+    Names the code a loop callback ran. For task steps this is the name of the task if it was given one,
+    otherwise the coroutine chain the task is suspended in
+    :param handle: The :class:`asyncio.Handle` that was run
+    """
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if not isinstance(task, asyncio.Task):
+        return getattr(callback, "__qualname__", repr(callback))
+
+    if not task.get_name().startswith("Task-"):
+        # named by RefereeBot._schedule_event after the listener it runs
+        return task.get_name()
+
+    coro = task.get_coro()
+    # innermost coroutine the task is suspended in, the slow code ran somewhere along this chain
+    chain = [coro.__qualname__]
+    awaited = getattr(coro, "cr_await", None)
+    while awaited is not None and hasattr(awaited, "cr_await") and len(chain) < 4:
+        chain.append(awaited.__qualname__)
+        awaited = awaited.cr_await
+    return " > ".join(chain)
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping for a fixed interval
+    and logs callbacks that block the loop for longer than ``slow_threshold`` seconds
+    """
+
+    def __init__(self, interval: float = 0.5, slow_threshold: float = 0.1, history: int = 1200):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lag: metrics.Samples = metrics.Samples(history)
+        self.slow: Deque[Tuple[float, str, float]] = deque(maxlen=50)
+        self.slow_totals: _Counter = _Counter()
+        self._task: Optional[asyncio.Task] = None
+        self._original_run = None
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Starts sampling the lag and installs the slow callback detector
+        """
+        loop = loop or asyncio.get_event_loop()
+        if self._task is None:
+            self._task = loop.create_task(self._sample())
+        if self.slow_threshold > 0:
+            self.install_detector()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.uninstall_detector()
+
+    async def _sample(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.lag.add(lag)
+            loop_lag.observe(lag)
+
+    def install_detector(self):
+        """
+        Wraps :meth:`asyncio.Handle._run`, which runs every callback and task step of the loop.
+        Only works with the default asyncio loop, uvloop runs its handles in C
+        """
+        if self._original_run is not None:
+            return
+        original_run = self._original_run = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle: asyncio.Handle):
+            start = time.perf_counter()
+            original_run(handle)
+            duration = time.perf_counter() - start
+            if duration >= monitor.slow_threshold:
+                monitor.record_slow(handle, duration)
+
+        asyncio.events.Handle._run = _run
+
+    def uninstall_detector(self):
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    def record_slow(self, handle: asyncio.Handle, duration: float):
+        try:
+            name = describe_handle(handle)
+        except Exception:
+            name = repr(handle)
+        self.slow.append((time.time(), name, duration))
+        self.slow_totals[name] += 1
+        slow_callbacks.inc(name)
+        slow_callback_seconds.inc(name, amount=duration)
+        logger.warning("Event loop blocked for %.0fms by %s", duration * 1000, name)
+
+    def lag_percentiles(self) -> dict:
+        return {
+            "p50": self.lag.percentile(50),
+            "p99": self.lag.percentile(99),
+            "max": max(self.lag, default=0.0),
+            "samples": len(self.lag)
+        }
+
+    def slowest_callbacks(self, n: int = 5) -> List[Tuple[str, float, int]]:
+        """
+        The callbacks with the longest recent blocking durations
+        :return: name, longest recent duration and number of times it was slow since startup
+        """
+        longest = {}
+        for _, name, duration in self.slow:
+            longest[name] = max(longest.get(name, 0.0), duration)
+        ranked = sorted(longest.items(), key=lambda x: x[1], reverse=True)[:n]
+        return [(name, duration, self.slow_totals[name]) for name, duration in ranked]
+
+
+loop_monitor = LoopMonitor(interval=loop_config.interval, slow_threshold=loop_config.slow_threshold)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+import discord
+
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+chunk_duration = metrics.registry.histogram("member_chunk_seconds", "Time to load all members of a guild",
+                                            buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+member_queries = metrics.registry.counter("member_queries_total", "Members requested from the gateway by id")
+
+# most user ids the gateway accepts in one member request
+QUERY_BATCH = 100
+
+
+class MemberLoader:
+    """
+    Loads the members of a guild when they are needed, with MemberLoading = lazy.
+    Code that needs every member of a guild awaits :meth:`ensure`, code looking up a few members by id
+    uses :meth:`get_member` and :meth:`get_members`, which request just those. When members are loaded
+    at startup, or the bot has no members intent, these only look at the cache
+    """
+
+    def __init__(self, intents: discord.Intents, lazy: bool):
+        self.lazy = lazy and intents.members
+        self._chunking: Dict[int, asyncio.Future] = {}
+
+    def _needs_loading(self, guild: discord.Guild) -> bool:
+        return self.lazy and not guild.chunked
+
+    async def ensure(self, guild: discord.Guild):
+        """
+        Loads all members of the guild unless that happened before. Concurrent calls share one request
+        """
+        if not self._needs_loading(guild):
+            return
+        task = self._chunking.get(guild.id)
+        if task is None:
+            task = self._chunking[guild.id] = asyncio.ensure_future(self._chunk(guild))
+            task.add_done_callback(lambda _: self._chunking.pop(guild.id, None))
+        # one caller being cancelled must not cancel the request for the others
+        await asyncio.shield(task)
+
+    async def _chunk(self, guild: discord.Guild):
+        start = time.perf_counter()
+        await guild.chunk(cache=True)
+        elapsed = time.perf_counter() - start
+        chunk_duration.observe(elapsed)
+        logger.info(f"Loaded {len(guild.members)} members of {guild} in {elapsed:.2f}s")
+
+    async def get_member(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        """
+        Like ``guild.get_member``, but requests the member if it isn't cached yet
+        """
+        member = guild.get_member(user_id)
+        if member is not None or not self._needs_loading(guild):
+            return member
+        return (await self.get_members(guild, [user_id])).get(user_id)
+
+    async def get_members(self, guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, discord.Member]:
+        """
+        The members of the guild among ``user_ids``, those that aren't cached are requested in batches
+        :return: User id -> member, users that aren't members of the guild are left out
+        """
+        found = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id)
+            if member is not None:
+                found[user_id] = member
+            else:
+                missing.append(user_id)
+        if not missing or not self._needs_loading(guild):
+            return found
+        member_queries.inc(amount=len(missing))
+        for i in range(0, len(missing), QUERY_BATCH):
+            try:
+                members = await guild.query_members(user_ids=missing[i:i + QUERY_BATCH], limit=QUERY_BATCH, cache=True)
+            except asyncio.TimeoutError:
+                logger.warning(f"Requesting {len(missing[i:i + QUERY_BATCH])} members of {guild} timed out")
+                continue
+            found.update((m.id, m) for m in members)
+        return found
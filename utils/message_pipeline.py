@@ -0,0 +1,141 @@
+import logging
+import re
+from functools import cached_property
+from typing import Callable, Collection, FrozenSet, List, Optional, Sequence
+
+import discord
+
+logger = logging.getLogger("Referee")
+
+_non_word = re.compile(r"\W+")
+
+
+class MessageInfo:
+    """
+    A message with the parts most handlers look at, computed once per message and only when first used
+    """
+
+    def __init__(self, message: discord.Message, command_prefixes: Sequence[str] = ()):
+        self.message = message
+        self.content: str = message.content
+        self.command_prefixes = command_prefixes
+
+    @cached_property
+    def lower(self) -> str:
+        return self.content.lower()
+
+    @cached_property
+    def words(self) -> List[str]:
+        """
+        The lowercased content split on whitespace
+        """
+        return self.lower.split()
+
+    @cached_property
+    def tokens(self) -> List[str]:
+        """
+        The lowercased content split on everything that is not a word character
+        """
+        return _non_word.split(self.lower)
+
+    @cached_property
+    def unquoted(self) -> str:
+        """
+        The lowercased content without quoted lines
+        """
+        return "\n".join(line for line in self.lower.split("\n") if not line.startswith("> "))
+
+    @cached_property
+    def mention_ids(self) -> FrozenSet[int]:
+        return frozenset(m.id for m in self.message.mentions)
+
+    @cached_property
+    def is_command(self) -> bool:
+        """
+        Whether the message starts with one of the bots command prefixes
+        """
+        return self.content.startswith(tuple(self.command_prefixes))
+
+    @property
+    def is_dm(self) -> bool:
+        return self.message.guild is None
+
+
+class Subscription:
+    """
+    A message handler and the conditions a message has to meet to be passed to it.
+    The conditions are checked in order of cost, a message that fails one is not looked at any further
+    """
+
+    def __init__(self, handler: Callable, guild_only: bool = False, dm_only: bool = False,
+                 ignore_bots: bool = False, ignore_commands: bool = False,
+                 channels: Optional[Collection[int]] = None, contains: Sequence[str] = (),
+                 predicate: Callable[[MessageInfo], bool] = None):
+        self.handler = handler
+        self.guild_only = guild_only
+        self.dm_only = dm_only
+        self.ignore_bots = ignore_bots
+        self.ignore_commands = ignore_commands
+        self.channels = channels
+        self.contains = tuple(contains)
+        self.predicate = predicate
+
+    def matches(self, info: MessageInfo) -> bool:
+        message = info.message
+        if self.guild_only and message.guild is None:
+            return False
+        if self.dm_only and message.guild is not None:
+            return False
+        if self.ignore_bots and message.author.bot:
+            return False
+        if self.channels is not None and message.channel.id not in self.channels:
+            return False
+        if self.contains and not any(s in info.lower for s in self.contains):
+            return False
+        if self.ignore_commands and info.is_command:
+            return False
+        if self.predicate is not None and not self.predicate(info):
+            return False
+        return True
+
+
+class MessagePipeline:
+    """
+    Parses every message once and hands it to the cogs that subscribed to messages like it.
+    Replaces an ``on_message`` listener per cog, which had every cog look at every message
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.subscriptions: List[Subscription] = []
+
+    def subscribe(self, handler: Callable, **conditions) -> Subscription:
+        """
+        Registers a coroutine that is called with the :class:`MessageInfo` of every matching message
+        :param handler: The coroutine function
+        :param conditions: The keyword arguments of :class:`Subscription`
+        """
+        subscription = Subscription(handler, **conditions)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, owner):
+        """
+        Removes all handlers that are methods of ``owner``, meant for ``cog_unload``
+        """
+        self.subscriptions = [s for s in self.subscriptions if getattr(s.handler, "__self__", None) is not owner]
+
+    def dispatch(self, message: discord.Message) -> MessageInfo:
+        """
+        Schedules every handler the message passes the conditions of, each in its own task like a listener
+        """
+        info = MessageInfo(message, self.bot.command_prefix)
+        for subscription in self.subscriptions:
+            try:
+                matches = subscription.matches(info)
+            except Exception:
+                logger.exception("Message filter of %s failed", subscription.handler.__qualname__)
+                continue
+            if matches:
+                self.bot._schedule_event(subscription.handler, "on_message", info)
+        return info
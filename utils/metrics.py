@@ -0,0 +1,223 @@
+import bisect
+import math
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def lines(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(header + list(self.lines()))
+
+
+class _SimpleMetric(Metric):
+    """
+    One value per label combination, either kept here or read from a callback on every scrape.
+    The callback returns (label values, value) pairs, for numbers that are already counted elsewhere
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def lines(self):
+        values = dict(self.callback()) if self.callback else self.values
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Counter(_SimpleMetric):
+    """
+    Monotonically increasing value per label combination
+    """
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_SimpleMetric):
+    """
+    Value that can go up and down per label combination
+    """
+    type = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    Cumulative bucket counts, sum and count of observed values per label combination
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (+ overflow), sum, count]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def lines(self):
+        for labels, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class Samples(deque):
+    """
+    The most recent observations of a value, for percentiles over a sliding window
+    """
+
+    def __init__(self, size: int):
+        super().__init__(maxlen=size)
+
+    def add(self, value: float):
+        self.append(value)
+
+    def percentile(self, p: float) -> float:
+        """
+        Nearest-rank percentile of the stored samples, 0 if there are none
+        :param p: Percentile between 0 and 100
+        """
+        if not self:
+            return 0.0
+        ordered = sorted(self)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class MetricsRegistry:
+    """
+    Collection of all metrics, rendered in the Prometheus text format
+    """
+
+    def __init__(self, prefix: str = "referee_"):
+        self.prefix = prefix
+        self.metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            # modules imported twice (Referee as __main__ and as module) share their metrics
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None) -> Counter:
+        return self._add(Counter(self.prefix + name, documentation, labelnames, callback))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None) -> Gauge:
+        return self._add(Gauge(self.prefix + name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        return self._add(Histogram(self.prefix + name, documentation, labelnames, buckets or DEFAULT_BUCKETS))
+
+    def render(self) -> str:
+        blocks: List[str] = []
+        for metric in self.metrics.values():
+            try:
+                blocks.append(metric.render())
+            except Exception as e:
+                blocks.append(f"# {metric.name} failed: {_escape(e)}")
+        return "\n".join(blocks) + "\n"
+
+
+def merge_expositions(texts: Dict[str, str], label: str) -> str:
+    """
+    Merges the Prometheus text output of several processes into one, telling their samples apart by a label.
+    The samples of a metric are grouped under a single HELP and TYPE header, as the format requires
+    :param texts: Value of the label -> rendered registry of that process
+    :param label: Name of the label added to every sample
+    """
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for value, text in texts.items():
+        extra = f'{label}="{_escape(value)}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                family = line.split(" ", 3)[2]
+                family_headers = headers.setdefault(family, [])
+                if line not in family_headers:
+                    family_headers.append(line)
+                samples.setdefault(family, [])
+                continue
+            if not line.strip() or line.startswith("#"):
+                continue
+            name, brace, rest = line.partition("{")
+            if brace:
+                line = f"{name}{{{extra}{'' if rest.startswith('}') else ','}{rest}"
+            else:
+                name, _, rest = line.partition(" ")
+                line = f"{name}{{{extra}}} {rest}"
+            samples.setdefault(family or name, []).append(line)
+    return "\n".join("\n".join(headers.get(family, []) + lines) for family, lines in samples.items()) + "\n"
+
+
+registry = MetricsRegistry()
+
+events = registry.counter("events_total", "Gateway events dispatched", ["event"])
+listener_calls = registry.counter("listener_calls_total", "Listener invocations", ["listener"])
+command_duration = registry.histogram("command_duration_seconds", "Time from invocation to completion of commands",
+                                      ["command"])
+command_errors = registry.counter("command_errors_total", "Commands that raised an error", ["command"])
+cache_requests = registry.counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+ratelimit_hits = registry.counter("discord_ratelimit_hits_total", "Discord HTTP rate limits encountered",
+                                  ["kind", "route"])
+ratelimit_wait = registry.counter("discord_ratelimit_wait_seconds_total",
+                                  "Time spent waiting for Discord HTTP rate limits", ["kind", "route"])
@@ -0,0 +1,69 @@
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from utils import metrics
+from utils.perf import perf
+
+logger = logging.getLogger("Referee")
+
+
+class RateLimitRecorder(logging.Filter):
+    """
+    discord.py handles 429 responses inside its HTTP client and only logs them.
+    This filter turns those log records into metrics and lets every record through.
+    Exhausted buckets are recorded from the response headers, see :func:`utils.perf.instrument_http`
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        try:
+            if isinstance(record.msg, str) and record.msg.startswith("We are being rate limited"):
+                retry_after, bucket = float(record.args[0]), record.args[1]
+                route = str(bucket).rsplit(":", 1)[-1]
+                metrics.ratelimit_hits.inc("429", route)
+                metrics.ratelimit_wait.inc("429", route, amount=retry_after)
+                # logged from inside the request, so the request being accounted is still current
+                perf.add_ratelimit(retry_after)
+                logger.warning("Rate limited on %s, retrying in %.2fs", route, retry_after)
+        except Exception as e:
+            logger.debug(f"Could not record rate limit from {record.msg!r}: {e}")
+        return True
+
+
+def install_ratelimit_recorder():
+    """
+    Filters the discord.http logger, whose level stays as configured. The 429 message is logged as a warning
+    """
+    http_logger = logging.getLogger("discord.http")
+    if not any(isinstance(f, RateLimitRecorder) for f in http_logger.filters):
+        http_logger.addFilter(RateLimitRecorder())
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.registry.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def handle_perf(request: web.Request) -> web.Response:
+    return web.Response(text=perf.dump_json(), content_type="application/json")
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """
+    Serves the metrics registry in the Prometheus text format under /metrics
+    and the listener and command timings under /perf
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/perf", handle_perf)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.error(f"Could not start metrics server on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Serving metrics on {host}:{port}/metrics")
+    return runner
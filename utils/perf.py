@@ -0,0 +1,301 @@
+import contextvars
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+from utils.metrics import Samples
+
+current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+# HttpStats of the Discord API request currently running, rate limits logged by discord.py are added to it
+current_request: contextvars.ContextVar = contextvars.ContextVar("current_request", default=None)
+# PendingRequest of the same request, the responses discord.py reads for it are measured into it
+pending_request: contextvars.ContextVar = contextvars.ContextVar("pending_request", default=None)
+
+http_requests = metrics.registry.counter("discord_http_requests_total", "Discord API requests",
+                                         ["source", "route"])
+http_bytes = metrics.registry.counter("discord_http_bytes_total", "Payload bytes of Discord API requests",
+                                      ["source", "route", "direction"])
+
+
+class Span:
+    """
+    One running listener or command. DB and Discord time spent inside it is added up here
+    """
+    __slots__ = ("name", "parent", "db_time", "api_time", "failed")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None):
+        self.name = name
+        self.parent = parent
+        self.db_time = 0.0
+        self.api_time = 0.0
+        self.failed = False
+
+
+class PerfEntry:
+    """
+    Counters and recent durations of one listener or command
+    """
+
+    def __init__(self, history: int):
+        self.calls = 0
+        self.errors = 0
+        self.wall_total = 0.0
+        self.wall = Samples(history)
+        self.db = Samples(history)
+        self.api = Samples(history)
+
+    def record(self, span: Span, wall: float):
+        self.calls += 1
+        self.errors += span.failed
+        self.wall_total += wall
+        self.wall.add(wall)
+        self.db.add(span.db_time)
+        self.api.add(span.api_time)
+
+    def summary(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "wall_total": self.wall_total,
+            "wall_p50": self.wall.percentile(50),
+            "wall_p99": self.wall.percentile(99),
+            "wall_max": max(self.wall, default=0.0),
+            "db_p50": self.db.percentile(50),
+            "db_p99": self.db.percentile(99),
+            "api_p50": self.api.percentile(50),
+            "api_p99": self.api.percentile(99),
+        }
+
+
+class HttpStats:
+    """
+    Discord API requests to one route, caused by one listener or command
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.time = 0.0
+        self.ratelimited = 0
+        self.ratelimit_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class PendingRequest:
+    """
+    Bytes received for the Discord API request currently running, over all its attempts
+    """
+    __slots__ = ("path", "received")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.received = 0
+
+
+def payload_size(payload) -> int:
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, str)):
+        return len(payload)
+    return len(json.dumps(payload, separators=(",", ":"), ensure_ascii=True))
+
+
+def files_size(files) -> int:
+    size = 0
+    for file in files or ():
+        fp = getattr(file, "fp", None)
+        if hasattr(fp, "getbuffer"):
+            size += fp.getbuffer().nbytes
+    return size
+
+
+class PerfRecorder:
+    """
+    Times listeners and commands, including the time they spend waiting for the db and the Discord API
+    """
+
+    def __init__(self, history: int = 500):
+        self.history = history
+        self.entries: Dict[str, PerfEntry] = {}
+        # (listener or command, route) -> requests
+        self.http: Dict[Tuple[str, str], HttpStats] = {}
+        self.started = time.time()
+
+    @contextmanager
+    def span(self, name: str, root: bool = False):
+        """
+        Times the enclosed block as ``name``. Spans nest, db and API time count towards all enclosing spans
+        :param root: Don't nest in the current span, for listeners of events dispatched from within another span
+        """
+        span = Span(name, None if root else current_span.get())
+        token = current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.failed = True
+            raise
+        finally:
+            current_span.reset(token)
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self.entries[name] = PerfEntry(self.history)
+            entry.record(span, time.perf_counter() - start)
+
+    def wrap(self, name: str, coro_func):
+        """
+        Wraps a listener so every call is timed as ``name``
+        """
+        @functools.wraps(coro_func)
+        async def wrapped(*args, **kwargs):
+            with self.span(name, root=True):
+                return await coro_func(*args, **kwargs)
+        return wrapped
+
+    @staticmethod
+    def add_db_time(duration: float):
+        span = current_span.get()
+        while span is not None:
+            span.db_time += duration
+            span = span.parent
+
+    @staticmethod
+    def add_api_time(duration: float):
+        span = current_span.get()
+        while span is not None:
+            span.api_time += duration
+            span = span.parent
+
+    def http_stats(self, source: str, route: str) -> HttpStats:
+        """
+        The request counters of ``route`` for the listener or command ``source``
+        """
+        key = (source, route)
+        stats = self.http.get(key)
+        if stats is None:
+            stats = self.http[key] = HttpStats()
+        return stats
+
+    @staticmethod
+    def add_ratelimit(wait: float):
+        stats = current_request.get()
+        if stats is not None:
+            stats.ratelimited += 1
+            stats.ratelimit_wait += wait
+
+    def summary(self) -> Dict[str, dict]:
+        return {name: entry.summary() for name, entry in self.entries.items()}
+
+    def http_summary(self) -> Dict[str, Dict[str, dict]]:
+        """
+        Request counters by listener or command, then route
+        """
+        summary = {}
+        for (source, route), stats in self.http.items():
+            summary.setdefault(source, {})[route] = stats.as_dict()
+        return summary
+
+    def top_http(self, n: int = 10, key: str = "count") -> List[Tuple[str, str, dict]]:
+        """
+        The ``n`` listener/command and route pairs with the highest value of ``key``
+        """
+        ranked = sorted(self.http.items(), key=lambda x: getattr(x[1], key), reverse=True)[:n]
+        return [(source, route, stats.as_dict()) for (source, route), stats in ranked]
+
+    def top(self, n: int = 10, key: str = "wall_total") -> List[tuple]:
+        """
+        The ``n`` listeners and commands with the highest value of ``key``
+        """
+        return sorted(self.summary().items(), key=lambda x: x[1][key], reverse=True)[:n]
+
+    def dump_json(self) -> str:
+        return json.dumps({"since": self.started, "entries": self.summary(), "http": self.http_summary()},
+                          indent=2, sort_keys=True)
+
+    def reset(self):
+        self.entries.clear()
+        self.http.clear()
+        self.started = time.time()
+
+
+def instrument_http(http):
+    """
+    Wraps :meth:`discord.http.HTTPClient.request`. Every Discord API call is counted for the route
+    and the listener or command that caused it, and its time is added to the current span
+    """
+    if getattr(http.request, "__perf_wrapped__", False):
+        return
+    request = http.request
+
+    @functools.wraps(request)
+    async def accounted_request(route, *args, **kwargs):
+        span = current_span.get()
+        source = span.name if span else "background"
+        route_name = f"{route.method} {route.path}"
+        stats = perf.http_stats(source, route_name)
+        token = current_request.set(stats)
+        pending = PendingRequest(route.path)
+        pending_token = pending_request.set(pending)
+        sent = payload_size(kwargs.get("json")) + files_size(kwargs.get("files"))
+        start = time.perf_counter()
+        try:
+            return await request(route, *args, **kwargs)
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            current_request.reset(token)
+            pending_request.reset(pending_token)
+            received = pending.received
+            stats.count += 1
+            stats.time += duration
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+            http_requests.inc(source, route_name)
+            http_bytes.inc(source, route_name, "sent", amount=sent)
+            http_bytes.inc(source, route_name, "received", amount=received)
+            perf.add_api_time(duration)
+
+    accounted_request.__perf_wrapped__ = True
+    http.request = accounted_request
+    _instrument_responses(sys.modules.get(type(http).__module__))
+
+
+def _instrument_responses(module):
+    """
+    Wraps ``json_or_text`` of discord.http, which reads the body of every API response.
+    Counts the received bytes of the body it read, and records rate limit buckets the response exhausted,
+    which discord.py waits for but only logs at debug level
+    """
+    json_or_text = getattr(module, "json_or_text", None)
+    if json_or_text is None or getattr(json_or_text, "__perf_wrapped__", False):
+        return
+
+    @functools.wraps(json_or_text)
+    async def measured_json_or_text(response):
+        data = await json_or_text(response)
+        pending = pending_request.get()
+        if pending is not None:
+            # the body is cached on the response once read, this neither reads nor decodes it again
+            pending.received += len(await response.read())
+            if response.headers.get("X-Ratelimit-Remaining") == "0" and response.status != 429:
+                retry_after = float(response.headers.get("X-Ratelimit-Reset-After", 0))
+                metrics.ratelimit_hits.inc("bucket", pending.path)
+                metrics.ratelimit_wait.inc("bucket", pending.path, amount=retry_after)
+                perf.add_ratelimit(retry_after)
+        return data
+
+    measured_json_or_text.__perf_wrapped__ = True
+    module.json_or_text = measured_json_or_text
+
+
+perf = PerfRecorder()
@@ -0,0 +1,272 @@
+import asyncio
+import importlib
+import itertools
+import logging
+import os
+import pickle
+import signal
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing.connection import Connection
+from typing import Callable, Dict, Optional, Union
+
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TASK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+tasks = metrics.registry.counter("process_pool_tasks_total", "Tasks run in the process pool", ["task", "result"])
+task_duration = metrics.registry.histogram("process_pool_task_seconds",
+                                           "Time from handing a task to a worker to getting its result", ["task"],
+                                           buckets=TASK_BUCKETS)
+queue_wait = metrics.registry.histogram("process_pool_queue_seconds", "Time tasks waited for an idle worker",
+                                        ["task"], buckets=TASK_BUCKETS)
+worker_replacements = metrics.registry.counter("process_pool_worker_replacements_total",
+                                               "Workers replaced, by reason", ["reason"])
+
+
+class TaskTimeout(asyncio.TimeoutError):
+    """
+    The task ran longer than its timeout, its worker was killed
+    """
+
+
+class WorkerCrashed(RuntimeError):
+    """
+    The worker died while running the task, e.g. killed by the OOM killer
+    """
+
+
+class Worker:
+    """
+    A python process running the tasks of the pool one at a time, see :func:`worker_main`
+    """
+
+    def __init__(self, index: int, memory_limit: int):
+        parent_sock, child_sock = socket.socketpair()
+        # a fresh interpreter instead of a fork of the bot, workers must not inherit its loop, threads or sockets
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "utils.process_pool", str(child_sock.fileno()), str(memory_limit)],
+            pass_fds=(child_sock.fileno(),), stdin=subprocess.DEVNULL, cwd=ROOT)
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.index = index
+        self.tasks = 0
+        self.current: Optional[asyncio.Future] = None
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.conn.close()
+
+
+class ProcessPool:
+    """
+    A few worker processes shared by all cogs for work that would otherwise hold the event loop:
+    image rendering, user supplied regexes, calculations. Tasks are module level functions that take
+    and return plain, picklable data. A task that times out or is cancelled gets its worker killed and replaced,
+    so a runaway regex can't keep a worker busy forever
+    """
+
+    def __init__(self, workers: int, timeout: float, memory_limit: int = 0, max_tasks_per_worker: int = 0):
+        """
+        :param workers: Number of worker processes
+        :param timeout: Default seconds a task may run
+        :param memory_limit: Address space limit of a worker in MB, 0 for none
+        :param max_tasks_per_worker: Tasks after which a worker is replaced, 0 to keep it forever
+        """
+        self.size = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.workers: Dict[int, Worker] = {}
+        self.busy = 0
+        self._idle: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task_ids = itertools.count()
+        self._indices = itertools.count()
+
+    @property
+    def started(self) -> bool:
+        return self._idle is not None
+
+    def start(self):
+        """
+        Starts the workers, done by the first :meth:`submit` if not called before
+        """
+        if self.started:
+            return
+        self._loop = asyncio.get_event_loop()
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._spawn()
+        logger.info(f"Started {self.size} process pool workers")
+
+    def _spawn(self):
+        worker = Worker(next(self._indices), self.memory_limit)
+        self.workers[worker.index] = worker
+        self._loop.add_reader(worker.conn.fileno(), self._on_readable, worker)
+        self._idle.put_nowait(worker)
+
+    def _replace(self, worker: Worker, reason: str):
+        self._loop.remove_reader(worker.conn.fileno())
+        worker.kill()
+        del self.workers[worker.index]
+        worker_replacements.inc(reason)
+        if self.started:
+            self._spawn()
+
+    def _on_readable(self, worker: Worker):
+        try:
+            ok, result = worker.conn.recv()
+        except (EOFError, OSError):
+            self._loop.remove_reader(worker.conn.fileno())
+            logger.error(f"Process pool worker {worker.process.pid} died")
+            if worker.current is not None and not worker.current.done():
+                worker.current.set_exception(WorkerCrashed("The process pool worker running the task died"))
+            if worker.current is None:
+                # died while idle, it is still waiting in the idle queue and gets skipped there
+                self._replace(worker, "crashed")
+            return
+        if worker.current is not None and not worker.current.done():
+            if ok:
+                worker.current.set_result(result)
+            else:
+                worker.current.set_exception(result)
+
+    async def _get_idle(self) -> Worker:
+        while True:
+            worker = await self._idle.get()
+            if worker.index in self.workers:
+                return worker
+
+    async def submit(self, fn: Union[Callable, str], *args, timeout: float = None, name: str = None, **kwargs):
+        """
+        Runs ``fn(*args, **kwargs)`` in a worker and returns its result, exceptions raised by it are raised here.
+        :param fn: A module level function, or its "module:function" name, so the bot doesn't have to import
+                   modules only the task needs
+        :param timeout: Seconds the task may run, defaults to the pools timeout
+        :param name: Name of the task in the metrics, defaults to the name of the function
+        :raises TaskTimeout: If the task took longer than ``timeout``
+        :raises WorkerCrashed: If the worker died while running the task
+        """
+        if not self.started:
+            self.start()
+        if name is None:
+            name = fn.rsplit(":", 1)[-1] if isinstance(fn, str) else getattr(fn, "__name__", repr(fn))
+        timeout = self.timeout if timeout is None else timeout
+
+        queued = time.perf_counter()
+        worker = await self._get_idle()
+        start = time.perf_counter()
+        queue_wait.observe(start - queued, name)
+
+        worker.current = self._loop.create_future()
+        self.busy += 1
+        reason = None
+        try:
+            worker.conn.send((next(self._task_ids), fn, args, kwargs))
+            result = await asyncio.wait_for(asyncio.shield(worker.current), timeout)
+        except asyncio.TimeoutError:
+            tasks.inc(name, "timeout")
+            reason = "timeout"
+            logger.warning("Process pool task %s took longer than %.1fs, killing its worker", name, timeout)
+            raise TaskTimeout(f"{name} took longer than {timeout:.1f}s")
+        except asyncio.CancelledError:
+            tasks.inc(name, "cancelled")
+            reason = "cancelled"
+            raise
+        except WorkerCrashed:
+            tasks.inc(name, "crashed")
+            reason = "crashed"
+            raise
+        except MemoryError:
+            tasks.inc(name, "memory")
+            # what's left of the workers heap after a MemoryError isn't worth keeping
+            reason = "memory"
+            raise
+        except Exception:
+            tasks.inc(name, "error")
+            raise
+        else:
+            tasks.inc(name, "ok")
+            return result
+        finally:
+            task_duration.observe(time.perf_counter() - start, name)
+            self.busy -= 1
+            worker.current = None
+            worker.tasks += 1
+            if reason is None and self.max_tasks_per_worker and worker.tasks >= self.max_tasks_per_worker:
+                reason = "recycled"
+            if reason is not None:
+                self._replace(worker, reason)
+            else:
+                self._idle.put_nowait(worker)
+
+    def shutdown(self):
+        """
+        Kills all workers. Submitting starts new ones
+        """
+        if not self.started:
+            return
+        self._idle = None
+        for worker in list(self.workers.values()):
+            self._replace(worker, "shutdown")
+        logger.info("Stopped the process pool workers")
+
+
+def _resolve(fn: Union[Callable, str]) -> Callable:
+    if isinstance(fn, str):
+        module, _, function = fn.partition(":")
+        return getattr(importlib.import_module(module), function)
+    return fn
+
+
+def worker_main(fd: int, memory_limit: int):
+    """
+    Runs in the worker process: receives (id, function, args, kwargs) and sends back (ok, result or exception)
+    until the bot closes the connection
+    """
+    # Ctrl+C reaches the whole process group, the bot decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        import resource
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    conn = Connection(fd)
+    while True:
+        try:
+            task_id, fn, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = (True, _resolve(fn)(*args, **kwargs))
+        except BaseException as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            conn.send((False, RuntimeError(f"Result of {fn} can't be sent back: {e}")))
+        except (EOFError, OSError):
+            return
+
+
+def _pool_from_config() -> ProcessPool:
+    from config.config import ProcessPool as pool_config
+    return ProcessPool(workers=pool_config.workers, timeout=pool_config.task_timeout,
+                       memory_limit=pool_config.memory_limit, max_tasks_per_worker=pool_config.max_tasks_per_worker)
+
+
+if __name__ == "__main__":
+    worker_main(int(sys.argv[1]), int(sys.argv[2]))
+else:
+    process_pool = _pool_from_config()
+    metrics.registry.gauge("process_pool_workers", "Running process pool workers",
+                           callback=lambda: [((), len(process_pool.workers))])
+    metrics.registry.gauge("process_pool_busy_workers", "Process pool workers running a task",
+                           callback=lambda: [((), process_pool.busy)])
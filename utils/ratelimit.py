@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Hashable, Optional
+
+
+class KeyedLimiter:
+    """
+    Rate limiter per key (user id, pair of user ids, ...) using the generic cell rate algorithm.
+    Each key only stores the theoretical arrival time (TAT) of its next event, so checks are O(1).
+    Keys whose TAT has passed are indistinguishable from new keys and get evicted,
+    and at most ``max_keys`` are kept, evicting the least recently used ones
+
+    Allows ``burst`` events at once and ``rate`` events per ``period`` seconds on average
+    """
+
+    def __init__(self, rate: float, period: float, burst: int = 1, max_keys: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.emission_interval = period / rate
+        self.tolerance = self.emission_interval * (burst - 1)
+        self.max_keys = max_keys
+        self.clock = clock
+        self._tat: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._tat)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        Whether ``key`` is currently limited
+        """
+        return self.retry_after(key) > 0
+
+    def _evict(self, now: float):
+        # the least recently used keys are checked first, two per call keeps up with any rate of new keys
+        for _ in range(2):
+            if not self._tat:
+                return
+            key, tat = next(iter(self._tat.items()))
+            if tat > now and len(self._tat) <= self.max_keys:
+                return
+            del self._tat[key]
+
+    def retry_after(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Seconds until the next event for ``key`` would be allowed, 0 if it would be allowed now
+        """
+        now = self.clock() if now is None else now
+        tat = self._tat.get(key)
+        if tat is None:
+            return 0.0
+        return max(0.0, tat - self.tolerance - now)
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """
+        Records an event for ``key`` if it is allowed
+        :param now: Time of the event on the limiters clock, for replaying past events
+        :return: Whether the event was allowed
+        """
+        now = self.clock() if now is None else now
+        tat = self._tat.get(key)
+        if tat is None or tat < now:
+            tat = now
+        elif tat - self.tolerance > now:
+            return False
+        self._tat[key] = tat + self.emission_interval
+        self._tat.move_to_end(key)
+        self._evict(now)
+        return True
+
+    def reset(self, key: Hashable = None):
+        """
+        Forgets ``key``, or all keys
+        """
+        if key is None:
+            self._tat.clear()
+        else:
+            self._tat.pop(key, None)
+
+
+class WindowLimiter:
+    """
+    Limits keys to ``limit`` events in any ``period`` seconds, a sliding window.
+    Only the last ``limit`` events of a key are kept: a key is limited while the oldest of them is in the window.
+    Keys without events in the window are evicted like in :class:`KeyedLimiter`
+    """
+
+    def __init__(self, limit: int, period: float, max_keys: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit = limit
+        self.period = period
+        self.max_keys = max_keys
+        self.clock = clock
+        self._events: "OrderedDict[Hashable, deque]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._events)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        Whether ``key`` is currently limited
+        """
+        return self.retry_after(key) > 0
+
+    def _evict(self, now: float):
+        for _ in range(2):
+            if not self._events:
+                return
+            key, events = next(iter(self._events.items()))
+            if events[-1] + self.period > now and len(self._events) <= self.max_keys:
+                return
+            del self._events[key]
+
+    def retry_after(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Seconds until the next event for ``key`` would be allowed, 0 if it would be allowed now
+        """
+        now = self.clock() if now is None else now
+        events = self._events.get(key)
+        if events is None or len(events) < self.limit:
+            return 0.0
+        return max(0.0, events[0] + self.period - now)
+
+    def add(self, key: Hashable, now: Optional[float] = None):
+        """
+        Records an event for ``key``, even if it is limited. Events past the limit keep it limited for longer
+        :param now: Time of the event on the limiters clock, for replaying past events
+        """
+        now = self.clock() if now is None else now
+        events = self._events.get(key)
+        if events is None:
+            events = self._events[key] = deque(maxlen=self.limit)
+        events.append(now)
+        self._events.move_to_end(key)
+        self._evict(now)
+
+    def reset(self, key: Hashable = None):
+        """
+        Forgets ``key``, or all keys
+        """
+        if key is None:
+            self._events.clear()
+        else:
+            self._events.pop(key, None)
@@ -0,0 +1,237 @@
+import asyncio
+import inspect
+import logging
+import math
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from utils import metrics
+from utils.metrics import Samples
+from utils.perf import perf
+
+logger = logging.getLogger("Referee")
+
+job_runs = metrics.registry.counter("job_runs_total", "Runs of scheduled jobs", ["job", "result"])
+job_duration = metrics.registry.histogram("job_duration_seconds", "Runtime of scheduled jobs", ["job"],
+                                          buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+
+class Timer:
+    """
+    A callback due at a tick of the wheel
+    """
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline: int, callback: Callable, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Job:
+    """
+    A coroutine function run every ``interval`` seconds, plus up to ``jitter`` random seconds.
+    A run that is due while the previous one is still going is skipped, unless ``overlap`` is set
+    """
+
+    def __init__(self, scheduler: "Scheduler", name: str, interval: float, func: Callable,
+                 jitter: float = 0, overlap: bool = False):
+        self.scheduler = scheduler
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+        self.overlap = overlap
+        self.timer: Optional[Timer] = None
+        self.running: List[asyncio.Task] = []
+        self.cancelled = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_run: Optional[float] = None
+        self.durations = Samples(100)
+
+    def schedule(self, delay: float):
+        if not self.cancelled:
+            self.timer = self.scheduler.call_later(delay, self._due)
+
+    def next_delay(self) -> float:
+        return self.interval + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def _due(self):
+        self.schedule(self.next_delay())
+        if self.running and not self.overlap:
+            self.skipped += 1
+            job_runs.inc(self.name, "skipped")
+            logger.warning("Skipped job %s, previous run is still going", self.name)
+            return
+        task = asyncio.ensure_future(self._run())
+        task.set_name(f"job:{self.name}")
+        self.running.append(task)
+        task.add_done_callback(self.running.remove)
+
+    async def _run(self):
+        start = time.perf_counter()
+        self.last_run = time.time()
+        result = "ok"
+        try:
+            with perf.span(f"job:{self.name}", root=True):
+                await self.func()
+        except asyncio.CancelledError:
+            result = "cancelled"
+            raise
+        except Exception:
+            result = "failed"
+            self.failures += 1
+            logger.exception("Job %s failed", self.name)
+        finally:
+            duration = time.perf_counter() - start
+            self.runs += 1
+            self.durations.add(duration)
+            job_runs.inc(self.name, result)
+            job_duration.observe(duration, self.name)
+
+    def cancel(self, running: bool = False):
+        """
+        Stops future runs, ``running`` also cancels the current run
+        """
+        self.cancelled = True
+        if self.timer is not None:
+            self.timer.cancel()
+        if running:
+            for task in self.running:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "running": len(self.running),
+            "last_run": self.last_run,
+            "duration_p50": self.durations.percentile(50),
+            "duration_max": max(self.durations, default=0.0),
+        }
+
+
+class Scheduler:
+    """
+    Hashed timing wheel for one-shot timers and periodic jobs.
+    A single task advances the wheel by one slot per ``resolution`` seconds and fires the timers in that slot
+    whose deadline has come, instead of every background loop keeping a sleeping task of its own.
+    The task exits when no timers are left and is restarted by the next one
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution
+        self.wheel: List[List[Timer]] = [[] for _ in range(slots)]
+        self.jobs: Dict[str, Job] = {}
+        self.tick = 0
+        self.pending = 0
+        self._origin: Optional[float] = None
+        self._driver: Optional[asyncio.Task] = None
+
+    def _current_tick(self) -> int:
+        loop = asyncio.get_event_loop()
+        if self._origin is None:
+            self._origin = loop.time()
+        return int((loop.time() - self._origin) / self.resolution)
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        """
+        Calls ``callback(*args)`` after ``delay`` seconds, rounded up to the resolution of the wheel.
+        Coroutines returned by the callback are run as tasks
+        :return: The :class:`Timer`, which can be cancelled
+        """
+        now = self._current_tick()
+        if self._driver is None:
+            self.tick = now
+        # from the current time rather than self.tick, the last tick fired, which may be most of a tick behind
+        deadline = max(now + 1, math.ceil((asyncio.get_event_loop().time() - self._origin + delay) / self.resolution))
+        timer = Timer(deadline, callback, args)
+        self.wheel[timer.deadline % len(self.wheel)].append(timer)
+        self.pending += 1
+        if self._driver is None:
+            self._driver = asyncio.ensure_future(self._drive())
+            self._driver.set_name("scheduler")
+        return timer
+
+    def every(self, name: str, interval: float, func: Callable, jitter: float = 0, first_delay: float = 0,
+              overlap: bool = False) -> Job:
+        """
+        Runs the coroutine function ``func`` periodically. A job registered under a name that is already in use
+        replaces the old one, so this can be called from on_ready, which runs again after reconnects
+        :param name: Name of the job, used for cancellation, logs and metrics
+        :param interval: Seconds between the start of two runs
+        :param jitter: Up to this many seconds are randomly added to each interval
+        :param first_delay: Seconds until the first run
+        :param overlap: Whether a run may start while the previous one is still going
+        """
+        self.cancel(name)
+        job = self.jobs[name] = Job(self, name, interval, func, jitter=jitter, overlap=overlap)
+        job.schedule(first_delay)
+        return job
+
+    def cancel(self, name: str, running: bool = False):
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancel(running=running)
+
+    def cancel_owner(self, owner):
+        """
+        Cancels all jobs that run methods of ``owner``, meant for ``cog_unload``
+        """
+        for name, job in list(self.jobs.items()):
+            if getattr(job.func, "__self__", None) is owner:
+                self.cancel(name, running=True)
+
+    async def _drive(self):
+        try:
+            while self.pending:
+                # next tick boundary, measured from the origin so the wheel doesn't drift
+                next_at = self._origin + (self.tick + 1) * self.resolution
+                await asyncio.sleep(max(0.0, next_at - asyncio.get_event_loop().time()))
+                now = self._current_tick()
+                # a blocked loop may have skipped ticks, a full turn covers every slot
+                last = min(now, self.tick + len(self.wheel))
+                for tick in range(self.tick + 1, last + 1):
+                    # timers added by callbacks are placed after the tick being fired
+                    self.tick = tick
+                    self._fire_slot(tick % len(self.wheel), now)
+                self.tick = now
+        finally:
+            self._driver = None
+
+    def _fire_slot(self, slot: int, now: int):
+        due, waiting = [], []
+        for timer in self.wheel[slot]:
+            if timer.cancelled:
+                self.pending -= 1
+            elif timer.deadline <= now:
+                due.append(timer)
+            else:
+                waiting.append(timer)
+        self.wheel[slot] = waiting
+        for timer in due:
+            self.pending -= 1
+            try:
+                result = timer.callback(*timer.args)
+                if inspect.isawaitable(result):
+                    asyncio.ensure_future(result)
+            except Exception:
+                logger.exception("Timer callback %s failed", getattr(timer.callback, "__qualname__", timer.callback))
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+scheduler = Scheduler()
+
+metrics.registry.gauge("scheduler_pending_timers", "Timers waiting in the scheduler wheel",
+                       callback=lambda: [((), scheduler.pending)])
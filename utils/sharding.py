@@ -0,0 +1,57 @@
+import os
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+ENV_WORKER = "REFEREE_WORKER"
+ENV_SHARD_IDS = "REFEREE_SHARD_IDS"
+ENV_SHARD_COUNT = "REFEREE_SHARD_COUNT"
+ENV_METRICS_PORT = "REFEREE_METRICS_PORT"
+
+
+class ShardAssignment(NamedTuple):
+    """
+    The shards one worker process of the launcher connects to.
+    Handed to the worker through environment variables, since the bot is created when Referee is imported
+    """
+    worker: int
+    shard_ids: Tuple[int, ...]
+    shard_count: int
+    metrics_port: int
+
+    def to_env(self) -> Dict[str, str]:
+        return {
+            ENV_WORKER: str(self.worker),
+            ENV_SHARD_IDS: ",".join(str(i) for i in self.shard_ids),
+            ENV_SHARD_COUNT: str(self.shard_count),
+            ENV_METRICS_PORT: str(self.metrics_port),
+        }
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> Optional["ShardAssignment"]:
+        """
+        :return: The assignment of this process, None if it wasn't started by the launcher
+        """
+        if ENV_SHARD_IDS not in environ:
+            return None
+        return cls(worker=int(environ[ENV_WORKER]),
+                   shard_ids=tuple(int(i) for i in environ[ENV_SHARD_IDS].split(",")),
+                   shard_count=int(environ[ENV_SHARD_COUNT]),
+                   metrics_port=int(environ[ENV_METRICS_PORT]))
+
+    @property
+    def name(self) -> str:
+        return f"worker {self.worker} (shards {self.shard_ids[0]}-{self.shard_ids[-1]} of {self.shard_count})"
+
+
+def split_shards(shard_count: int, workers: int) -> List[Tuple[int, ...]]:
+    """
+    Splits the shards into contiguous ranges of nearly equal size, one per worker
+    """
+    workers = max(1, min(workers, shard_count))
+    size, larger = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for worker in range(workers):
+        end = start + size + (1 if worker < larger else 0)
+        ranges.append(tuple(range(start, end)))
+        start = end
+    return ranges
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from utils import metrics
+
+logger = logging.getLogger("Referee")
+
+ready_events = metrics.registry.counter("ready_events_total", "READY and RESUMED events received", ["kind"])
+
+
+class StartupStep:
+    """
+    The hooks of one cog and how long its warm up took
+    """
+
+    def __init__(self, name: str, warm_up: Optional[Callable] = None, ready: Optional[Callable] = None):
+        self.name = name
+        self.warm_up = warm_up
+        self.ready = ready
+        self.duration: Optional[float] = None
+        self.error: Optional[BaseException] = None
+
+
+class Startup:
+    """
+    Runs the setup of the cogs when the bot becomes ready.
+    discord.py dispatches on_ready again whenever the gateway had to start a new session,
+    so setup is split in two parts:
+    ``ready`` hooks rebind cached references (guild, channels) on every ready and have to be cheap,
+    ``warm_up`` hooks load caches and start jobs and run exactly once per process, concurrently
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, StartupStep] = {}
+        self.ready_count = 0
+        self.resumed_count = 0
+        self.warmed_up = False
+        self.duration: Optional[float] = None
+        self._warm_up_task: Optional[asyncio.Future] = None
+
+    def register(self, name: str, warm_up: Callable = None, ready: Callable = None):
+        """
+        Adds the setup of a cog, replacing an earlier one of the same name.
+        Registered after startup, e.g. by a reloaded extension, both hooks are run right away
+        :param name: Name of the step, used in logs
+        :param warm_up: Coroutine function run once per process, after the ready hooks
+        :param ready: Coroutine function run on every ready, before the warm ups
+        """
+        step = self.steps[name] = StartupStep(name, warm_up=warm_up, ready=ready)
+        if self.warmed_up:
+            asyncio.ensure_future(self._run_late(step))
+
+    async def _run_late(self, step: StartupStep):
+        if step.ready:
+            await step.ready()
+        await self._warm_up(step)
+
+    async def on_ready(self) -> bool:
+        """
+        Runs all ready hooks, and all warm ups on the first ready.
+        A ready dispatched while the warm ups still run waits for them instead of starting them again
+        :return: Whether this was the first ready of the process
+        """
+        self.ready_count += 1
+        first = self._warm_up_task is None
+        ready_events.inc("first_ready" if first else "ready")
+        if first:
+            # claimed before anything is awaited, steps registered from here on are run by register
+            self.warmed_up = True
+            steps = list(self.steps.values())
+            self._warm_up_task = asyncio.ensure_future(self._start(steps))
+            await asyncio.shield(self._warm_up_task)
+            return True
+
+        await self._run_ready_hooks(list(self.steps.values()))
+        await asyncio.shield(self._warm_up_task)
+        logger.info("Ready again (#%d), skipping warm ups", self.ready_count)
+        return False
+
+    async def _start(self, steps: List[StartupStep]):
+        await self._run_ready_hooks(steps)
+        start = time.perf_counter()
+        steps = [s for s in steps if s.warm_up]
+        await asyncio.gather(*(self._warm_up(s) for s in steps))
+        self.duration = time.perf_counter() - start
+        failed = [s.name for s in steps if s.error]
+        logger.info("Warmed up %d/%d cogs in %.3fs%s", len(steps) - len(failed), len(steps), self.duration,
+                    f", failed: {', '.join(failed)}" if failed else "")
+
+    @staticmethod
+    async def _run_ready_hooks(steps: List[StartupStep]):
+        for step in steps:
+            if step.ready:
+                try:
+                    await step.ready()
+                except Exception:
+                    logger.exception("Ready hook of %s failed", step.name)
+
+    def on_resumed(self):
+        self.resumed_count += 1
+        ready_events.inc("resumed")
+        logger.info("Resumed session (#%d)", self.resumed_count)
+
+    @staticmethod
+    async def _warm_up(step: StartupStep):
+        if not step.warm_up:
+            return
+        start = time.perf_counter()
+        try:
+            await step.warm_up()
+        except Exception as e:
+            step.error = e
+            logger.exception("Warm up of %s failed", step.name)
+        step.duration = time.perf_counter() - start
+        logger.info("Warmed up %s in %.3fs", step.name, step.duration)
+
+    def timings(self) -> Dict[str, Optional[float]]:
+        return {name: step.duration for name, step in self.steps.items() if step.warm_up}
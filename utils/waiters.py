@@ -0,0 +1,52 @@
+import asyncio
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+import discord
+
+
+class ReactionWaiters:
+    """
+    Futures waiting for a user to react to a message with one of a few emojis.
+    Unlike ``bot.wait_for('reaction_add', check=...)``, which runs every pending check on every reaction,
+    a reaction only looks up the waiters registered for its message and user
+    """
+
+    def __init__(self):
+        self._waiters: Dict[Tuple[int, int], List[Tuple[FrozenSet[str], asyncio.Future]]] = {}
+
+    def __len__(self):
+        return sum(len(w) for w in self._waiters.values())
+
+    async def wait(self, message_id: int, user_id: int, emojis: Iterable, timeout: float = None) -> str:
+        """
+        Waits for ``user_id`` to add one of ``emojis`` to the message
+        :param message_id: The discord id of the message
+        :param user_id: The discord id of the user that is expected to react
+        :param emojis: Unicode emojis or :class:`discord.Emoji`, compared as strings
+        :param timeout: Seconds until :class:`asyncio.TimeoutError` is raised, like ``bot.wait_for``
+        :return: The emoji that was added, as string
+        """
+        key = (message_id, user_id)
+        entry = (frozenset(str(e) for e in emojis), asyncio.get_event_loop().create_future())
+        self._waiters.setdefault(key, []).append(entry)
+        try:
+            return await asyncio.wait_for(entry[1], timeout=timeout)
+        finally:
+            waiting = self._waiters.get(key)
+            if waiting is not None:
+                if entry in waiting:
+                    waiting.remove(entry)
+                if not waiting:
+                    del self._waiters[key]
+
+    def resolve(self, payload: discord.RawReactionActionEvent):
+        """
+        Completes the waiters a reaction was expected by, called for every raw reaction
+        """
+        waiting = self._waiters.get((payload.message_id, payload.user_id))
+        if not waiting:
+            return
+        reaction = str(payload.emoji)
+        for emojis, future in waiting:
+            if reaction in emojis and not future.done():
+                future.set_result(reaction)